@@ -1,23 +1,62 @@
 import os
+import sys
+import atexit
 import asyncio
 import logging
 import json
+import base64
 import re
 import secrets
 import time
+import math
 from io import BytesIO
 from collections import defaultdict
-from functools import wraps
-import subprocess
-import tempfile
+from functools import wraps, lru_cache
 import threading
+import hashlib
+import itertools
+import random
+import signal
+import socket
+import multiprocessing
+import multiprocessing.connection
+import shutil
+import tempfile
+import zipfile
+import ssl
+import uuid
+from collections import OrderedDict, deque
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from xml.sax.saxutils import escape, unescape
 
+import aiohttp
+import certifi
 import edge_tts
-from flask import Flask, request, jsonify, render_template, send_file, session, redirect, url_for, Response
+from flask import Flask, request, jsonify, render_template, send_file, session, redirect, url_for, Response, g
 from flask_cors import CORS
+from werkzeug.serving import is_running_from_reloader, make_server
 from dotenv import load_dotenv
+from asgiref.sync import sync_to_async
 import emoji
 
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+try:
+    # Building blocks of edge_tts.Communicate, reused by the upstream connection pool
+    from edge_tts.communicate import (
+        connect_id, date_to_string, mkssml, remove_incompatible_characters, split_text_by_byte_length,
+        ssml_headers_plus_data)
+    from edge_tts.constants import SEC_MS_GEC_VERSION, WSS_HEADERS, WSS_URL
+    from edge_tts.data_classes import TTSConfig
+    from edge_tts.drm import DRM
+except ImportError:
+    TTSConfig = None
+
 # --- 配置和初始化 ---
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
@@ -31,42 +70,1868 @@ CONFIG_FILE = 'config.json'
 VOICES_LIST_FILE = os.path.join('tts_data', 'voices_list.txt')
 LOCALES_MAP_FILE = os.path.join('tts_data', 'locales_map.json')
 config = {}
-ALL_VOICES = []
 SUPPORTED_LOCALES = {}
 MAX_CONCURRENT_REQUESTS = 20
 CHUNK_SIZE = 300
 SYNC_CHUNKS = 1
+AUDIO_CACHE_DIR = os.path.join('tts_data', 'audio_cache')
+AUDIO_CACHE_MAX_BYTES = 256 * 1024 * 1024
+TRANSCODE_CACHE_DIR = os.path.join('tts_data', 'transcode_cache')
+TRANSCODE_CACHE_MAX_BYTES = 128 * 1024 * 1024
+JOBS_DIR = os.path.join('tts_data', 'jobs')
+BATCH_MAX_ITEMS = 1000
+# Worker threads the ASGI bridge uses to run Flask request dispatch
+ASGI_DISPATCH_THREADS = 64
+# Raw characters cleaned per step when streaming text ingestion is used
+STREAM_INGEST_BLOCK_SIZE = 4000
+# Repeated sentences at least this long get a chunk of their own so their audio is reused
+REPEATED_SENTENCE_MIN_LEN = 24
+# Complete responses larger than this are spooled to a temp file instead of memory
+OUTPUT_SPOOL_THRESHOLD = 8 * 1024 * 1024
+# Audio a streaming response may hold ahead of the client before scheduling pauses
+STREAM_BUFFER_MAX_BYTES = 16 * 1024 * 1024
+# Chunks a streaming response synthesizes ahead of the one being sent (0 = no limit)
+STREAM_LOOKAHEAD_CHUNKS = 0
+# Log every request span as a JSON line on the "tts.trace" logger
+TRACE_LOG_SPANS = True
+# Range the on-demand sampling profiler's duration and sampling interval are clamped to (seconds)
+PROFILE_MIN_SECONDS = 0.1
+PROFILE_MAX_SECONDS = 60
+PROFILE_MIN_INTERVAL = 0.001
+PROFILE_MAX_INTERVAL = 1.0
+
+# Seconds between checks of config.json for changes made by other workers
+CONFIG_RELOAD_INTERVAL = 1.0
+_config_mtime = None
+_config_checked_at = 0.0
+# Index of this worker process in multi-worker mode (None when single-process)
+WORKER_INDEX = None
 
 # Global event loop for streaming tasks
 STREAM_LOOP = asyncio.new_event_loop()
 _loop_thread = threading.Thread(target=STREAM_LOOP.run_forever, daemon=True)
 _loop_thread.start()
 
-async def generate_silence_bytes(duration: float = 0.2) -> bytes:
-    cmd = [
-        "ffmpeg",
-        "-f",
-        "lavfi",
-        "-i",
-        "anullsrc=r=24000:cl=mono",
-        "-t",
-        str(duration),
-        "-q:a",
-        "9",
-        "-f",
-        "mp3",
-        "pipe:1",
-    ]
-    process = await asyncio.create_subprocess_exec(
-        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await process.communicate()
-    if process.returncode != 0:
-        logger.error(
-            f"FFmpeg failed to generate silence.\n{stderr.decode(errors='ignore')}"
-        )
-        return b""
-    return stdout
+
+# --- 监控指标 ---
+def _escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metric:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _format_labels(self, key: tuple, extra: dict | None = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs: return ""
+        return "{" + ",".join(f'{n}="{_escape_label_value(v)}"' for n, v in pairs) + "}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = defaultdict(float)
+
+    def inc(self, amount: float = 1.0, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._format_labels(k), v) for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Value read from a callback at scrape time (exported as ``kind``)."""
+
+    def __init__(self, name, documentation, callback, kind="gauge"):
+        super().__init__(name, documentation)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self):
+        return [(self.name, "", float(self.callback()))]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    out.append((f"{self.name}_bucket", self._format_labels(key, {"le": repr(float(bound))}), cumulative))
+                out.append((f"{self.name}_bucket", self._format_labels(key, {"le": "+Inf"}), count))
+                out.append((f"{self.name}_sum", self._format_labels(key), total))
+                out.append((f"{self.name}_count", self._format_labels(key), count))
+        return out
+
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format registry; no client library required."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, kind="gauge"):
+        return self.register(Gauge(name, documentation, callback, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+_SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+METRIC_REQUESTS = metrics.counter("tts_requests_total", "Speech requests received.", ("voice", "mode"))
+METRIC_REQUEST_SECONDS = metrics.histogram("tts_request_seconds", "End-to-end generation time per request.", ("voice", "mode"))
+METRIC_PREPROCESS_SECONDS = metrics.histogram("tts_preprocess_seconds", "Text cleaning time per request.", ("voice", "mode"))
+METRIC_SPLIT_SECONDS = metrics.histogram("tts_split_seconds", "Text chunking time per request.", ("voice", "mode"))
+METRIC_CHUNKS = metrics.counter("tts_chunks_total", "Chunks processed by result (ok, cached, reused, coalesced, failed, cancelled).", ("voice", "mode", "result"))
+METRIC_UPSTREAM_SECONDS = metrics.histogram("tts_upstream_seconds", "Duration of successful upstream synthesis attempts per chunk.", ("voice", "mode"))
+METRIC_RETRIES = metrics.counter("tts_upstream_retries_total", "Failed upstream attempts that were retried or gave up.", ("voice", "mode"))
+METRIC_SLOT_WAIT_SECONDS = metrics.histogram("tts_slot_wait_seconds", "Time spent waiting for an upstream concurrency slot.", ("voice", "mode"))
+METRIC_STITCH_SECONDS = metrics.histogram("tts_stitch_seconds", "MP3 stitching time per request.", ("voice", "mode"))
+METRIC_BYTES_OUT = metrics.counter("tts_bytes_out_total", "Audio bytes returned to clients.", ("voice", "mode"))
+METRIC_STREAM_TTFB_SECONDS = metrics.histogram("tts_stream_ttfb_seconds", "Time to first audio byte of streaming responses.", ("voice",))
+METRIC_RESPONSE_BYTES = metrics.histogram("tts_response_bytes", "Audio bytes per response.", ("voice", "mode"), _SIZE_BUCKETS)
+METRIC_TRANSCODE_SECONDS = metrics.histogram("tts_transcode_seconds", "Time to re-encode a complete response.", ("format",))
+METRIC_ADMISSION_REJECTED = metrics.counter("tts_admission_rejected_total", "Speech requests rejected by admission control.", ("reason",))
+METRIC_COALESCED_REQUESTS = metrics.counter("tts_coalesced_requests_total", "Requests served by attaching to an identical in-flight request.", ("mode",))
+METRIC_TRANSCODE_BYTES = metrics.counter("tts_transcode_bytes_total", "MP3 bytes fed to the encoder.", ("format", "mode"))
+
+
+# --- 请求追踪 ---
+trace_logger = logging.getLogger("tts.trace")
+_trace_handler = logging.StreamHandler()
+_trace_handler.setFormatter(logging.Formatter('%(message)s'))
+trace_logger.addHandler(_trace_handler)
+trace_logger.propagate = False
+_TRACE_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+
+class RequestTrace:
+    """Timed spans of one request under a trace id.
+
+    Every finished span is logged as one JSON line on ``trace_logger``:
+    ``{"trace_id", "span", "start", "duration", ...attributes}``, so the
+    spans of concurrent requests can be told apart and filtered. The root
+    span, named after the request, is logged by ``finish`` with the request
+    attributes once the response has been sent. Span durations are also
+    summed by name for the ``Server-Timing`` response header.
+    """
+
+    def __init__(self, name: str, trace_id: str | None = None, **attrs):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.finished = False
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_request(cls, name: str, **attrs) -> "RequestTrace":
+        """Start a trace for the current request, keeping a valid ``X-Trace-Id`` the client sent."""
+        trace_id = request.headers.get('X-Trace-Id', '')
+        return cls(name, trace_id if _TRACE_ID_PATTERN.fullmatch(trace_id) else None, **attrs)
+
+    def set(self, **attrs):
+        """Add attributes to the root span."""
+        self.attrs.update(attrs)
+
+    def span(self, name: str, start: float, end: float | None = None, **attrs):
+        """Record the span ``name`` from ``start`` to ``end`` (default: now)."""
+        end = time.time() if end is None else end
+        with self._lock:
+            total = self._totals.setdefault(name, [0.0, 0])
+            total[0] += end - start
+            total[1] += 1
+        if TRACE_LOG_SPANS:
+            trace_logger.info(json.dumps({
+                "trace_id": self.trace_id, "span": name, "start": round(start, 6),
+                "duration": round(end - start, 6), **attrs,
+            }, ensure_ascii=False, default=str))
+
+    def server_timing(self) -> str:
+        """Return the spans so far, summed by name, as a ``Server-Timing`` header value."""
+        with self._lock:
+            entries = [
+                f"{name};dur={seconds * 1000:.1f}" + (f';desc="{count}x"' if count > 1 else "")
+                for name, (seconds, count) in self._totals.items()
+            ]
+        entries.append(f"total;dur={(time.time() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def finish(self, **attrs):
+        """Log the root span; later calls do nothing."""
+        if self.finished:
+            return
+        self.finished = True
+        self.span(self.name, self.start, **self.attrs, **attrs)
+
+    def send(self, body):
+        """Iterate a response ``body``, record it as the ``send`` span and finish the trace."""
+        start, sent = time.time(), 0
+        try:
+            for block in body:
+                sent += len(block)
+                yield block
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+            self.span("send", start, bytes=sent)
+            self.finish()
+
+    async def send_async(self, agen):
+        """``send`` for the async generator of a streaming response."""
+        start, sent = time.time(), 0
+        try:
+            async for block in agen:
+                sent += len(block)
+                yield block
+        finally:
+            await agen.aclose()
+            self.span("send", start, bytes=sent)
+            self.finish()
+
+
+# --- 性能剖析 ---
+# Innermost frames of threads that are parked rather than running
+_IDLE_FRAMES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("selectors.py", "select"),
+    ("queue.py", "get"), ("thread.py", "_worker"), ("connection.py", "wait"), ("socketserver.py", "serve_forever"),
+}
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of every thread of this process at a fixed interval.
+
+    Stacks are counted in the collapsed format read by ``flamegraph.pl`` and
+    speedscope: ``thread;outer frame;...;inner frame``. Threads parked in a
+    wait are skipped unless ``idle`` is set, so the profile shows where the
+    process spends CPU time. Only one profile runs at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, seconds: float, interval: float = 0.01, idle: bool = False) -> dict | None:
+        """Sample for ``seconds``; return ``None`` if another profile is running."""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            own = threading.get_ident()
+            names = {}
+            stacks = defaultdict(int)
+            samples = 0
+            start = time.monotonic()
+            while time.monotonic() - start < seconds:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    code = frame.f_code
+                    if not idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                        continue
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, f"thread-{ident}"))
+                    stacks[";".join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(interval)
+            return {
+                "seconds": round(time.monotonic() - start, 3),
+                "interval": interval,
+                "samples": samples,
+                "stacks": dict(stacks),
+            }
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def collapsed(profile: dict) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(profile["stacks"].items()))
+
+    @staticmethod
+    def top(profile: dict, limit: int = 30) -> list:
+        """Return the frames with the most samples, innermost (``self``) and anywhere on the stack (``total``)."""
+        own = defaultdict(int)
+        total = defaultdict(int)
+        for stack, count in profile["stacks"].items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        ranked = sorted(total, key=lambda frame: (own[frame], total[frame]), reverse=True)[:limit]
+        return [{"frame": frame, "self": own[frame], "total": total[frame]} for frame in ranked]
+
+
+profiler = SamplingProfiler()
+
+
+class AudioCache:
+    """Size-bounded on-disk LRU cache of synthesized chunk audio.
+
+    Entries are keyed by the voice and the whitespace-normalized chunk text,
+    so repeated sentences skip the upstream round trip entirely. The index is
+    rebuilt from the cache directory on startup (oldest mtime first) and kept
+    in memory; access order is refreshed on every hit. ``load``/``store``
+    address entries by a precomputed key for callers caching other artifacts.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, suffix: str = '.mp3'):
+        self.cache_dir = cache_dir
+        self.max_bytes = max(int(max_bytes or 0), 0)
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(voice: str, text: str, rate: str = "+0%") -> str:
+        normalized = re.sub(r'\s+', ' ', text).strip()
+        # Default-rate keys keep their original form so existing entries stay valid.
+        prefix = voice if rate == "+0%" else f"{voice}\x00{rate}"
+        return hashlib.sha256(f"{prefix}\x00{normalized}".encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}{self.suffix}")
+
+    def _load_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(self.suffix): continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, name[:-len(self.suffix)], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict_locked()
+        logger.info(f"Audio cache ready ({self.cache_dir}): {len(self._entries)} entries, {self._total_bytes} bytes (budget {self.max_bytes} bytes).")
+
+    def _evict_locked(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def resize(self, max_bytes: int):
+        """Apply a new byte budget: shrinking evicts, ``0`` disables the cache and keeps its files."""
+        max_bytes = max(int(max_bytes or 0), 0)
+        with self._lock:
+            if max_bytes == self.max_bytes:
+                return
+            was_enabled = self.enabled
+            self.max_bytes = max_bytes
+            if not self.enabled:
+                self._entries.clear()
+                self._total_bytes = 0
+            elif was_enabled:
+                self._evict_locked()
+            else:
+                self._load_index()
+
+    def get(self, voice: str, text: str, rate: str = "+0%") -> bytes | None:
+        return self.load(self.make_key(voice, text, rate))
+
+    def put(self, voice: str, text: str, data: bytes, rate: str = "+0%"):
+        self.store(self.make_key(voice, text, rate), data)
+
+    def load(self, key: str) -> bytes | None:
+        f = self.open_entry(key)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def open_entry(self, key: str):
+        """Return the entry as an open binary file (closed by the caller), or ``None``."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        # Entries missing from the index may have been written by another
+        # worker process sharing the cache directory.
+        try:
+            f = open(self._path(key), 'rb')
+            size = os.fstat(f.fileno()).st_size
+        except OSError:
+            with self._lock:
+                size = self._entries.pop(key, None)
+                if size is not None: self._total_bytes -= size
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            if key not in self._entries:
+                self._entries[key] = size
+                self._total_bytes += size
+                self._evict_locked()
+        return f
+
+    def store(self, key: str, data: bytes):
+        self._store(key, len(data), lambda f: f.write(data))
+
+    def store_file(self, key: str, src, size: int):
+        """Copy ``size`` bytes of the binary file ``src`` from its start into the cache."""
+        def write(f):
+            src.seek(0)
+            shutil.copyfileobj(src, f)
+        self._store(key, size, write)
+
+    def _store(self, key: str, size: int, write):
+        if not self.enabled or not size or size > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f: write(f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Audio cache write failed: {e}")
+            return
+        with self._lock:
+            old_size = self._entries.pop(key, None)
+            if old_size is not None: self._total_bytes -= old_size
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+audio_cache = AudioCache(AUDIO_CACHE_DIR, 0)
+# Word timings of the cached chunks, stored next to their audio (see load_cached_chunk)
+word_cache = AudioCache(AUDIO_CACHE_DIR, 0, suffix='.words')
+metrics.gauge("tts_audio_cache_hits_total", "Audio cache hits since startup.", lambda: audio_cache.hits, kind="counter")
+metrics.gauge("tts_audio_cache_misses_total", "Audio cache misses since startup.", lambda: audio_cache.misses, kind="counter")
+metrics.gauge("tts_audio_cache_bytes", "Bytes currently stored in the audio cache.", lambda: audio_cache.stats()["bytes"])
+
+
+def load_cached_chunk(voice: str, text: str, rate: str = "+0%", timed: bool = False):
+    """Return ``(audio, words)`` of a cached chunk, or ``None`` on a miss.
+
+    Word timings are only read for a ``timed`` lookup (``words`` is ``None``
+    otherwise), which treats entries cached without them as a miss so the
+    chunk is synthesized with its timings.
+    """
+    key = AudioCache.make_key(voice, text, rate)
+    words = None
+    if timed:
+        words = word_cache.load(key)
+        if words is None:
+            return None
+        words = json.loads(words)
+    audio = audio_cache.load(key)
+    if audio is None:
+        return None
+    return audio, words
+
+def store_cached_chunk(voice: str, text: str, audio: bytes, words: list, rate: str = "+0%"):
+    key = AudioCache.make_key(voice, text, rate)
+    audio_cache.store(key, audio)
+    word_cache.store(key, json.dumps(words).encode('utf-8'))
+
+
+class _SlotWaiter:
+    __slots__ = ("loop", "future", "request_id", "granted")
+
+    def __init__(self, loop, future, request_id):
+        self.loop = loop
+        self.future = future
+        self.request_id = request_id
+        self.granted = False
+
+
+class UpstreamScheduler:
+    """Process-wide budget of concurrent edge-tts sessions.
+
+    Every request opens a session with its own concurrency cap (which can only
+    lower, never raise, the global limit). Free slots are handed out first to
+    priority waiters (the leading ``sync_chunks`` of streaming requests), then
+    round-robin across requests so one long document cannot starve the rest.
+    The scheduler is shared by the Flask request loops and ``STREAM_LOOP``, so
+    it is guarded by a thread lock and wakes waiters on their own loop.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(int(limit), 1)
+        self.throttle = None
+        self.active = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._caps = {}
+        self._inflight = defaultdict(int)
+        self._queues = OrderedDict()
+        self._priority = deque()
+        self.budget = None
+
+    def set_limit(self, limit: int):
+        with self._lock:
+            self.limit = max(int(limit), 1)
+            self._dispatch_locked()
+
+    def set_throttle(self, throttle: int | None):
+        """Temporarily cap the effective limit (``None`` lifts the cap)."""
+        with self._lock:
+            self.throttle = throttle
+            self._dispatch_locked()
+
+    def effective_limit(self) -> int:
+        return min(self.limit, self.throttle) if self.throttle else self.limit
+
+    def fair_share(self, cap: int | None = None) -> int:
+        """Slots a new session can expect while sharing round-robin with the open ones."""
+        with self._lock:
+            share = self.effective_limit() // (len(self._caps) + 1)
+        return max(min(share, cap or self.limit), 1)
+
+    def session(self, cap: int | None = None, mode: str = "full", ticket=None,
+                trace: RequestTrace | None = None) -> "UpstreamSession":
+        request_id = next(self._ids)
+        with self._lock:
+            self._caps[request_id] = max(int(cap or self.limit), 1)
+        return UpstreamSession(self, request_id, mode, ticket, trace)
+
+    def close_session(self, request_id: int):
+        with self._lock:
+            self._caps.pop(request_id, None)
+            if not self._inflight.get(request_id):
+                self._inflight.pop(request_id, None)
+
+    def _eligible_locked(self, request_id: int) -> bool:
+        return self._inflight[request_id] < self._caps.get(request_id, self.limit)
+
+    def _grant_locked(self, waiter: _SlotWaiter):
+        waiter.granted = True
+        self.active += 1
+        self._inflight[waiter.request_id] += 1
+        waiter.loop.call_soon_threadsafe(self._wake, waiter)
+
+    def _wake(self, waiter: _SlotWaiter):
+        if waiter.future.done():
+            # The waiter was cancelled after the slot was granted.
+            self.release(waiter.request_id)
+        else:
+            waiter.future.set_result(True)
+
+    def _has_eligible_locked(self) -> bool:
+        return (any(self._eligible_locked(w.request_id) for w in self._priority)
+                or any(self._eligible_locked(request_id) for request_id in self._queues))
+
+    def _next_waiter_locked(self) -> _SlotWaiter:
+        for candidate in self._priority:
+            if self._eligible_locked(candidate.request_id):
+                self._priority.remove(candidate)
+                return candidate
+        for request_id, queue in self._queues.items():
+            if self._eligible_locked(request_id):
+                waiter = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(request_id)
+                else:
+                    del self._queues[request_id]
+                return waiter
+
+    def _dispatch_locked(self):
+        while self.active < self.effective_limit() and self._has_eligible_locked():
+            if self.budget is not None and not self.budget.try_acquire():
+                # Other worker processes hold the rest of the global limit;
+                # the budget's watcher thread calls ``kick`` to retry.
+                return
+            self._grant_locked(self._next_waiter_locked())
+
+    def kick(self):
+        with self._lock:
+            self._dispatch_locked()
+
+    async def acquire(self, request_id: int, priority: bool = False):
+        loop = asyncio.get_running_loop()
+        waiter = _SlotWaiter(loop, loop.create_future(), request_id)
+        with self._lock:
+            if priority:
+                self._priority.append(waiter)
+            else:
+                self._queues.setdefault(request_id, deque()).append(waiter)
+            self._dispatch_locked()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.granted:
+                    if priority:
+                        self._priority.remove(waiter)
+                    else:
+                        queue = self._queues.get(request_id)
+                        if queue is not None:
+                            queue.remove(waiter)
+                            if not queue: del self._queues[request_id]
+            if waiter.granted and waiter.future.done() and not waiter.future.cancelled():
+                self.release(request_id)
+            raise
+
+    def release(self, request_id: int):
+        if self.budget is not None:
+            self.budget.release()
+        with self._lock:
+            self.active -= 1
+            self._inflight[request_id] -= 1
+            if self._inflight[request_id] <= 0 and request_id not in self._caps:
+                self._inflight.pop(request_id, None)
+            self._dispatch_locked()
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return len(self._priority) + sum(len(q) for q in self._queues.values())
+
+    def priority_waiting(self) -> int:
+        with self._lock:
+            return len(self._priority)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "worker": WORKER_INDEX,
+                "shared_budget": self.budget.stats() if self.budget is not None else None,
+                "limit": self.limit,
+                "effective_limit": self.effective_limit(),
+                "active": self.active,
+                "queue_depth": len(self._priority) + sum(len(q) for q in self._queues.values()),
+                "priority_waiting": len(self._priority),
+                "requests_waiting": len(self._queues),
+                "open_sessions": len(self._caps),
+            }
+
+
+class SharedUpstreamBudget:
+    """Upstream concurrency limit shared by the worker processes of one server.
+
+    Each worker's ``UpstreamScheduler`` takes a unit from the budget before it
+    grants a slot. Per-worker holdings live in shared memory, so the launcher
+    can return the units of a worker that died. A worker that finds the budget
+    exhausted polls it until other workers release units.
+    """
+
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, ctx, workers: int, limit: int):
+        self._held = ctx.Array('i', workers, lock=False)
+        self._limit = ctx.Value('i', max(int(limit), 1), lock=False)
+        self._lock = ctx.Lock()
+        self._starved = None
+        self.index = None
+
+    def attach(self, index: int, scheduler: "UpstreamScheduler"):
+        self.index = index
+        self._starved = threading.Event()
+        scheduler.budget = self
+        threading.Thread(target=self._watch, args=(scheduler,), daemon=True).start()
+
+    def _watch(self, scheduler: "UpstreamScheduler"):
+        while True:
+            self._starved.wait()
+            time.sleep(self.POLL_INTERVAL)
+            self._starved.clear()
+            scheduler.kick()
+
+    def set_limit(self, limit: int):
+        with self._lock:
+            self._limit.value = max(int(limit), 1)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if sum(self._held) < self._limit.value:
+                self._held[self.index] += 1
+                return True
+        self._starved.set()
+        return False
+
+    def release(self):
+        with self._lock:
+            self._held[self.index] -= 1
+
+    def reset(self, index: int):
+        """Return all units held by worker ``index`` (used after it exits)."""
+        with self._lock:
+            self._held[index] = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"limit": self._limit.value, "active": sum(self._held), "per_worker": list(self._held)}
+
+
+class UpstreamSession:
+    """Handle one request uses to take slots from the ``UpstreamScheduler``.
+
+    Each finished slot is reported to the request's admission ``ticket``,
+    and the chunk spans of the request are recorded in its ``trace``.
+    """
+
+    def __init__(self, scheduler: UpstreamScheduler, request_id: int, mode: str = "full", ticket=None,
+                 trace: RequestTrace | None = None):
+        self.scheduler = scheduler
+        self.request_id = request_id
+        self.mode = mode
+        self.ticket = ticket
+        self.trace = trace
+
+    def span(self, name: str, start: float, **attrs):
+        if self.trace is not None:
+            self.trace.span(name, start, **attrs)
+
+    @asynccontextmanager
+    async def slot(self, priority: bool = False, chunk: int | None = None, voice: str = ""):
+        wait_start = time.time()
+        await self.scheduler.acquire(self.request_id, priority)
+        METRIC_SLOT_WAIT_SECONDS.observe(time.time() - wait_start, voice=voice, mode=self.mode)
+        self.span("slot_wait", wait_start, chunk=chunk)
+        try:
+            yield
+        finally:
+            self.scheduler.release(self.request_id)
+            if self.ticket is not None:
+                self.ticket.progress()
+
+    def close(self):
+        self.scheduler.close_session(self.request_id)
+
+
+upstream_scheduler = UpstreamScheduler(MAX_CONCURRENT_REQUESTS)
+metrics.gauge("tts_upstream_slots_active", "Upstream sessions currently in use.", lambda: upstream_scheduler.active)
+metrics.gauge("tts_upstream_slots_limit", "Effective upstream concurrency limit.", lambda: upstream_scheduler.effective_limit())
+metrics.gauge("tts_upstream_queue_depth", "Chunks waiting for an upstream slot.", lambda: upstream_scheduler.queue_depth())
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised instead of contacting edge-tts while the circuit breaker is open."""
+
+
+class UpstreamHealth:
+    """Shared view of edge-tts health with jittered backoff and a circuit breaker.
+
+    Outcomes of real upstream attempts are kept in a sliding time window. When
+    enough of them fail the breaker opens: new requests are rejected and pending
+    attempts fail fast instead of retrying in lockstep. After the cooldown the
+    breaker goes half-open and the scheduler is throttled to a single upstream
+    session; a successful probe closes the breaker, a failed one reopens it
+    with a longer cooldown.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, scheduler: UpstreamScheduler, window: float = 30.0, min_samples: int = 10,
+                 failure_threshold: float = 0.5, cooldown: float = 5.0, max_cooldown: float = 60.0):
+        self.scheduler = scheduler
+        self.window = window
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self.total_successes = 0
+        self.total_failures = 0
+        self._outcomes = deque()
+        self._lock = threading.Lock()
+
+    def _prune_locked(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def _error_rate_locked(self) -> float:
+        if not self._outcomes: return 0.0
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def _set_state_locked(self, state: str):
+        if state == self.state: return
+        logger.warning(f"[Upstream] Circuit breaker {self.state} \u2192 {state} (error rate {self._error_rate_locked():.0%}, cooldown {self.cooldown:.1f}s)")
+        self.state = state
+        self.scheduler.set_throttle(None if state == self.CLOSED else 1)
+
+    def _refresh_locked(self, now: float):
+        if self.state == self.OPEN and now - self.opened_at >= self.cooldown:
+            self._set_state_locked(self.HALF_OPEN)
+
+    def _trip_locked(self, now: float):
+        self.opened_at = now
+        self.trips += 1
+        self._set_state_locked(self.OPEN)
+
+    def check(self):
+        """Raise ``UpstreamUnavailableError`` if the upstream must not be contacted now."""
+        with self._lock:
+            self._refresh_locked(time.time())
+            if self.state == self.OPEN:
+                raise UpstreamUnavailableError("Upstream circuit breaker is open.")
+
+    def is_open(self) -> bool:
+        with self._lock:
+            self._refresh_locked(time.time())
+            return self.state == self.OPEN
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(self.cooldown - (time.time() - self.opened_at), 0.0) if self.state == self.OPEN else 0.0
+
+    def record_success(self):
+        now = time.time()
+        with self._lock:
+            self.total_successes += 1
+            self._outcomes.append((now, True))
+            self._prune_locked(now)
+            if self.state == self.HALF_OPEN:
+                self.cooldown = self.base_cooldown
+                self._outcomes.clear()
+                self._set_state_locked(self.CLOSED)
+
+    def record_failure(self):
+        now = time.time()
+        with self._lock:
+            self.total_failures += 1
+            self._outcomes.append((now, False))
+            self._prune_locked(now)
+            if self.state == self.HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self._trip_locked(now)
+            elif self.state == self.CLOSED and len(self._outcomes) >= self.min_samples \
+                    and self._error_rate_locked() >= self.failure_threshold:
+                self._trip_locked(now)
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff, stretched to the breaker cooldown while open."""
+        wait_time = random.uniform(0, min(2 ** attempt, 8))
+        return max(wait_time, self.retry_after())
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.time()
+            self._prune_locked(now)
+            self._refresh_locked(now)
+            return {
+                "state": self.state,
+                "error_rate": self._error_rate_locked(),
+                "window_samples": len(self._outcomes),
+                "trips": self.trips,
+                "cooldown": self.cooldown,
+                "successes": self.total_successes,
+                "failures": self.total_failures,
+            }
+
+
+upstream_health = UpstreamHealth(upstream_scheduler)
+metrics.gauge("tts_upstream_circuit_open", "1 if the upstream circuit breaker is open, 0.5 if half-open, else 0.",
+              lambda: {UpstreamHealth.OPEN: 1.0, UpstreamHealth.HALF_OPEN: 0.5}.get(upstream_health.stats()["state"], 0.0))
+metrics.gauge("tts_upstream_error_rate", "Upstream error rate over the health window.", lambda: upstream_health.stats()["error_rate"])
+metrics.gauge("tts_upstream_circuit_trips_total", "Times the upstream circuit breaker has opened.", lambda: upstream_health.trips, kind="counter")
+
+
+# --- 准入控制 ---
+class AdmissionTicket:
+    """Upstream work an admitted request still has to do, in expected upstream seconds."""
+
+    __slots__ = ("client", "stream", "chars", "work", "remaining", "per_chunk")
+
+    def __init__(self, client: str, stream: bool, chars: int, chunks: int, per_chunk: float):
+        self.client = client
+        self.stream = stream
+        self.chars = chars
+        self.per_chunk = per_chunk
+        self.work = self.remaining = chunks * per_chunk
+
+    def progress(self):
+        """Record one finished upstream attempt."""
+        self.remaining = max(self.remaining - self.per_chunk, 0.0)
+
+    @property
+    def remaining_chars(self) -> int:
+        return int(self.chars * self.remaining / self.work) if self.work else 0
+
+
+class AdmissionController:
+    """Admits speech requests while the upstream backlog lets them finish in time.
+
+    Every admitted request holds a ticket with its expected upstream work:
+    the chunk count its text will be split into, times the expected cost of
+    one chunk from ``ChunkCostModel``. The ticket shrinks as the request's
+    upstream attempts finish and is released when the request ends.
+
+    Slots are shared round-robin, so a request of work ``w`` is projected to
+    finish after ``(w + sum(min(r, w) for r in backlog)) / slots`` seconds.
+    Non-streaming requests are rejected when that exceeds ``slo``. Streaming
+    requests form a priority class: their leading chunks jump the slot queue
+    and playback paces the rest, so they are judged by the projected time to
+    first audio against ``stream_slo`` instead. A client (API token, or the
+    remote address without one) may also have at most ``client_max_chars``
+    characters in flight; ``client_quotas`` overrides that per token or
+    address. A limit of ``0`` disables its check.
+
+    Batch requests are admitted like one non-streaming request over their
+    distinct chunks. Speech jobs are queued by design and never rejected, but
+    a running job holds a ``track``ed ticket so its remaining chunks count in
+    the backlog that interactive requests are judged against.
+    """
+
+    def __init__(self, scheduler: UpstreamScheduler, slo: float = 0.0, stream_slo: float = 0.0,
+                 client_max_chars: int = 0, client_quotas: dict | None = None):
+        self.scheduler = scheduler
+        self.admitted = 0
+        self.rejected = defaultdict(int)
+        self._tickets = set()
+        self._lock = threading.Lock()
+        self.configure(slo, stream_slo, client_max_chars, client_quotas)
+
+    def configure(self, slo: float, stream_slo: float, client_max_chars: int, client_quotas: dict | None):
+        self.slo = max(float(slo or 0), 0.0)
+        self.stream_slo = max(float(stream_slo or 0), 0.0)
+        self.client_max_chars = max(int(client_max_chars or 0), 0)
+        self.client_quotas = dict(client_quotas or {})
+
+    @staticmethod
+    def client_id(token: str | None, address: str | None) -> str:
+        """Identify a client without keeping its token in memory or logs."""
+        if token:
+            return "token:" + hashlib.sha256(token.encode('utf-8')).hexdigest()[:12]
+        return f"address:{address}"
+
+    def admit(self, token: str | None, address: str | None, voice: str, chars: int,
+              chunk_len: int, first_len: int, stream: bool, chunks: int | None = None):
+        """Return ``(ticket, None)``, or ``(None, (message, status, retry_after))`` to reject.
+
+        ``chunks`` overrides the chunk count estimated from ``chars`` and ``chunk_len``.
+        """
+        client = self.client_id(token, address)
+        chunk_len = max(min(chunk_len, chars), 1)
+        per_chunk = chunk_cost_model.expected_cost(voice, chunk_len)
+        ticket = AdmissionTicket(client, stream, chars, -(-chars // chunk_len) if chunks is None else chunks, per_chunk)
+        slots = self.scheduler.effective_limit()
+        with self._lock:
+            quota = self.client_quotas.get(token or address, self.client_max_chars)
+            if quota:
+                if chars > quota:
+                    return self._reject_locked(
+                        "quota", f"Input of {chars} characters exceeds the client quota of {quota}; use /v1/audio/jobs.",
+                        413, None)
+                own = [t for t in self._tickets if t.client == client]
+                if sum(t.remaining_chars for t in own) + chars > quota:
+                    return self._reject_locked(
+                        "quota", f"Client quota of {quota} characters in flight exceeded.",
+                        429, sum(t.remaining for t in own) / slots)
+            if stream:
+                limit = self.stream_slo
+                # A free slot, or the queued leading chunks of other streams and one slot turnover.
+                busy = self.scheduler.active >= slots
+                waiting = (self.scheduler.priority_waiting() + 1) * per_chunk / slots if busy else 0.0
+                projected = waiting + chunk_cost_model.expected_cost(voice, max(min(first_len, chars), 1))
+                retry_after = projected - limit
+            else:
+                limit = self.slo
+                shared = sum(min(t.remaining, ticket.work) for t in self._tickets)
+                projected = max((ticket.work + shared) / slots, per_chunk)
+                # Wait until the backlog has drained far enough for the request to fit.
+                retry_after = (shared - max(limit * slots - ticket.work, 0.0)) / slots
+            # A request too long for the SLO even alone is still served on an idle upstream.
+            if limit and projected > limit and retry_after > 0:
+                return self._reject_locked(
+                    "slo", f"Server is busy: projected {'time to first audio' if stream else 'completion time'} "
+                    f"{projected:.1f}s exceeds {limit:g}s.", 429, retry_after)
+            self._tickets.add(ticket)
+            self.admitted += 1
+        return ticket, None
+
+    def track(self, client: str, voice: str, chars: int, chunks: int) -> AdmissionTicket:
+        """Add background work to the backlog without judging it; ``release`` it when done."""
+        per_chunk = chunk_cost_model.expected_cost(voice, max(-(-chars // max(chunks, 1)), 1))
+        ticket = AdmissionTicket(client, False, chars, chunks, per_chunk)
+        with self._lock:
+            self._tickets.add(ticket)
+        return ticket
+
+    def _reject_locked(self, reason: str, message: str, status: int, retry_after: float | None):
+        self.rejected[reason] += 1
+        METRIC_ADMISSION_REJECTED.inc(reason=reason)
+        return None, (message, status, retry_after)
+
+    def release(self, ticket: AdmissionTicket | None):
+        if ticket is not None:
+            with self._lock:
+                self._tickets.discard(ticket)
+
+    def backlog(self) -> float:
+        """Expected upstream seconds still owed to admitted requests."""
+        with self._lock:
+            return sum(t.remaining for t in self._tickets)
+
+    def stats(self) -> dict:
+        with self._lock:
+            clients = defaultdict(int)
+            for t in self._tickets:
+                clients[t.client] += t.remaining_chars
+            return {
+                "slo": self.slo,
+                "stream_slo": self.stream_slo,
+                "client_max_chars": self.client_max_chars,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "in_flight": len(self._tickets),
+                "streams_in_flight": sum(1 for t in self._tickets if t.stream),
+                "backlog_seconds": round(sum(t.remaining for t in self._tickets), 3),
+                "clients": dict(clients),
+            }
+
+
+admission = AdmissionController(upstream_scheduler)
+metrics.gauge("tts_admission_backlog_seconds", "Expected upstream seconds owed to admitted requests.", lambda: admission.backlog())
+
+
+# --- 上游连接池 ---
+_SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+# Short names ("zh-CN-XiaoxiaoNeural") and the long form edge-tts sends; both are safe in SSML.
+_VOICE_NAME_PATTERN = re.compile(
+    r"[A-Za-z0-9-]+|Microsoft Server Speech Text to Speech Voice \([A-Za-z0-9-]+, [A-Za-z0-9-]+\)")
+# The service always answers with 48 kbps CBR MP3; offsets are in 100 ns ticks.
+_TICKS_PER_AUDIO_BYTE = 8 * 10_000_000 / 48_000
+
+
+class UpstreamProtocolError(Exception):
+    """The upstream websocket sent something the pool cannot interpret."""
+
+
+class _StaleConnectionError(Exception):
+    """A reused connection was closed by the service before the turn started."""
+
+
+class _PooledConnection:
+    __slots__ = ("ws", "created", "last_used", "turns")
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.created = self.last_used = time.time()
+        self.turns = 0
+
+
+def upstream_tts_config(voice: str, rate: str) -> "TTSConfig":
+    """Return the edge-tts ``TTSConfig`` for a synthesis turn; ``ValueError`` for an unusable voice."""
+    tts_config = TTSConfig(voice, rate, "+0%", "+0Hz", "WordBoundary")
+    if not _VOICE_NAME_PATTERN.fullmatch(tts_config.voice):
+        raise ValueError(f"Invalid voice '{voice}'.")
+    return tts_config
+
+
+def word_boundary(event) -> list:
+    """Return a ``WordBoundary`` event as ``[offset, duration, text]`` (times in 100 ns ticks)."""
+    return [event["offset"], event["duration"], event["text"]]
+
+
+class UpstreamConnectionPool:
+    """Warm edge-tts websocket connections reused across chunks and requests.
+
+    ``edge_tts.Communicate`` opens a new TLS + websocket connection per chunk,
+    which dominates the latency of short chunks. The pool keeps connections
+    open after a synthesis turn and serves the next ``speech.config``-configured
+    SSML turn on them. A connection is used by one turn at a time (callers hold
+    an upstream slot), is checked before reuse, closed once it has been idle for
+    ``idle_timeout`` or alive for ``max_age``, and at most the scheduler limit
+    of idle connections is kept.
+
+    Messages are built with the same edge-tts helpers ``Communicate`` uses
+    (``TTSConfig``, ``mkssml``), so voices are sent in the form Edge sends.
+    aiohttp connections are bound to one event loop, so the pool lives on
+    ``STREAM_LOOP``; ``synthesize`` bridges callers running on other loops.
+    With ``enabled`` off, from a foreign loop, or with an edge-tts version
+    that lacks those helpers, ``stream`` falls back to ``edge_tts.Communicate``.
+    """
+
+    def __init__(self, loop, scheduler: UpstreamScheduler, idle_timeout: float = 20.0,
+                 max_age: float = 300.0, connect_timeout: int = 10, receive_timeout: int = 60):
+        self.loop = loop
+        self.scheduler = scheduler
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.connect_timeout = connect_timeout
+        self.receive_timeout = receive_timeout
+        self.enabled = True
+        self.opened = 0
+        self.reused = 0
+        self.evicted = 0
+        self._idle = deque()
+        self._session = None
+        self._reaper = None
+        self._closing = set()
+
+    def _connect_url(self) -> str:
+        return (f"{WSS_URL}&ConnectionId={connect_id()}"
+                f"&Sec-MS-GEC={DRM.generate_sec_ms_gec()}&Sec-MS-GEC-Version={SEC_MS_GEC_VERSION}")
+
+    async def _open(self) -> _PooledConnection:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(trust_env=True, timeout=aiohttp.ClientTimeout(
+                total=None, connect=None, sock_connect=self.connect_timeout, sock_read=self.receive_timeout))
+        connect = lambda: self._session.ws_connect(
+            self._connect_url(), compress=15, headers=DRM.headers_with_muid(WSS_HEADERS),
+            ssl=_SSL_CONTEXT, timeout=aiohttp.ClientWSTimeout(ws_receive=self.receive_timeout))
+        try:
+            ws = await connect()
+        except aiohttp.ClientResponseError as e:
+            if e.status != 403: raise
+            # Sec-MS-GEC is time based; resync the clock skew and try once more.
+            DRM.handle_client_response_error(e)
+            ws = await connect()
+        conn = _PooledConnection(ws)
+        try:
+            await ws.send_str(
+                f"X-Timestamp:{date_to_string()}\r\n"
+                "Content-Type:application/json; charset=utf-8\r\n"
+                "Path:speech.config\r\n\r\n"
+                '{"context":{"synthesis":{"audio":{"metadataoptions":{'
+                '"sentenceBoundaryEnabled":"false","wordBoundaryEnabled":"true"},'
+                '"outputFormat":"audio-24khz-48kbitrate-mono-mp3"}}}}\r\n'
+            )
+        except BaseException:
+            self._discard(conn)
+            raise
+        self.opened += 1
+        return conn
+
+    def _usable(self, conn: _PooledConnection, now: float) -> bool:
+        return (not conn.ws.closed and conn.ws.exception() is None
+                and now - conn.last_used < self.idle_timeout and now - conn.created < self.max_age)
+
+    async def _checkout(self, fresh: bool = False):
+        now = time.time()
+        while self._idle and not fresh:
+            # Most recently used first: it is the least likely to have been dropped.
+            conn = self._idle.pop()
+            if self._usable(conn, now):
+                return conn, True
+            self.evicted += 1
+            self._discard(conn)
+        return await self._open(), False
+
+    def _checkin(self, conn: _PooledConnection):
+        conn.last_used = time.time()
+        conn.turns += 1
+        if self.enabled and len(self._idle) < self.scheduler.limit and self._usable(conn, conn.last_used):
+            self._idle.append(conn)
+            if self._reaper is None or self._reaper.done():
+                self._reaper = self.loop.create_task(self._reap())
+        else:
+            self._discard(conn)
+
+    def _discard(self, conn: _PooledConnection):
+        # Closing waits for the close handshake; don't hold up the caller.
+        task = self.loop.create_task(conn.ws.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _reap(self):
+        while self._idle:
+            await asyncio.sleep(self.idle_timeout / 2)
+            now = time.time()
+            for conn in [c for c in self._idle if not self._usable(c, now)]:
+                self._idle.remove(conn)
+                self.evicted += 1
+                self._discard(conn)
+
+    @staticmethod
+    def _parse_headers(data: bytes):
+        head, _, body = data.partition(b"\r\n\r\n")
+        headers = dict(line.split(b":", 1) for line in head.split(b"\r\n") if b":" in line)
+        return headers, body
+
+    async def _turn(self, conn: _PooledConnection, tts_config: "TTSConfig", escaped_text: bytes, offset: int):
+        ws = conn.ws
+        started = False
+        try:
+            await ws.send_str(ssml_headers_plus_data(connect_id(), date_to_string(), mkssml(tts_config, escaped_text)))
+            while True:
+                msg = await ws.receive()
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    started = True
+                    headers, body = self._parse_headers(msg.data.encode("utf-8"))
+                    path = headers.get(b"Path")
+                    if path == b"turn.end":
+                        return
+                    if path == b"audio.metadata":
+                        for meta in json.loads(body)["Metadata"]:
+                            if meta["Type"] in ("WordBoundary", "SentenceBoundary"):
+                                yield {
+                                    "type": meta["Type"],
+                                    "offset": meta["Data"]["Offset"] + offset,
+                                    "duration": meta["Data"]["Duration"],
+                                    "text": unescape(meta["Data"]["text"]["Text"]),
+                                }
+                    elif path not in (b"response", b"turn.start"):
+                        raise UpstreamProtocolError(f"Unknown path received: {path!r}")
+                elif msg.type == aiohttp.WSMsgType.BINARY:
+                    started = True
+                    if len(msg.data) < 2:
+                        raise UpstreamProtocolError("Binary message is missing the header length.")
+                    header_length = int.from_bytes(msg.data[:2], "big")
+                    headers, _ = self._parse_headers(msg.data[2:header_length + 2] + b"\r\n\r\n")
+                    if headers.get(b"Path") != b"audio":
+                        raise UpstreamProtocolError("Binary message is not audio.")
+                    data = msg.data[header_length + 2:]
+                    if data:
+                        yield {"type": "audio", "data": data}
+                elif msg.type == aiohttp.WSMsgType.ERROR:
+                    raise UpstreamProtocolError(f"Websocket error: {msg.data}")
+                else:
+                    # CLOSE / CLOSING / CLOSED before turn.end.
+                    raise (UpstreamProtocolError if started else _StaleConnectionError)(
+                        "Upstream closed the connection mid-turn.")
+        except (ConnectionError, aiohttp.ClientConnectionError) as e:
+            if started: raise
+            raise _StaleConnectionError(str(e)) from e
+
+    async def stream(self, text: str, voice: str, rate: str = "+0%"):
+        """Yield edge-tts style ``audio`` / ``WordBoundary`` events for ``text``."""
+        if not self.enabled or TTSConfig is None or asyncio.get_running_loop() is not self.loop:
+            async for event in edge_tts.Communicate(text, voice, rate=rate, boundary="WordBoundary").stream():
+                yield event
+            return
+        tts_config = upstream_tts_config(voice, rate)
+        audio_bytes = 0
+        received = False
+        for part in split_text_by_byte_length(escape(remove_incompatible_characters(text)), 4096):
+            fresh = False
+            while True:
+                conn, reused = await self._checkout(fresh)
+                complete = False
+                try:
+                    async for event in self._turn(conn, tts_config, part, int(audio_bytes * _TICKS_PER_AUDIO_BYTE)):
+                        if event["type"] == "audio":
+                            audio_bytes += len(event["data"])
+                            received = True
+                        yield event
+                    complete = True
+                except _StaleConnectionError:
+                    if not reused: raise
+                    # The service dropped the idle connection; redo on a new one.
+                    self.evicted += 1
+                    fresh = True
+                    continue
+                finally:
+                    if complete:
+                        self.reused += reused
+                        self._checkin(conn)
+                    elif not conn.ws.closed: self._discard(conn)
+                break
+        if not received:
+            raise edge_tts.NoAudioReceived("No audio was received.")
+
+    async def _collect(self, text: str, voice: str, rate: str) -> tuple:
+        buf = bytearray()
+        words = []
+        async for event in self.stream(text, voice, rate):
+            if event["type"] == "audio":
+                buf.extend(event["data"])
+            elif event["type"] == "WordBoundary":
+                words.append(word_boundary(event))
+        return bytes(buf), words
+
+    async def synthesize(self, text: str, voice: str, rate: str = "+0%") -> tuple:
+        """Return ``(audio, words)`` for ``text`` (see ``word_boundary``); safe to await from any event loop."""
+        if asyncio.get_running_loop() is self.loop:
+            return await self._collect(text, voice, rate)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._collect(text, voice, rate), self.loop))
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().ws.close()
+        if self._session is not None:
+            await self._session.close()
+
+    def shutdown(self, timeout: float = 2.0):
+        """Close pooled connections from outside the pool loop (e.g. at exit)."""
+        if self.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self.close(), self.loop).result(timeout)
+            except Exception as e:
+                logger.debug(f"[Upstream] Failed to close pooled connections: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled and TTSConfig is not None,
+            "idle": len(self._idle),
+            "max_idle": self.scheduler.limit,
+            "opened": self.opened,
+            "reused": self.reused,
+            "evicted": self.evicted,
+        }
+
+
+upstream_pool = UpstreamConnectionPool(STREAM_LOOP, upstream_scheduler)
+atexit.register(upstream_pool.shutdown)
+metrics.gauge("tts_upstream_connections_idle", "Warm upstream websocket connections in the pool.", lambda: len(upstream_pool._idle))
+metrics.gauge("tts_upstream_connections_opened_total", "Upstream websocket connections opened.", lambda: upstream_pool.opened, kind="counter")
+metrics.gauge("tts_upstream_connections_reused_total", "Synthesis turns served on a reused connection.", lambda: upstream_pool.reused, kind="counter")
+
+
+# --- MP3 拼接 ---
+# Bitrate tables (kbps) indexed by [version is MPEG-1][layer][bitrate index].
+_MP3_BITRATES = {
+    True: {
+        1: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    },
+    False: {
+        1: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        3: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    },
+}
+# Sample rates indexed by [version bits][sample rate index].
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def parse_mp3_frame_header(data, pos: int):
+    """Parse the MPEG audio frame header at ``pos``.
+
+    Returns ``(frame_length, side_info_offset, seconds)`` or ``None`` if the
+    bytes at ``pos`` are not a valid frame header. ``side_info_offset`` is
+    where a Xing/Info tag would start relative to the frame; ``seconds`` is
+    the playing time of the frame.
+    """
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    version = (b1 >> 3) & 0x03
+    layer_bits = (b1 >> 1) & 0x03
+    bitrate_idx = b2 >> 4
+    rate_idx = (b2 >> 2) & 0x03
+    if version == 1 or layer_bits == 0 or bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+    layer = 4 - layer_bits
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[mpeg1][layer][bitrate_idx] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_idx]
+    padding = (b2 >> 1) & 0x01
+    if layer == 1:
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and not mpeg1:
+        frame_length = 72 * bitrate // sample_rate + padding
+    else:
+        frame_length = 144 * bitrate // sample_rate + padding
+    mono = (b3 >> 6) == 3
+    if mpeg1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    crc = 0 if (b1 & 0x01) else 2
+    samples = 384 if layer == 1 else (576 if layer == 3 and not mpeg1 else 1152)
+    return frame_length, 4 + crc + side_info, samples / sample_rate
+
+
+def _id3v2_size(data, pos: int) -> int:
+    if data[pos:pos + 3] != b"ID3" or pos + 10 > len(data):
+        return 0
+    size = 0
+    for b in data[pos + 6:pos + 10]:
+        size = (size << 7) | (b & 0x7F)
+    footer = 10 if data[pos + 5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def iter_mp3_audio_ranges(data):
+    """Yield ``(start, end)`` byte ranges of contiguous audio frames in ``data``.
+
+    ID3v2/ID3v1 tags, Xing/Info/VBRI header frames, truncated trailing frames
+    and any garbage between frames are skipped, so the ranges of several
+    segments can be joined back to back into one valid MP3 stream.
+    """
+    length = len(data)
+    end_limit = length - 128 if length >= 128 and data[length - 128:length - 125] == b"TAG" else length
+    pos = 0
+    run_start = None
+    first_frame = True
+    while pos < end_limit:
+        tag_size = _id3v2_size(data, pos)
+        if tag_size:
+            if run_start is not None:
+                yield run_start, pos
+                run_start = None
+            pos += tag_size
+            continue
+        header = parse_mp3_frame_header(data, pos)
+        if header is None or pos + header[0] > end_limit:
+            if run_start is not None:
+                yield run_start, pos
+                run_start = None
+            if header is not None:
+                break
+            next_sync = data.find(b"\xff", pos + 1, end_limit)
+            if next_sync < 0:
+                break
+            pos = next_sync
+            continue
+        frame_length, side_info_offset, _ = header
+        if first_frame:
+            first_frame = False
+            tag = data[pos + side_info_offset:pos + side_info_offset + 4]
+            if tag in (b"Xing", b"Info") or data[pos + 36:pos + 40] == b"VBRI":
+                pos += frame_length
+                continue
+        if run_start is None:
+            run_start = pos
+        pos += frame_length
+    if run_start is not None:
+        yield run_start, pos
+
+
+def stitch_mp3_segments(segments) -> bytes:
+    """Join MP3 segments in memory into a single MP3 byte string.
+
+    Replaces the temp-dir + ``ffmpeg -f concat -c copy`` round trip: frames
+    are copied as-is and per-segment tag/header frames are dropped.
+    """
+    parts = []
+    for segment in segments:
+        if not segment:
+            continue
+        view = memoryview(segment)
+        parts.extend(view[start:end] for start, end in iter_mp3_audio_ranges(segment))
+    return b"".join(parts)
+
+
+def scan_mp3_frames(data, pos: int = 0):
+    """Return ``(frames, next_pos)`` for the complete frames of ``data`` from ``pos``.
+
+    ``frames`` lists ``(start, end, seconds)`` per frame. Tags and bytes that
+    are not frames are skipped. Scanning stops before an incomplete frame or
+    tag at the end, so a growing buffer can be scanned again from ``next_pos``.
+    """
+    frames = []
+    length = len(data)
+    while pos + 4 <= length:
+        if data[pos:pos + 3] == b"ID3":
+            tag_size = _id3v2_size(data, pos)
+            if not tag_size or pos + tag_size > length:
+                break
+            pos += tag_size
+            continue
+        header = parse_mp3_frame_header(data, pos)
+        if header is None:
+            next_sync = data.find(b"\xff", pos + 1)
+            pos = next_sync if next_sync >= 0 else length
+            continue
+        frame_length, _, seconds = header
+        if pos + frame_length > length:
+            break
+        frames.append((pos, pos + frame_length, seconds))
+        pos += frame_length
+    return frames, pos
+
+
+def mp3_duration(data) -> float:
+    """Return the playing time in seconds of the audio frames in ``data``.
+
+    Counts the frames ``write_mp3_segment`` would keep, so the durations of
+    segments add up to the length of their stitched output.
+    """
+    seconds = 0.0
+    for start, end in iter_mp3_audio_ranges(data):
+        pos = start
+        while pos < end:
+            frame_length, _, frame_seconds = parse_mp3_frame_header(data, pos)
+            seconds += frame_seconds
+            pos += frame_length
+    return seconds
+
+
+# One silent MPEG-2 Layer III frame in the format edge-tts returns
+# (24 kHz, mono, 48 kbps, no CRC): header FF F3 64 C4 followed by zeroed side
+# info and main data, which decoders render as 576 samples of silence.
+_SILENT_MP3_FRAME = bytes([0xFF, 0xF3, 0x64, 0xC4]) + bytes(140)
+_SILENT_MP3_FRAME_SECONDS = 576 / 24000
+
+
+def generate_silence_bytes(duration: float = 0.2) -> bytes:
+    """Return ``duration`` seconds of MP3 silence built from the frame template."""
+    frame_count = max(1, round(duration / _SILENT_MP3_FRAME_SECONDS))
+    return _SILENT_MP3_FRAME * frame_count
+
+
+def write_mp3_segment(out, segment) -> int:
+    """Write the audio frames of one MP3 ``segment`` to ``out``; return the bytes written.
+
+    The streaming counterpart of ``stitch_mp3_segments``: frames are copied
+    straight from the segment, so no joined copy of the output is built.
+    """
+    if not segment:
+        return 0
+    view = memoryview(segment)
+    written = 0
+    for start, end in iter_mp3_audio_ranges(segment):
+        written += out.write(view[start:end])
+    return written
+
+
+class AudioSpool:
+    """Output file for a complete response that only stays in memory while small.
+
+    Bytes are written to a ``BytesIO`` until ``threshold`` is exceeded, then
+    everything moves to an anonymous temp file, so a long response costs disk
+    rather than RSS. ``add`` accepts MP3 segments in any order and stitches
+    them in index order; segments that arrive early wait in memory up to
+    ``reorder_bytes`` and in a scratch temp file beyond that.
+    """
+
+    def __init__(self, threshold: int, reorder_bytes: int | None = None):
+        self.threshold = threshold
+        self.reorder_bytes = threshold if reorder_bytes is None else reorder_bytes
+        self.file = BytesIO()
+        self.size = 0
+        self.stitch_seconds = 0.0
+        self._next = 0
+        # index -> segment bytes, or (offset, length) in the scratch file
+        self._pending = {}
+        self._pending_bytes = 0
+        self._scratch = None
+
+    @property
+    def spilled(self) -> bool:
+        return not isinstance(self.file, BytesIO)
+
+    def write(self, data) -> int:
+        if not self.spilled and self.size + len(data) > self.threshold:
+            spill = tempfile.TemporaryFile()
+            with self.file.getbuffer() as view:
+                spill.write(view)
+            self.file = spill
+        self.file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def add(self, index: int, segment: bytes):
+        """Stitch the MP3 ``segment`` at ``index`` (0-based) into the output."""
+        if index != self._next:
+            self._hold(index, segment)
+            return
+        start = time.perf_counter()
+        write_mp3_segment(self, segment)
+        self._next += 1
+        while self._next in self._pending:
+            write_mp3_segment(self, self._take(self._next))
+            self._next += 1
+        self.stitch_seconds += time.perf_counter() - start
+
+    def _hold(self, index: int, segment: bytes):
+        if self._pending_bytes + len(segment) <= self.reorder_bytes:
+            self._pending[index] = segment
+            self._pending_bytes += len(segment)
+            return
+        if self._scratch is None:
+            self._scratch = tempfile.TemporaryFile()
+        offset = self._scratch.seek(0, os.SEEK_END)
+        self._scratch.write(segment)
+        self._pending[index] = (offset, len(segment))
+
+    def _take(self, index: int) -> bytes:
+        entry = self._pending.pop(index)
+        if isinstance(entry, tuple):
+            offset, length = entry
+            self._scratch.seek(offset)
+            return self._scratch.read(length)
+        self._pending_bytes -= len(entry)
+        return entry
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        """Read ``size`` bytes at ``offset`` without moving where writes go."""
+        self.file.seek(offset)
+        data = self.file.read(size)
+        self.file.seek(0, os.SEEK_END)
+        return data
+
+    def finish(self):
+        """Return the output file rewound for reading; the caller owns and closes it."""
+        if self._pending:
+            raise ValueError(f"Segment {self._next} was never added.")
+        if self._scratch is not None:
+            self._scratch.close()
+            self._scratch = None
+        self.file.seek(0)
+        return self.file
+
+    def close(self):
+        self.file.close()
+        if self._scratch is not None:
+            self._scratch.close()
+
+
+# --- 字幕时间轴 ---
+# Response formats for word timings next to the audio (``timestamps`` request field)
+TIMESTAMP_FORMATS = ("json", "srt", "vtt")
+# Longest subtitle cue in characters before a new one is started
+SUBTITLE_CUE_MAX_CHARS = 42
+_TICKS_PER_SECOND = 10_000_000
+# Punctuation that follows a word in the text and belongs to its cue
+_WORD_TRAILER = re.compile(r'[^\w\s]*')
+_SENTENCE_END = re.compile(r'[.!?\u2026\u3002\uff01\uff1f]')
+
+
+class WordTimeline:
+    """Word timings of one response, placed on the timeline of its stitched audio.
+
+    Chunks are ``add``-ed with their audio and the ``WordBoundary`` timings the
+    upstream sent for them (see ``word_boundary``), in any order. Once every
+    earlier chunk is in, a chunk's words are shifted by the playing time of
+    the audio before it and grouped into subtitle cues. Times are divided by
+    ``tempo`` when the audio is sped up after synthesis.
+
+    A complete response reads ``result``; a stream calls ``take_event`` to
+    hand out what was placed since the previous call and keeps nothing.
+    """
+
+    def __init__(self, subtitle_format: str = "json", tempo: float = 1.0):
+        self.format = subtitle_format
+        self.tempo = tempo
+        self.words = []
+        # (start, end, text) in seconds
+        self.cues = []
+        # Playing time of the chunks placed so far, before ``tempo``
+        self.seconds = 0.0
+        self.cues_taken = 0
+        self._next = 0
+        self._pending = {}
+
+    def add(self, index: int, text: str, audio, words):
+        """Add chunk ``index`` (0-based) with its stitched ``audio`` segment and timings."""
+        self._pending[index] = (text, mp3_duration(audio) if audio else 0.0, words or ())
+        while self._next in self._pending:
+            self._place(*self._pending.pop(self._next))
+            self._next += 1
+
+    def _place(self, text: str, seconds: float, words):
+        cue = []
+        cursor = 0
+        for offset, duration, word in words:
+            start = (self.seconds + offset / _TICKS_PER_SECOND) / self.tempo
+            end = (self.seconds + (offset + duration) / _TICKS_PER_SECOND) / self.tempo
+            self.words.append({"text": word, "start": round(start, 3), "end": round(end, 3)})
+            pos = text.find(word, cursor)
+            if pos < 0:
+                span = None
+            else:
+                cursor = _WORD_TRAILER.match(text, pos + len(word)).end()
+                span = (pos, cursor)
+            if cue and len(self._cue_text(text, cue + [(start, end, word, span)])) > SUBTITLE_CUE_MAX_CHARS:
+                self._close_cue(text, cue)
+                cue = []
+            cue.append((start, end, word, span))
+            if span is not None and _SENTENCE_END.search(text, pos + len(word), span[1]):
+                self._close_cue(text, cue)
+                cue = []
+        if cue:
+            self._close_cue(text, cue)
+        self.seconds += seconds
+
+    @staticmethod
+    def _cue_text(text: str, cue) -> str:
+        # Cut from the chunk text so spacing and punctuation stay as written.
+        if all(span is not None for _, _, _, span in cue):
+            return ' '.join(text[cue[0][3][0]:cue[-1][3][1]].split())
+        return ' '.join(word for _, _, word, _ in cue)
+
+    def _close_cue(self, text: str, cue):
+        self.cues.append((cue[0][0], cue[-1][1], self._cue_text(text, cue)))
+
+    def result(self) -> dict:
+        """Return every placed word, and the subtitles for ``srt``/``vtt``."""
+        result = {"words": self.words}
+        if self.format != "json":
+            result["subtitles"] = format_subtitles(self.cues, self.format)
+        return result
+
+    def take_event(self) -> dict | None:
+        """Return a ``speech.words`` event with what was placed since the last call, if anything."""
+        if not self.words and not self.cues:
+            return None
+        event = {"type": "speech.words", "words": self.words}
+        if self.format != "json":
+            # Fragments concatenate into one valid SRT/WebVTT document.
+            event["subtitles"] = format_subtitles(self.cues, self.format, self.cues_taken + 1)
+        self.cues_taken += len(self.cues)
+        self.words, self.cues = [], []
+        return event
+
+
+def _subtitle_time(seconds: float, separator: str) -> str:
+    ms = int(round(seconds * 1000))
+    hours, ms = divmod(ms, 3_600_000)
+    minutes, ms = divmod(ms, 60_000)
+    secs, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{ms:03d}"
+
+def format_subtitles(cues, subtitle_format: str, first_number: int = 1) -> str:
+    """Render ``(start, end, text)`` cues as ``srt`` or ``vtt``, numbered from ``first_number``.
+
+    The WebVTT header is only written when numbering starts at 1, so
+    documents rendered in pieces can be appended to each other.
+    """
+    separator = "," if subtitle_format == "srt" else "."
+    lines = ["WEBVTT", ""] if subtitle_format == "vtt" and first_number == 1 else []
+    for number, (start, end, text) in enumerate(cues, first_number):
+        if subtitle_format == "srt":
+            lines.append(str(number))
+        lines.append(f"{_subtitle_time(start, separator)} --> {_subtitle_time(end, separator)}")
+        lines.extend((text, ""))
+    return "\n".join(lines) + "\n" if lines else ""
+
+def _sse_frame(event: dict) -> bytes:
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8')
+
+async def sse_speech_events(agen, timeline: WordTimeline):
+    """Frame a streamed response as server-sent events with its word timings interleaved.
+
+    Audio goes out as OpenAI-style ``speech.audio.delta`` events (base64).
+    A chunk's ``speech.words`` event follows its last audio, and
+    ``speech.audio.done`` ends the stream.
+    """
+    try:
+        async for piece in agen:
+            # Words placed while waiting for this piece belong to the audio before it.
+            event = timeline.take_event()
+            if event:
+                yield _sse_frame(event)
+            yield _sse_frame({"type": "speech.audio.delta", "audio": base64.b64encode(piece).decode('ascii')})
+    finally:
+        await agen.aclose()
+    event = timeline.take_event()
+    if event:
+        yield _sse_frame(event)
+    yield _sse_frame({"type": "speech.audio.done"})
+
+
+# --- 流式生成 ---
+class _ChunkBuffer:
+    """Audio of one streaming chunk plus a wake-up signal for the consumer.
+
+    ``data`` holds the bytes of the current upstream attempt and grows as
+    edge-tts emits them. ``changed`` is set whenever bytes arrive or the chunk
+    finishes, so the ordered consumer only wakes when there is work to do.
+    ``estimate`` is the expected audio size, used to bound the unsent window.
+    ``words`` collects the ``WordBoundary`` timings of the attempt, and
+    ``attempt`` counts the resets, one per upstream attempt.
+    """
+
+    __slots__ = ("text", "data", "words", "attempt", "done", "failed", "changed", "estimate")
+
+    def __init__(self, text: str = "", estimate: int = 0):
+        self.text = text
+        self.data = bytearray()
+        self.words = []
+        self.attempt = 0
+        self.estimate = estimate
+        self.done = False
+        self.failed = False
+        self.changed = asyncio.Event()
+
+    def feed(self, piece: bytes):
+        self.data.extend(piece)
+        self.changed.set()
+
+    def reset(self):
+        self.data.clear()
+        self.words = []
+        self.attempt += 1
+
+    def finish(self, failed: bool = False, data: bytes | None = None, words=None):
+        if data is not None:
+            self.data = bytearray(data)
+            self.words = list(words or ())
+        self.done = True
+        self.failed = failed
+        self.changed.set()
 
 
 async def generate_streaming_audio_async(
@@ -74,19 +1939,58 @@ async def generate_streaming_audio_async(
     voice,
     sync_chunks: int = 1,
     max_concurrent_requests: int | None = None,
+    rate: str = "+0%",
+    outcome: dict | None = None,
+    repeated: set | None = None,
+    lookahead: int = 0,
+    timeline: WordTimeline | None = None,
+    ticket: AdmissionTicket | None = None,
+    trace: RequestTrace | None = None,
 ):
     """Generate audio chunks and yield them in a hybrid streaming mode.
 
     The first few chunks are generated synchronously to provide an immediate
     playback experience. Remaining chunks are processed concurrently while
-    ensuring chunks are yielded in order.
+    ensuring chunks are yielded in order. Bytes of the head-of-line chunk are
+    forwarded as soon as edge-tts emits them; later chunks are sent the moment
+    their predecessors finish, without polling.
+
+    ``text_chunks`` may be a lazy iterator (see ``iter_text_chunks``): chunks
+    are scheduled as they are produced, so synthesis of the first chunk starts
+    before the rest of the input has been cleaned and split.
+
+    ``rate`` is the upstream prosody rate. If ``outcome`` is given, the number
+    of chunks that fell back to silence is stored in it under ``"failed"``
+    once the generator finishes. Chunks whose text is one of the ``repeated``
+    sentences are synthesized once; later occurrences wait for the first and
+    reuse its audio.
+
+    Memory stays bounded however long the input is: a chunk's buffer is
+    dropped as soon as it has been sent, and no new chunk is scheduled while
+    the audio expected from unsent chunks exceeds ``STREAM_BUFFER_MAX_BYTES``
+    (the next chunk to send is always scheduled). A positive ``lookahead``
+    also limits synthesis to that many chunks past the one being sent.
+
+    With a ``timeline``, every chunk's word timings are added to it once the
+    chunk has been sent.
+
+    Closing the generator early (the client went away) cancels the chunks
+    still pending, which releases their upstream slots.
+
+    Upstream progress is reported to the admission ``ticket``, and the chunk
+    spans and time to first byte are recorded in ``trace``.
     """
-    total_chunks = len(text_chunks)
-    semaphore = asyncio.Semaphore(
-        max_concurrent_requests or MAX_CONCURRENT_REQUESTS
-    )
-    buffers = [None] * (total_chunks + 1)
-    results = [None] * (total_chunks + 1)
+    total_chunks = len(text_chunks) if hasattr(text_chunks, '__len__') else '?'
+    upstream = upstream_scheduler.session(max_concurrent_requests, mode="stream", ticket=ticket, trace=trace)
+    buffers = [None]
+    results = [None]
+    chunk_added = asyncio.Event()
+    scheduling_done = False
+    # Chunk being sent and a signal fired each time one has been sent
+    sending_idx = 1
+    window_changed = asyncio.Event()
+    # Audio bytes and characters of the chunks synthesized so far, for estimates
+    audio_totals = [0, 0]
     start_time = time.time()
     # Number of chunks handled sequentially before switching to concurrency
     SYNC_CHUNKS = max(sync_chunks, 0)
@@ -96,114 +2000,892 @@ async def generate_streaming_audio_async(
         logger.info(f"[Streaming] Processing chunk {idx}/{total_chunks}")
         max_retries = 10
         chunk_start = time.time()
-        for attempt in range(max_retries):
-            try:
-                logger.info(
-                    f"  [Task {idx}] Attempt {attempt + 1}/{max_retries} acquiring semaphore..."
-                )
-                async with semaphore:
-                    logger.info(
-                        f"  [Task {idx}] Acquired semaphore. Starting TTS request..."
-                    )
-                    communicate = edge_tts.Communicate(text, voice)
-                    buf = bytearray()
-                    async for chunk_data in communicate.stream():
-                        if chunk_data["type"] == "audio":
-                            buf.extend(chunk_data["data"])
-                if buf:
-                    elapsed_time = time.time() - chunk_start
-                    logger.info(
-                        f"  [Task {idx}] Successfully generated in {elapsed_time:.2f}s after {attempt + 1} attempt(s)."
-                    )
-                    logger.info(
-                        f"  [Task {idx}] Done. Total retry attempts: {attempt + 1}"
-                    )
-                    buffers[idx] = bytes(buf)
-                    results[idx] = (True, attempt + 1, elapsed_time)
-                    break
-                else:
-                    raise edge_tts.NoAudioReceived("No audio was received (empty data).")
-            except Exception as e:
-                logger.warning(f"  [Task {idx}] Attempt {attempt + 1} failed: {e}")
-                if attempt + 1 == max_retries:
-                    elapsed_time = time.time() - chunk_start
-                    logger.error(
-                        f"  [Task {idx}] Failed after {max_retries} attempts. Giving up."
-                    )
+        chunk_buffer = buffers[idx]
+        # Cache reads and writes are disk IO; keep them off STREAM_LOOP.
+        cached = await asyncio.to_thread(load_cached_chunk, voice, text, rate, timeline is not None)
+        if cached:
+            logger.info(f"  [Task {idx}] Served from audio cache.")
+            METRIC_CHUNKS.inc(voice=voice, mode="stream", result="cached")
+            chunk_buffer.finish(data=cached[0], words=cached[1])
+            results[idx] = (True, 0, time.time() - chunk_start)
+            return
+
+        async def synthesize():
+            for attempt in range(max_retries):
+                try:
                     logger.info(
-                        f"  [Task {idx}] Done. Total retry attempts: {attempt + 1}"
+                        f"  [Task {idx}] Attempt {attempt + 1}/{max_retries} acquiring upstream slot..."
                     )
-                    buffers[idx] = await generate_silence_bytes()
-                    results[idx] = (False, attempt + 1, elapsed_time)
-                    break
-                wait_time = min(2 ** attempt, 8)
-                logger.info(f"  [Task {idx}] Retrying after {wait_time:.2f}s...")
-                await asyncio.sleep(wait_time)
-
-    # --- Step 1: process the first few chunks synchronously ---
-    for idx, chunk in enumerate(text_chunks[:SYNC_CHUNKS], start=1):
-        await process_chunk(idx, chunk)
-        if buffers[idx] is not None:
-            logger.info(f"Streaming chunk {idx}/{total_chunks} sent")
-            yield buffers[idx]
+                    chunk_buffer.reset()
+                    upstream_start = None
+                    async with upstream.slot(priority=idx <= SYNC_CHUNKS, chunk=idx, voice=voice):
+                        logger.info(
+                            f"  [Task {idx}] Acquired upstream slot. Starting TTS request..."
+                        )
+                        upstream_health.check()
+                        upstream_start = time.time()
+                        async for chunk_data in upstream_pool.stream(text, voice, rate):
+                            if chunk_data["type"] == "audio":
+                                chunk_buffer.feed(chunk_data["data"])
+                            elif chunk_data["type"] == "WordBoundary":
+                                chunk_buffer.words.append(word_boundary(chunk_data))
+                    if chunk_buffer.data:
+                        upstream.span("upstream", upstream_start, chunk=idx, attempt=attempt + 1, chars=len(text))
+                        upstream_health.record_success()
+                        chunk_cost_model.record(voice, len(text), time.time() - upstream_start)
+                        METRIC_UPSTREAM_SECONDS.observe(time.time() - upstream_start, voice=voice, mode="stream")
+                        METRIC_CHUNKS.inc(voice=voice, mode="stream", result="ok")
+                        elapsed_time = time.time() - chunk_start
+                        logger.info(
+                            f"  [Task {idx}] Successfully generated in {elapsed_time:.2f}s after {attempt + 1} attempt(s)."
+                        )
+                        logger.info(
+                            f"  [Task {idx}] Done. Total retry attempts: {attempt + 1}"
+                        )
+                        results[idx] = (True, attempt + 1, elapsed_time)
+                        audio = bytes(chunk_buffer.data)
+                        words = chunk_buffer.words
+                        audio_totals[0] += len(audio)
+                        audio_totals[1] += len(text)
+                        await asyncio.to_thread(store_cached_chunk, voice, text, audio, words, rate)
+                        chunk_buffer.finish()
+                        return audio, words
+                    else:
+                        raise edge_tts.NoAudioReceived("No audio was received (empty data).")
+                except Exception as e:
+                    logger.warning(f"  [Task {idx}] Attempt {attempt + 1} failed: {e}")
+                    if upstream_start is not None:
+                        upstream.span("upstream", upstream_start, chunk=idx, attempt=attempt + 1, error=str(e))
+                    fail_fast = isinstance(e, UpstreamUnavailableError)
+                    if not fail_fast:
+                        upstream_health.record_failure()
+                        chunk_cost_model.record(voice, len(text), ok=False)
+                    METRIC_RETRIES.inc(voice=voice, mode="stream")
+                    if attempt + 1 == max_retries or fail_fast:
+                        elapsed_time = time.time() - chunk_start
+                        logger.error(
+                            f"  [Task {idx}] Failed after {attempt + 1} attempts. Giving up."
+                        )
+                        logger.info(
+                            f"  [Task {idx}] Done. Total retry attempts: {attempt + 1}"
+                        )
+                        results[idx] = (False, attempt + 1, elapsed_time)
+                        METRIC_CHUNKS.inc(voice=voice, mode="stream", result="failed")
+                        chunk_buffer.finish(failed=True, data=generate_silence_bytes())
+                        return None, None
+                    wait_time = upstream_health.backoff(attempt)
+                    logger.info(f"  [Task {idx}] Retrying after {wait_time:.2f}s...")
+                    backoff_start = time.time()
+                    await asyncio.sleep(wait_time)
+                    upstream.span("retry_backoff", backoff_start, chunk=idx, attempt=attempt + 1)
 
-    # --- Step 2: launch concurrent tasks for the remaining chunks ---
-    tasks = [
-        asyncio.create_task(process_chunk(i, chunk))
-        for i, chunk in enumerate(text_chunks[SYNC_CHUNKS:], start=SYNC_CHUNKS + 1)
-    ]
+        # An identical chunk already being synthesized for another request is
+        # awaited rather than repeated; its audio arrives in one piece.
+        (audio, words), shared = await chunk_flights.run(AudioCache.make_key(voice, text, rate), synthesize)
+        if shared:
+            logger.info(f"  [Task {idx}] Shared an identical chunk synthesized for another request.")
+            results[idx] = (audio is not None, 0, time.time() - chunk_start)
+            METRIC_CHUNKS.inc(voice=voice, mode="stream", result="coalesced" if audio is not None else "failed")
+            chunk_buffer.finish(failed=audio is None, data=audio or generate_silence_bytes(), words=words)
+
+    async def reuse_chunk(idx: int, text: str, source: _ChunkBuffer):
+        """Serve a repeated chunk from the buffer of its first occurrence."""
+        chunk_start = time.time()
+        while not source.done:
+            source.changed.clear()
+            await source.changed.wait()
+        if source.failed:
+            await process_chunk(idx, text)
+            return
+        logger.info(f"  [Task {idx}] Reused the audio of an earlier occurrence.")
+        METRIC_CHUNKS.inc(voice=voice, mode="stream", result="reused")
+        results[idx] = (True, 0, time.time() - chunk_start)
+        buffers[idx].finish(data=bytes(source.data), words=source.words)
+
+    tasks = []
+    # Normalized text of a repeated chunk -> buffer of its first occurrence
+    first_occurrences = {}
+
+    def unsent_bytes() -> int:
+        return sum(
+            len(b.data) if b.done else max(len(b.data), b.estimate)
+            for b in itertools.islice(buffers, sending_idx, None)
+            if b is not None
+        )
+
+    async def schedule_chunks():
+        nonlocal total_chunks, scheduling_done
+        try:
+            for idx, chunk in enumerate(text_chunks, start=1):
+                while idx > sending_idx and (
+                    (lookahead > 0 and idx > sending_idx + lookahead)
+                    or unsent_bytes() > STREAM_BUFFER_MAX_BYTES
+                ):
+                    window_changed.clear()
+                    await window_changed.wait()
+                bytes_per_char = audio_totals[0] / audio_totals[1] if audio_totals[1] else 600
+                buffers.append(_ChunkBuffer(chunk, int(len(chunk) * bytes_per_char)))
+                results.append(None)
+                chunk_added.set()
+                source = None
+                if repeated and (key := _normalize_sentence(chunk)) in repeated:
+                    source = first_occurrences.setdefault(key, buffers[idx])
+                if source is not None and source is not buffers[idx]:
+                    tasks.append(asyncio.create_task(reuse_chunk(idx, chunk, source)))
+                    await asyncio.sleep(0)
+                elif idx <= SYNC_CHUNKS:
+                    # --- Step 1: process the first few chunks synchronously ---
+                    await process_chunk(idx, chunk)
+                else:
+                    # --- Step 2: launch concurrent tasks for the remaining chunks ---
+                    tasks.append(asyncio.create_task(process_chunk(idx, chunk)))
+                    # Let the started tasks and the consumer run between chunks
+                    # produced by a lazy text pipeline.
+                    await asyncio.sleep(0)
+        except Exception as e:
+            logger.error(f"[Streaming] Failed to prepare text chunks: {e}", exc_info=True)
+        finally:
+            total_chunks = len(buffers) - 1
+            scheduling_done = True
+            chunk_added.set()
 
-    next_idx = SYNC_CHUNKS + 1
+    scheduler = asyncio.create_task(schedule_chunks())
+    first_byte_time = None
+    bytes_out = 0
+    max_gap = 0.0
+    last_send_time = None
     try:
-        while next_idx <= total_chunks:
-            if buffers[next_idx] is not None:
-                logger.info(f"Streaming chunk {next_idx}/{total_chunks} sent")
-                yield buffers[next_idx]
-                next_idx += 1
-            else:
-                await asyncio.sleep(0.05)
+        idx = 0
+        while True:
+            idx += 1
+            while idx >= len(buffers) and not scheduling_done:
+                chunk_added.clear()
+                await chunk_added.wait()
+            if idx >= len(buffers):
+                break
+            chunk_buffer = buffers[idx]
+            # Only whole frames are forwarded. If an attempt fails after some
+            # were sent, the retry re-synthesizes the text, which need not be
+            # byte-identical: its frames are skipped up to the playing time
+            # already sent, so the client gets intact frames and the speech
+            # resumes at about the same point.
+            attempt = chunk_buffer.attempt
+            scanned = 0
+            sent_seconds = skip_seconds = 0.0
+            while True:
+                if chunk_buffer.done and chunk_buffer.failed:
+                    piece = bytes(chunk_buffer.data)
+                else:
+                    if chunk_buffer.attempt != attempt:
+                        attempt, scanned, skip_seconds = chunk_buffer.attempt, 0, sent_seconds
+                    frames, scanned_to = scan_mp3_frames(chunk_buffer.data, scanned)
+                    ranges = []
+                    for frame_start, frame_end, frame_seconds in frames:
+                        if skip_seconds > frame_seconds / 2:
+                            skip_seconds -= frame_seconds
+                            continue
+                        sent_seconds += frame_seconds
+                        if ranges and ranges[-1][1] == frame_start:
+                            ranges[-1][1] = frame_end
+                        else:
+                            ranges.append([frame_start, frame_end])
+                    scanned = scanned_to
+                    if not ranges:
+                        if chunk_buffer.done:
+                            break
+                        chunk_buffer.changed.clear()
+                        await chunk_buffer.changed.wait()
+                        continue
+                    piece = b"".join(chunk_buffer.data[start:end] for start, end in ranges)
+                now = time.time()
+                if first_byte_time is None:
+                    first_byte_time = now - start_time
+                    METRIC_STREAM_TTFB_SECONDS.observe(first_byte_time, voice=voice)
+                    upstream.span("first_byte", start_time)
+                elif last_send_time is not None:
+                    max_gap = max(max_gap, now - last_send_time)
+                bytes_out += len(piece)
+                yield piece
+                last_send_time = time.time()
+                if chunk_buffer.failed:
+                    break
+            logger.info(f"Streaming chunk {idx}/{total_chunks} sent")
+            if timeline is not None:
+                timeline.add(idx - 1, chunk_buffer.text, chunk_buffer.data, chunk_buffer.words)
+            buffers[idx] = None
+            sending_idx = idx + 1
+            window_changed.set()
     finally:
-        await asyncio.gather(*tasks, return_exceptions=True)
+        # Only chunks nobody will receive are still pending here.
+        pending = [task for task in tasks if not task.done()]
+        scheduler.cancel()
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(scheduler, *pending, return_exceptions=True)
+        upstream.close()
+        if pending:
+            logger.info(f"[Streaming] Client went away: cancelled {len(pending)} pending chunk(s).")
+            METRIC_CHUNKS.inc(len(pending), voice=voice, mode="stream", result="cancelled")
         total_time = time.time() - start_time
+        METRIC_REQUEST_SECONDS.observe(total_time, voice=voice, mode="stream")
+        METRIC_BYTES_OUT.inc(bytes_out, voice=voice, mode="stream")
+        METRIC_RESPONSE_BYTES.observe(bytes_out, voice=voice, mode="stream")
         durations = [r[2] for r in results[1:] if r]
         total_attempts = sum(r[1] for r in results[1:] if r)
         avg_time = sum(durations) / len(durations) if durations else 0
         concurrency = (sum(durations) / total_time) if total_time > 0 else 0
         failed_indices = [idx for idx, r in enumerate(results[1:], start=1) if r and not r[0]]
+        if outcome is not None:
+            outcome["failed"] = len(failed_indices)
+        if trace is not None:
+            trace.set(chunks=total_chunks, failed=len(failed_indices), cancelled=len(pending))
         logger.info(
             f"All TTS tasks completed in {total_time:.2f}s. Average chunk time: {avg_time:.2f}s. Achieved concurrency: {concurrency:.2f}x"
         )
         logger.info(f"Total retry attempts across all tasks: {total_attempts}")
+        if first_byte_time is not None:
+            logger.info(f"Time to first byte: {first_byte_time:.3f}s. Max inter-send gap: {max_gap:.3f}s")
+        cache_stats = audio_cache.stats()
+        logger.info(f"Audio cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['bytes']} bytes stored")
         logger.info("=" * 50)
         logger.info("TTS Request Summary:")
         logger.info(f"  - Total Chunks: {total_chunks}")
-        logger.info(f"  - Successful Chunks: {total_chunks - len(failed_indices)}")
+        succeeded = sum(1 for r in results[1:] if r and r[0])
+        logger.info(f"  - Successful Chunks: {succeeded}")
         logger.info(f"  - Failed Chunks: {len(failed_indices)}")
+        if succeeded + len(failed_indices) < total_chunks:
+            logger.info(f"  - Unfinished Chunks: {total_chunks - succeeded - len(failed_indices)}")
         if failed_indices:
             logger.warning(f"  - Indices of Failed Chunks: {failed_indices}")
         logger.info(f"  - Total Processing Time: {total_time:.2f}s")
         logger.info("=" * 50)
 
-def generate_streaming_audio_sync(
+class AudioStream:
+    """Streaming response body for both serving modes.
+
+    WSGI servers iterate it synchronously; every chunk is fetched from the
+    generator running on ``STREAM_LOOP``. The ASGI bridge, which itself runs
+    on ``STREAM_LOOP``, iterates the async generator directly.
+    """
+
+    def __init__(self, agen, loop):
+        self.agen = agen
+        self.loop = loop
+
+    def __iter__(self):
+        while True:
+            future = asyncio.run_coroutine_threadsafe(self.agen.__anext__(), self.loop)
+            try:
+                chunk = future.result()
+            except StopAsyncIteration:
+                break
+            yield chunk
+
+    def __aiter__(self):
+        if asyncio.get_running_loop() is not self.loop:
+            raise RuntimeError("AudioStream can only be iterated asynchronously on its own loop.")
+        return self.agen
+
+    def close(self):
+        """Close the generator; WSGI servers call this when the client disconnects."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self.loop.create_task(self.agen.aclose())
+        else:
+            asyncio.run_coroutine_threadsafe(self.agen.aclose(), self.loop)
+
+
+def generate_streaming_audio_pipeline(
     text_chunks,
     voice,
     sync_chunks: int = 1,
     max_concurrent_requests: int | None = None,
+    rate: str = "+0%",
+    response_format: str = "mp3",
+    tempo: float = 1.0,
+    cache_key: str | None = None,
+    repeated: set | None = None,
+    lookahead: int = 0,
+    timeline: WordTimeline | None = None,
+    ticket: AdmissionTicket | None = None,
+    trace: RequestTrace | None = None,
 ):
-    async_iter = generate_streaming_audio_async(
-        text_chunks, voice, sync_chunks, max_concurrent_requests
-    ).__aiter__()
+    """Return the async generator of a streaming response: synthesis, then encoding and caching if needed.
+
+    With a ``timeline`` the audio is framed as server-sent events carrying
+    the word timings (see ``sse_speech_events``).
+    """
+    outcome = {}
+    agen = generate_streaming_audio_async(
+        text_chunks, voice, sync_chunks, max_concurrent_requests, rate, outcome, repeated, lookahead, timeline, ticket,
+        trace)
+    if needs_transcoding(response_format, tempo):
+        agen = audio_transcoder.stream(agen, response_format, tempo)
+        if cache_key:
+            agen = _cache_transcoded_stream(agen, cache_key, outcome)
+    if timeline is not None:
+        agen = sse_speech_events(agen, timeline)
+    return agen
+
+
+# --- 音频转码 ---
+class TranscodeError(Exception):
+    """Raised when the encoder fails to produce the requested format."""
+
+
+class AudioTranscoder:
+    """Re-encodes the synthesized MP3 into the requested ``response_format``.
+
+    Encoding runs in ffmpeg processes driven from ``STREAM_LOOP``: MP3 is
+    written to stdin as it is synthesized and encoded bytes are read back
+    from stdout, so streaming responses stay streaming. One ffmpeg process
+    encodes exactly one output stream, so rather than starting it when a
+    request arrives the transcoder keeps ``spares`` encoders per format
+    already running and blocked on stdin; a request takes a warm encoder and
+    a replacement is started in the background. This only hides process
+    startup: every request still gets a fresh process, and requests beyond
+    the spares wait for one to start.
 
-    def sync_gen():
+    ``tempo`` is the part of the requested speed that the upstream prosody
+    rate cannot express (see ``speed_to_prosody``); it is applied with
+    ffmpeg's ``atempo`` filter and such encoders are not kept warm.
+    """
+
+    # response_format -> (content type, ffmpeg output options)
+    FORMATS = {
+        "mp3": ("audio/mpeg", ["-c:a", "libmp3lame", "-b:a", "48k", "-f", "mp3"]),
+        "opus": ("audio/opus", ["-c:a", "libopus", "-b:a", "32k", "-f", "ogg"]),
+        "aac": ("audio/aac", ["-c:a", "aac", "-b:a", "64k", "-f", "adts"]),
+        "flac": ("audio/flac", ["-c:a", "flac", "-f", "flac"]),
+        "wav": ("audio/wav", ["-c:a", "pcm_s16le", "-f", "wav"]),
+        "pcm": ("audio/pcm", ["-c:a", "pcm_s16le", "-f", "s16le"]),
+    }
+    READ_SIZE = 16384
+    FEED_SIZE = 262144
+
+    def __init__(self, loop, ffmpeg: str | None = None, spares: int = 1):
+        self.loop = loop
+        self.ffmpeg = ffmpeg or shutil.which("ffmpeg")
+        self.spares = spares
+        self.spawned = 0
+        self.warm_hits = 0
+        self._warm = defaultdict(deque)
+        self._filling = set()
+        # format -> [streams, encodes, encoded input bytes, encode seconds]
+        self._totals = defaultdict(lambda: [0, 0, 0, 0.0])
+
+    @property
+    def available(self) -> bool:
+        return self.ffmpeg is not None
+
+    @classmethod
+    def content_type(cls, response_format: str) -> str:
+        return cls.FORMATS[response_format][0]
+
+    def _command(self, response_format: str, tempo: float):
+        filters = ["-filter:a", f"atempo={tempo:.4f}"] if tempo != 1.0 else []
+        return [
+            self.ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "mp3", "-i", "pipe:0",
+            *filters, "-ar", "24000", "-ac", "1", *self.FORMATS[response_format][1], "pipe:1",
+        ]
+
+    async def _spawn(self, response_format: str, tempo: float):
+        proc = await asyncio.create_subprocess_exec(
+            *self._command(response_format, tempo),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        self.spawned += 1
+        return proc
+
+    async def _fill(self, response_format: str):
+        warm = self._warm[response_format]
+        try:
+            while len(warm) < self.spares:
+                warm.append(await self._spawn(response_format, 1.0))
+        except Exception as e:
+            logger.warning(f"[Transcode] Failed to start a spare {response_format} encoder: {e}")
+        finally:
+            self._filling.discard(response_format)
+
+    def _replenish(self, response_format: str):
+        if self.spares > 0 and response_format not in self._filling:
+            self._filling.add(response_format)
+            self.loop.create_task(self._fill(response_format))
+
+    async def _acquire(self, response_format: str, tempo: float):
+        if tempo == 1.0:
+            warm = self._warm[response_format]
+            self._replenish(response_format)
+            while warm:
+                proc = warm.popleft()
+                if proc.returncode is None:
+                    self.warm_hits += 1
+                    return proc
+        return await self._spawn(response_format, tempo)
+
+    async def stream(self, chunks, response_format: str, tempo: float = 1.0, mode: str = "stream"):
+        """Yield ``response_format`` audio while MP3 from the async iterable ``chunks`` is encoded."""
+        proc = await self._acquire(response_format, tempo)
+        fed = 0
+
+        async def feed():
+            nonlocal fed
+            try:
+                async for chunk in chunks:
+                    proc.stdin.write(chunk)
+                    fed += len(chunk)
+                    await proc.stdin.drain()
+            finally:
+                proc.stdin.close()
+
+        feeder = asyncio.create_task(feed())
+        try:
+            while data := await proc.stdout.read(self.READ_SIZE):
+                yield data
+            if await proc.wait() != 0:
+                stderr = (await proc.stderr.read()).decode('utf-8', errors='replace').strip()
+                raise TranscodeError(f"ffmpeg exited with status {proc.returncode}: {stderr}")
+            # Surfaces errors raised by the source of ``chunks``.
+            await feeder
+            self._totals[response_format][0] += 1
+        finally:
+            if not feeder.done():
+                feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+            METRIC_TRANSCODE_BYTES.inc(fed, format=response_format, mode=mode)
+
+    async def _encode(self, src, out, response_format: str, tempo: float):
+        """Encode the MP3 file ``src`` block by block into the writable ``out``."""
+        fed = 0
+
+        async def source():
+            nonlocal fed
+            while block := await asyncio.to_thread(src.read, self.FEED_SIZE):
+                fed += len(block)
+                yield block
+
+        start = time.perf_counter()
+        async for piece in self.stream(source(), response_format, tempo, mode="full"):
+            out.write(piece)
+        elapsed = time.perf_counter() - start
+        METRIC_TRANSCODE_SECONDS.observe(elapsed, format=response_format)
+        totals = self._totals[response_format]
+        totals[1] += 1
+        totals[2] += fed
+        totals[3] += elapsed
+
+    async def _run(self, coro):
+        if asyncio.get_running_loop() is self.loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    async def encode(self, data: bytes, response_format: str, tempo: float = 1.0) -> bytes:
+        """Return the MP3 ``data`` re-encoded; safe to await from any event loop."""
+        out = BytesIO()
+        await self._run(self._encode(BytesIO(data), out, response_format, tempo))
+        return out.getvalue()
+
+    async def encode_file(self, src, response_format: str, tempo: float = 1.0) -> "AudioSpool":
+        """Re-encode the MP3 file ``src`` into a new ``AudioSpool``; the caller closes it."""
+        out = AudioSpool(OUTPUT_SPOOL_THRESHOLD)
+        try:
+            await self._run(self._encode(src, out, response_format, tempo))
+        except BaseException:
+            out.close()
+            raise
+        return out
+
+    def shutdown(self):
+        for warm in self._warm.values():
+            for proc in warm:
+                if proc.returncode is None:
+                    try:
+                        proc.kill()
+                    except ProcessLookupError:
+                        pass
+
+    def stats(self) -> dict:
+        formats = {}
+        for response_format, (streams, encodes, encoded_bytes, seconds) in self._totals.items():
+            formats[response_format] = {
+                "streams": streams,
+                "encodes": encodes,
+                "encoded_input_bytes": encoded_bytes,
+                "encode_seconds": round(seconds, 6),
+                # MP3 input consumed per second of encoding, complete responses only.
+                "input_bytes_per_second": round(encoded_bytes / seconds) if seconds > 0 else None,
+            }
+        return {
+            "available": self.available,
+            "spares": self.spares,
+            "spawned": self.spawned,
+            "warm_hits": self.warm_hits,
+            "formats": formats,
+        }
+
+
+audio_transcoder = AudioTranscoder(STREAM_LOOP)
+atexit.register(audio_transcoder.shutdown)
+transcode_cache = AudioCache(TRANSCODE_CACHE_DIR, 0, suffix='.bin')
+
+
+def needs_transcoding(response_format: str, tempo: float) -> bool:
+    return response_format != "mp3" or tempo != 1.0
+
+
+def speed_to_prosody(speed: float) -> tuple[str, float]:
+    """Split an OpenAI ``speed`` into an upstream prosody rate and a residual tempo.
+
+    Edge voices render 0.5x to 2x natively, which sounds better than
+    time-stretching; only speeds outside that range leave a tempo factor for
+    the encoder.
+    """
+    native = min(max(speed, 0.5), 2.0)
+    return f"{round((native - 1) * 100):+d}%", round(speed / native, 4)
+
+
+def transcode_cache_key(voice: str, text: str, cleaning_options, max_chunk_len: int,
+                        response_format: str, speed: float) -> str:
+    payload = json.dumps([voice, text, cleaning_options, max_chunk_len, response_format, speed],
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+async def _cache_transcoded_stream(agen, key: str, outcome: dict):
+    """Pass encoded audio through and cache it once the stream completes cleanly.
+
+    The copy is spooled like a complete response, so caching a long stream
+    does not hold it in memory.
+    """
+    spool = AudioSpool(OUTPUT_SPOOL_THRESHOLD)
+    try:
+        try:
+            async for piece in agen:
+                if spool is not None:
+                    spool.write(piece)
+                    if spool.size > transcode_cache.max_bytes:
+                        spool.close()
+                        spool = None
+                yield piece
+        finally:
+            await agen.aclose()
+        if spool is not None and spool.size and not outcome.get("failed"):
+            await asyncio.to_thread(transcode_cache.store_file, key, spool.finish(), spool.size)
+    finally:
+        if spool is not None:
+            spool.close()
+
+
+# --- 请求合并 ---
+class SingleFlight:
+    """Registry of in-flight work keyed by its inputs, shared by every event loop.
+
+    ``join`` gives the first caller for a key a new flight and every later
+    caller the same one until the leader calls ``leave``. Callers that stop
+    early ``release`` their hold; the last one to do so learns that nobody
+    is waiting for the flight any more. ``run`` coalesces awaitable work the
+    same way: concurrent callers share one result, and if the leader is
+    cancelled a waiting follower takes over.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def join(self, key, create):
+        """Return ``(flight, leader)`` for ``key``, creating the flight with ``create()`` if there is none."""
+        with self._lock:
+            entry = self._flights.get(key)
+            if entry is not None:
+                entry[1] += 1
+                self.followers += 1
+                return entry[0], False
+            flight = create()
+            # [flight, callers holding it]
+            self._flights[key] = [flight, 1]
+            self.leaders += 1
+            return flight, True
+
+    def leave(self, key, flight):
+        with self._lock:
+            entry = self._flights.get(key)
+            if entry is not None and entry[0] is flight:
+                del self._flights[key]
+
+    def release(self, key, flight) -> bool:
+        """Drop one hold on a running ``flight``; return ``True`` if it was the last (the flight is forgotten)."""
+        with self._lock:
+            entry = self._flights.get(key)
+            if entry is None or entry[0] is not flight:
+                return False
+            entry[1] -= 1
+            if entry[1] > 0:
+                return False
+            del self._flights[key]
+            return True
+
+    async def run(self, key, factory) -> tuple:
+        """Return ``(result, shared)`` of ``await factory()``, running one call per key at a time."""
         while True:
-            future = asyncio.run_coroutine_threadsafe(async_iter.__anext__(), STREAM_LOOP)
+            future, leader = self.join(key, concurrent.futures.Future)
+            if leader:
+                break
             try:
-                chunk = future.result()
-            except StopAsyncIteration:
+                return await asyncio.shield(asyncio.wrap_future(future)), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+        try:
+            result = await factory()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self.leave(key, future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._flights), "leaders": self.leaders, "followers": self.followers}
+
+
+class OutputBroadcast:
+    """Response body of one generation, shared by identical concurrent requests.
+
+    The output goes into an ``AudioSpool``: a streaming generation is pumped
+    into it piece by piece on ``STREAM_LOOP``, a complete response is
+    published once finished. Every subscriber, the leader's own client
+    included, replays the spool from the start and then follows the live
+    output, so a request that attaches late still gets the whole response.
+    The pump only pauses while even the furthest subscriber is more than
+    ``max_behind`` bytes behind (``STREAM_BUFFER_MAX_BYTES`` by default), and
+    is cancelled by ``cancel`` once no client is left.
+    """
+
+    BLOCK_SIZE = 65536
+
+    def __init__(self, max_behind: int | None = None):
+        self.max_behind = max_behind
+        self.spool = AudioSpool(OUTPUT_SPOOL_THRESHOLD)
+        # (message, status) or the exception a failed generation ended with
+        self.error = None
+        self.exception = None
+        # Word timings published with a complete output, if they were requested
+        self.timeline = None
+        self.done = concurrent.futures.Future()
+        self._lock = threading.Lock()
+        # subscriber -> bytes it has read
+        self._offsets = {}
+        self._changed = asyncio.Event()
+        self._progress = asyncio.Event()
+        self._pump_future = None
+        self._pump_started = False
+
+    def start(self, agen, on_finish):
+        """Pump the async generator ``agen`` into the spool on ``STREAM_LOOP``.
+
+        ``on_finish`` runs once the pump has ended, even if it was cancelled
+        before it started: a coroutine cancelled that early never runs its
+        ``finally``, so the broadcast is completed from the future instead.
+        """
+        self._pump_future = asyncio.run_coroutine_threadsafe(self._pump(agen), STREAM_LOOP)
+        self._pump_future.add_done_callback(lambda _: self._finish(agen, on_finish))
+
+    def _finish(self, agen, on_finish):
+        if not self._pump_started:
+            asyncio.run_coroutine_threadsafe(agen.aclose(), STREAM_LOOP)
+        if not self.done.done():
+            self.done.set_result(None)
+        # Runs on whichever thread completed or cancelled the pump.
+        STREAM_LOOP.call_soon_threadsafe(self._changed.set)
+        on_finish()
+
+    def cancel(self):
+        """Stop the generation, cancelling its pending chunks."""
+        if self._pump_future is not None:
+            self._pump_future.cancel()
+
+    def _behind(self) -> int:
+        with self._lock:
+            return self.spool.size - max(self._offsets.values()) if self._offsets else 0
+
+    async def _pump(self, agen):
+        self._pump_started = True
+        max_behind = STREAM_BUFFER_MAX_BYTES if self.max_behind is None else self.max_behind
+        try:
+            async for piece in agen:
+                while self._behind() > max_behind:
+                    self._progress.clear()
+                    await self._progress.wait()
+                with self._lock:
+                    self.spool.write(piece)
+                self._changed.set()
+        except Exception as e:
+            logger.error(f"Shared streaming generation failed: {e}")
+            self.exception = e
+        finally:
+            await agen.aclose()
+
+    def publish(self, spool: AudioSpool, timeline: WordTimeline | None = None):
+        """Complete the broadcast with the finished output ``spool``."""
+        with self._lock:
+            self.spool.close()
+            self.spool = spool
+        self.timeline = timeline
+        if not self.done.done():
+            self.done.set_result(None)
+
+    def fail(self, message: str, status: int):
+        if not self.done.done():
+            self.error = (message, status)
+            self.done.set_result(None)
+
+    async def wait(self):
+        await asyncio.shield(asyncio.wrap_future(self.done))
+
+    def subscribe(self, on_close=lambda: None) -> "_BroadcastSubscription":
+        """Return an async iterator over the whole output that follows a streaming generation live.
+
+        ``on_close`` runs once the subscriber finishes or is closed early.
+        """
+        return _BroadcastSubscription(self, on_close)
+
+    def iter_blocks(self, block_size: int | None = None):
+        """Yield a published output block by block; safe alongside other readers."""
+        offset = 0
+        while True:
+            with self._lock:
+                data = self.spool.read_at(offset, block_size or self.BLOCK_SIZE)
+            if not data:
                 break
-            yield chunk
+            offset += len(data)
+            yield data
+
+
+class _BroadcastSubscription:
+    """One client's read position in an ``OutputBroadcast``.
+
+    A plain async iterator rather than an async generator so that ``aclose``
+    detaches the client even if it never started reading.
+    """
+
+    def __init__(self, broadcast: OutputBroadcast, on_close):
+        self.broadcast = broadcast
+        self.offset = 0
+        self._on_close = on_close
+        self._closed = False
+        with broadcast._lock:
+            broadcast._offsets[self] = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        broadcast = self.broadcast
+        while not self._closed:
+            with broadcast._lock:
+                size = broadcast.spool.size
+                data = broadcast.spool.read_at(self.offset, broadcast.BLOCK_SIZE) if self.offset < size else b""
+                self.offset += len(data)
+                broadcast._offsets[self] = self.offset
+            if data:
+                broadcast._progress.set()
+                return data
+            if broadcast.done.done():
+                break
+            broadcast._changed.clear()
+            await broadcast._changed.wait()
+        await self.aclose()
+        if broadcast.exception is not None:
+            raise broadcast.exception
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        with self.broadcast._lock:
+            del self.broadcast._offsets[self]
+        self.broadcast._progress.set()
+        self._on_close()
+
+
+request_flights = SingleFlight()
+chunk_flights = SingleFlight()
 
-    return sync_gen()
+
+# --- 声音目录 ---
+class VoiceCatalog:
+    """Compiled index of the voices listed in ``voices_list.txt``.
+
+    Built once by ``parse_voices``: voices are indexed by name
+    (case-insensitive), and the voice list of every locale/gender filter is
+    precomputed, so lookups and filtered queries are dictionary hits. The
+    JSON body and ETag of each listing are rendered on first use and reused.
+    An empty catalog (voice list missing) accepts any well-formed voice name.
+    """
+
+    def __init__(self, voices=()):
+        self.voices = list(voices)
+        self._by_name = {v["name"].lower(): v for v in self.voices}
+        # (locale or None, gender or None) -> voices; None matches any value
+        self._index = defaultdict(list)
+        for voice in self.voices:
+            locale, gender = voice["locale"].lower(), voice["gender"].lower()
+            for key in ((None, None), (locale, None), (None, gender), (locale, gender)):
+                self._index[key].append(voice)
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.voices)
+
+    def get(self, name: str) -> dict | None:
+        return self._by_name.get(str(name).lower())
+
+    def resolve(self, name: str) -> str | None:
+        """Return the canonical spelling of ``name``, or ``None`` if it is not a known voice."""
+        if not self.voices:
+            return name if _VOICE_NAME_PATTERN.fullmatch(str(name)) else None
+        voice = self.get(name)
+        return voice["name"] if voice else None
+
+    @staticmethod
+    def _filter_key(locale: str | None, gender: str | None) -> tuple:
+        return (locale.lower() if locale else None, gender.lower() if gender else None)
+
+    def filter(self, locale: str | None = None, gender: str | None = None) -> list:
+        return self._index.get(self._filter_key(locale, gender), [])
+
+    def listing(self, locale: str | None = None, gender: str | None = None) -> tuple[bytes, str]:
+        """Return the JSON body and ETag of the voices matching the filter."""
+        key = self._filter_key(locale, gender)
+        with self._lock:
+            cached = self._listings.get(key)
+        if cached is None:
+            body = app.json.dumps(self._index.get(key, [])).encode('utf-8')
+            cached = (body, hashlib.sha256(body).hexdigest()[:32])
+            with self._lock:
+                self._listings[key] = cached
+        return cached
+
+
+voice_catalog = VoiceCatalog()
 
 
 # --- 数据加载与管理 ---
@@ -213,10 +2895,63 @@ def load_config_from_file():
     except (FileNotFoundError, json.JSONDecodeError): return None
 
 def save_config_to_file(data):
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f: json.dump(data, f, indent=4, ensure_ascii=False)
+    # Written atomically: other worker processes may be reloading it.
+    tmp_path = f"{CONFIG_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, CONFIG_FILE)
+
+def apply_runtime_config():
+    """Push the current ``config`` into the module-level settings and components."""
+    global MAX_CONCURRENT_REQUESTS, CHUNK_SIZE, SYNC_CHUNKS, OUTPUT_SPOOL_THRESHOLD, STREAM_BUFFER_MAX_BYTES, STREAM_LOOKAHEAD_CHUNKS, TRACE_LOG_SPANS, _config_mtime
+    MAX_CONCURRENT_REQUESTS = config.get("max_concurrent_requests", 20)
+    CHUNK_SIZE = config.get("chunk_size", 300)
+    SYNC_CHUNKS = config.get("sync_chunks", 1)
+    OUTPUT_SPOOL_THRESHOLD = max(int(config.get("output_spool_threshold_bytes", 8 * 1024 * 1024)), 0)
+    STREAM_BUFFER_MAX_BYTES = max(int(config.get("stream_buffer_max_bytes", 16 * 1024 * 1024)), 0)
+    STREAM_LOOKAHEAD_CHUNKS = max(int(config.get("stream_lookahead_chunks", 0)), 0)
+    TRACE_LOG_SPANS = bool(config.get("trace_log_spans", True))
+    upstream_scheduler.set_limit(MAX_CONCURRENT_REQUESTS)
+    if upstream_scheduler.budget is not None:
+        upstream_scheduler.budget.set_limit(MAX_CONCURRENT_REQUESTS)
+    upstream_pool.enabled = bool(config.get("upstream_connection_reuse", True))
+    job_manager.max_active = max(int(config.get("max_active_jobs", 2)), 1)
+    job_manager.retention = float(config.get("job_retention_hours", 24)) * 3600
+    admission.configure(
+        config.get("admission_slo_seconds", 60),
+        config.get("admission_stream_slo_seconds", 10),
+        config.get("admission_client_max_chars", 0),
+        config.get("admission_client_quotas", {}),
+    )
+    audio_cache.resize(config.get("audio_cache_max_bytes", AUDIO_CACHE_MAX_BYTES))
+    # Timings take a small fraction of the space of the audio they describe.
+    word_cache.resize(audio_cache.max_bytes // 16)
+    transcode_cache.resize(config.get("transcode_cache_max_bytes", TRANSCODE_CACHE_MAX_BYTES))
+    try:
+        _config_mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    except OSError:
+        pass
+
+def reload_config_if_changed():
+    """Pick up ``config.json`` changes saved by another worker process."""
+    global config, _config_checked_at
+    now = time.time()
+    if now - _config_checked_at < CONFIG_RELOAD_INTERVAL:
+        return
+    _config_checked_at = now
+    try:
+        if os.stat(CONFIG_FILE).st_mtime_ns == _config_mtime:
+            return
+    except OSError:
+        return
+    loaded_config = load_config_from_file()
+    if loaded_config is None:
+        return
+    config = loaded_config
+    apply_runtime_config()
+    logger.info(f"[CONFIG RELOADED] Picked up changes to '{CONFIG_FILE}'.")
 
 def initialize_config():
-    global config, MAX_CONCURRENT_REQUESTS, CHUNK_SIZE, SYNC_CHUNKS
+    global config
     default_config = {
         "port": 5050,
         "api_token": "",
@@ -224,6 +2959,24 @@ def initialize_config():
         "chunk_size": 300,
         "sync_chunks": 1,
         "sync_api_filtering": True,
+        "adaptive_chunking": False,
+        "audio_cache_max_bytes": AUDIO_CACHE_MAX_BYTES,
+        "transcode_cache_max_bytes": TRANSCODE_CACHE_MAX_BYTES,
+        "output_spool_threshold_bytes": OUTPUT_SPOOL_THRESHOLD,
+        "stream_buffer_max_bytes": STREAM_BUFFER_MAX_BYTES,
+        "stream_lookahead_chunks": STREAM_LOOKAHEAD_CHUNKS,
+        "admission_slo_seconds": 60,
+        "admission_stream_slo_seconds": 10,
+        "admission_client_max_chars": 0,
+        "admission_client_quotas": {},
+        "trace_log_spans": TRACE_LOG_SPANS,
+        "upstream_connection_reuse": True,
+        "max_active_jobs": 2,
+        "job_retention_hours": 24,
+        "server_mode": "flask",
+        "workers": 1,
+        "worker_admin_port_base": 0,
+        "worker_admin_host": "127.0.0.1",
         "default_cleaning_options": {
             "remove_markdown": True, "remove_emoji": True,
             "no_urls": True, "no_line_breaks": False, "custom_keywords": ""
@@ -243,15 +2996,18 @@ def initialize_config():
                 updated = True
         config = loaded_config
         if updated: save_config_to_file(config)
-    MAX_CONCURRENT_REQUESTS = config.get("max_concurrent_requests", 20)
-    CHUNK_SIZE = config.get("chunk_size", 300)
-    SYNC_CHUNKS = config.get("sync_chunks", 1)
+    apply_runtime_config()
+    if not audio_transcoder.available:
+        logger.warning("ffmpeg not found: only response_format 'mp3' at speeds 0.5-2.0 can be served.")
+    if TTSConfig is None:
+        logger.warning("The installed edge-tts lacks the helpers the connection pool builds on; "
+                       "every chunk opens its own upstream connection.")
     logger.info(
         f"Configuration loaded. Port: {config.get('port')} - Max concurrent requests: {MAX_CONCURRENT_REQUESTS} - Chunk size: {CHUNK_SIZE} - Sync chunks: {SYNC_CHUNKS}"
     )
 
 def parse_voices():
-    global ALL_VOICES, SUPPORTED_LOCALES
+    global voice_catalog, SUPPORTED_LOCALES
     try:
         with open(VOICES_LIST_FILE, 'r', encoding='utf-8') as f: voices_raw_data = f.read()
         with open(LOCALES_MAP_FILE, 'r', encoding='utf-8') as f: locale_display_names = json.load(f)
@@ -260,6 +3016,7 @@ def parse_voices():
         return
 
     lines = voices_raw_data.strip().split('\n')
+    voices = []
     locales_with_voices = defaultdict(list)
     for line in lines[2:]:
         parts = line.split()
@@ -269,14 +3026,16 @@ def parse_voices():
             locale_parts = name.split('-')
             locale = f"{locale_parts[0]}-{locale_parts[1]}"
             voice_data = {"name": name, "gender": parts[1], "locale": locale, "short_name": '-'.join(locale_parts[2:])}
-            ALL_VOICES.append(voice_data)
+            voices.append(voice_data)
             locales_with_voices[locale].append(voice_data)
         except IndexError: logger.warning(f"Could not parse voice line: {line}")
+    voice_catalog = VoiceCatalog(voices)
     
     sorted_locales = sorted(locales_with_voices.keys(), key=lambda x: (x not in ['zh-CN', 'en-US'], locale_display_names.get(x, x)))
     for locale in sorted_locales:
         display_name = locale_display_names.get(locale, locale)
         SUPPORTED_LOCALES[locale] = display_name
+    logger.info(f"Voice catalog ready: {len(voice_catalog)} voices in {len(SUPPORTED_LOCALES)} locales.")
 
 # --- 认证装饰器 ---
 def token_required(f):
@@ -291,6 +3050,16 @@ def token_required(f):
         return await f(*args, **kwargs)
     return decorated_function
 
+def operator_token_required(f):
+    """``token_required`` for operator endpoints, which do not exist while no API token is configured."""
+    guarded = token_required(f)
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if not config.get('api_token'):
+            return jsonify({"error": {"message": "Not found."}}), 404
+        return await guarded(*args, **kwargs)
+    return decorated_function
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -301,54 +3070,209 @@ def login_required(f):
     return decorated_function
 
 # --- 核心业务逻辑 ---
+_MARKDOWN_PATTERNS = [
+    (re.compile(r'\[!\[([^\]]*)\]\([^\)]+\)\]\([^\)]+\)'), r'\1'),
+    (re.compile(r'!\[([^\]]*)\]\([^\)]+\)'), r'\1'),
+    (re.compile(r'\[([^\]]+)\]\([^\)]+\)'), r'\1'),
+    (re.compile(r'```[\s\S]*?```'), ''),
+    (re.compile(r'`([^`]+)`'), r'\1'),
+    (re.compile(r'(\*\*|__)(.*?)\1'), r'\2'),
+    (re.compile(r'(\*|_)(.*?)\1'), r'\2'),
+    (re.compile(r'^\s*#+\s*', re.MULTILINE), ''),
+    (re.compile(r'^\s*[\*\-]\s*|\s*\d+\.\s*', re.MULTILINE), ''),
+    (re.compile(r'^\s*>\s?', re.MULTILINE), ''),
+    (re.compile(r'^\s*[-*_]{3,}\s*$', re.MULTILINE), ''),
+]
+# ``https\S+`` is covered by ``http\S+``, so the original three-way alternation collapses to two.
+_URL_PATTERN = re.compile(r'(?:http|www)\S+')
+_LINE_BREAK_PATTERN = re.compile(r'\s*\n\s*')
+_SENTENCE_END_CHARS = frozenset('。？！?!')
+_LEADING_NUMBER_PATTERN = re.compile(r'\s*\d+\.')
+_TRAILING_NUMBER_PATTERN = re.compile(r'\d+\.\s*$')
+_SPACING_AFTER_CHARS = frozenset('，。、？！；：（《「『')
+_SPACING_BEFORE_CHARS = frozenset('，。、？！；：）》」』')
+# The five whitespace passes that used to run one after another (between Chinese
+# characters, around Chinese punctuation, after opening / before closing
+# brackets) each delete a whole whitespace run based only on its non-space
+# neighbours, so they are fused into one alternation with identical results.
+_CJK_SPACING_PATTERN = re.compile(
+    r'(?<=[，。、？！；：（《「『])\s+'
+    r'|\s+(?=[，。、？！；：）》」』])'
+    r'|(?<=[\u4e00-\u9fff])\s+(?=[\u4e00-\u9fff])'
+)
+_MULTI_SPACE_PATTERN = re.compile(r' {2,}')
+# Every emoji sequence contains at least one non-ASCII character from this set,
+# so text without any of them can skip the (slow) emoji tokenizer entirely.
+_EMOJI_CHARS = frozenset(c for e in emoji.EMOJI_DATA for c in e if ord(c) >= 128)
+# Keyword lists at least this long are matched with an Aho-Corasick automaton;
+# below that the C regex engine's alternation is faster than a Python automaton.
+AHO_CORASICK_MIN_KEYWORDS = 128
+
+
+class KeywordAutomaton:
+    """Aho-Corasick matcher that removes keywords like ``re.sub('k1|k2|...', '')``.
+
+    Matches are chosen exactly as the regex alternation would: scanning left to
+    right, the earliest start wins, ties at one start go to the keyword listed
+    first, and scanning resumes after the removed match.
+    """
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.keywords = keywords
+        for priority, keyword in enumerate(keywords):
+            state = 0
+            for ch in keyword:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = nxt
+            self.output[state].append(priority)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def remove(self, text: str) -> str:
+        goto, fail, output, keywords = self.goto, self.fail, self.output, self.keywords
+        best = {}
+        state = 0
+        for end, ch in enumerate(text, 1):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for priority in output[state]:
+                start = end - len(keywords[priority])
+                current = best.get(start)
+                if current is None or priority < current:
+                    best[start] = priority
+        if not best:
+            return text
+        parts = []
+        pos = 0
+        for start in sorted(best):
+            if start < pos: continue
+            parts.append(text[pos:start])
+            pos = start + len(keywords[best[start]])
+        parts.append(text[pos:])
+        return ''.join(parts)
+
+
+class TextCleaner:
+    """Cleaning pipeline for one set of cleaning options, compiled once.
+
+    Produces exactly the same output as the original pass-by-pass cleaning but
+    reuses precompiled patterns, fuses the trailing whitespace passes and keeps
+    the custom-keyword matcher between requests.
+    """
+
+    def __init__(self, remove_markdown: bool, remove_emoji: bool, no_urls: bool,
+                 no_line_breaks: bool, custom_keywords: str):
+        self.remove_markdown = remove_markdown
+        self.remove_emoji = remove_emoji
+        self.no_urls = no_urls
+        self.no_line_breaks = no_line_breaks
+        self.keyword_remover = None
+        keywords = [k.strip() for k in custom_keywords.split(',') if k.strip()] if custom_keywords else []
+        if len(keywords) >= AHO_CORASICK_MIN_KEYWORDS:
+            self.keyword_remover = KeywordAutomaton(keywords).remove
+        elif keywords:
+            keyword_pattern = re.compile('|'.join(re.escape(k) for k in keywords))
+            self.keyword_remover = lambda text: keyword_pattern.sub('', text)
+
+    @staticmethod
+    def _join_lines(match) -> str:
+        start = match.start()
+        return '\n' if start and match.string[start - 1] in _SENTENCE_END_CHARS else ' '
+
+    def clean(self, text: str) -> str:
+        processed_text = text
+        if self.remove_markdown:
+            for pattern, replacement in _MARKDOWN_PATTERNS:
+                processed_text = pattern.sub(replacement, processed_text)
+        if self.remove_emoji and not _EMOJI_CHARS.isdisjoint(processed_text):
+            processed_text = emoji.replace_emoji(processed_text, replace='')
+        if self.no_urls:
+            processed_text = _URL_PATTERN.sub('', processed_text)
+        if self.keyword_remover:
+            processed_text = self.keyword_remover(processed_text)
+        if not self.no_line_breaks:
+            # Re-join lines broken mid-sentence: each whitespace run containing
+            # a newline becomes a newline after sentence-ending punctuation and
+            # a space otherwise; blank lines disappear.
+            processed_text = _LINE_BREAK_PATTERN.sub(self._join_lines, processed_text.strip())
+        else:
+            processed_text = processed_text.replace('\n', ' ')
+        processed_text = processed_text.replace('\t', ' ')
+        processed_text = _CJK_SPACING_PATTERN.sub('', processed_text)
+        processed_text = _MULTI_SPACE_PATTERN.sub(' ', processed_text)
+        return processed_text.strip()
+
+    def _seam(self, previous: str, following: str, glued: bool) -> str:
+        """Separator the whole-text cleaning would leave between two blocks."""
+        if glued or _is_cjk(previous[-1]) and _is_cjk(following[0]) \
+                or previous[-1] in _SPACING_AFTER_CHARS or following[0] in _SPACING_BEFORE_CHARS:
+            return ''
+        if not self.no_line_breaks and previous[-1] in _SENTENCE_END_CHARS:
+            return '\n'
+        return ' '
+
+    def iter_clean(self, text: str, block_size: int = STREAM_INGEST_BLOCK_SIZE):
+        """Clean ``text`` block by block, yielding cleaned pieces as they are ready.
+
+        Blocks are cut at blank lines (see ``iter_raw_text_blocks``) and joined
+        with the separator the whole-text pass would produce, so apart from
+        constructs that straddle a block boundary the concatenated output
+        equals ``clean(text)``.
+        """
+        previous = ''
+        glued = False
+        for block in iter_raw_text_blocks(text, block_size):
+            # The unanchored numbered-list pattern also eats the whitespace
+            # around it, so a number at the seam glues the blocks together.
+            glued = glued or self.remove_markdown and _LEADING_NUMBER_PATTERN.match(block) is not None
+            cleaned = self.clean(block)
+            if not cleaned:
+                continue
+            yield (self._seam(previous, cleaned, glued) + cleaned) if previous else cleaned
+            previous = cleaned
+            glued = self.remove_markdown and _TRAILING_NUMBER_PATTERN.search(block) is not None
+
+
+def _is_cjk(ch: str) -> bool:
+    return '\u4e00' <= ch <= '\u9fff'
+
+
+@lru_cache(maxsize=64)
+def _get_text_cleaner(remove_markdown, remove_emoji, no_urls, no_line_breaks, custom_keywords) -> TextCleaner:
+    return TextCleaner(remove_markdown, remove_emoji, no_urls, no_line_breaks, custom_keywords)
+
+
+def get_text_cleaner(options) -> TextCleaner:
+    return _get_text_cleaner(
+        bool(options.get('remove_markdown')),
+        bool(options.get('remove_emoji')),
+        bool(options.get('no_urls')),
+        bool(options.get('no_line_breaks')),
+        options.get('custom_keywords', '') or '',
+    )
+
+
 def pre_process_text(text, options):
     logger.info(f"Applying text cleaning with options: {options}")
-    processed_text = text
-    if options.get('remove_markdown'):
-        processed_text = re.sub(r'\[!\[([^\]]*)\]\([^\)]+\)\]\([^\)]+\)', r'\1', processed_text)
-        processed_text = re.sub(r'!\[([^\]]*)\]\([^\)]+\)', r'\1', processed_text)
-        processed_text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', processed_text)
-        processed_text = re.sub(r'```[\s\S]*?```', '', processed_text)
-        processed_text = re.sub(r'`([^`]+)`', r'\1', processed_text)
-        processed_text = re.sub(r'(\*\*|__)(.*?)\1', r'\2', processed_text)
-        processed_text = re.sub(r'(\*|_)(.*?)\1', r'\2', processed_text)
-        processed_text = re.sub(r'^\s*#+\s*', '', processed_text, flags=re.MULTILINE)
-        processed_text = re.sub(r'^\s*[\*\-]\s*|\s*\d+\.\s*', '', processed_text, flags=re.MULTILINE)
-        processed_text = re.sub(r'^\s*>\s?', '', processed_text, flags=re.MULTILINE)
-        processed_text = re.sub(r'^\s*[-*_]{3,}\s*$', '', processed_text, flags=re.MULTILINE)
-    if options.get('remove_emoji'):
-        processed_text = emoji.replace_emoji(processed_text, replace='')
-    if options.get('no_urls'):
-        processed_text = re.sub(r'http\S+|www\S+|https\S+', '', processed_text, flags=re.MULTILINE)
-    custom_keywords_str = options.get('custom_keywords', '')
-    if custom_keywords_str:
-        keywords = [re.escape(k.strip()) for k in custom_keywords_str.split(',') if k.strip()]
-        if keywords:
-            regex_pattern = '|'.join(keywords)
-            processed_text = re.sub(regex_pattern, '', processed_text)
-    if not options.get('no_line_breaks'):
-        lines = processed_text.split('\n')
-        reunited_lines = []
-        for i, line in enumerate(lines):
-            line = line.strip()
-            if not line: continue
-            if reunited_lines and not reunited_lines[-1].strip().endswith(('。', '？', '！', '?', '!')):
-                reunited_lines[-1] += ' ' + line
-            else:
-                reunited_lines.append(line)
-        processed_text = '\n'.join(reunited_lines)
-    else:
-        processed_text = processed_text.replace('\n', ' ')
-    processed_text = processed_text.replace('\t', ' ')
-    # Remove spaces inserted between Chinese characters due to PDF line breaks
-    processed_text = re.sub(r'(?<=[\u4e00-\u9fff])\s+(?=[\u4e00-\u9fff])', '', processed_text)
-    # Remove spaces around common Chinese punctuation
-    processed_text = re.sub(r'\s+([，。、？！；：])', r'\1', processed_text)
-    processed_text = re.sub(r'([，。、？！；：])\s+', r'\1', processed_text)
-    processed_text = re.sub(r'([（《「『])\s+', r'\1', processed_text)
-    processed_text = re.sub(r'\s+([）》」』])', r'\1', processed_text)
-    processed_text = re.sub(r' +', ' ', processed_text)
-    return processed_text.strip()
+    return get_text_cleaner(options).clean(text)
 
 def split_text_intelligently(text, options, target_size=800, max_size=1500):
     processed_text = pre_process_text(text, options)
@@ -376,83 +3300,459 @@ def split_text_intelligently(text, options, target_size=800, max_size=1500):
     logger.info(f"Intelligently split text into {len(final_chunks)} high-quality chunks.")
     return final_chunks
 
-# 新的文本分块函数，优先按标点断句，并确保每块不超过 max_chunk_len
-def split_text_into_chunks(text, max_chunk_len=300):
-    sentences = re.split(r'(?<=[。！？!?.])(?!(\d)|$)', text)
-    sentences = [s.strip() for s in sentences if isinstance(s, str) and s.strip()]
+_SENTENCE_BOUNDARY_PATTERN = re.compile(r'(?<=[。！？!?.])(?!\d|$)')
+
+
+def _normalize_sentence(sentence: str) -> str:
+    return re.sub(r'\s+', ' ', sentence).strip()
+
+
+def find_repeated_sentences(text, min_len=REPEATED_SENTENCE_MIN_LEN) -> set:
+    """Normalized sentences that occur more than once in ``text`` and are at least ``min_len`` long."""
+    counts = defaultdict(int)
+    for sentence in _SENTENCE_BOUNDARY_PATTERN.split(text):
+        counts[_normalize_sentence(sentence)] += 1
+    return {sentence for sentence, count in counts.items() if count > 1 and len(sentence) >= min_len}
+
+
+def iter_text_chunks(pieces, max_chunk_len=300, plan=None, repeated=None, learn_repeats=False):
+    """Incrementally split a stream of text pieces into chunks.
+
+    Concatenating ``pieces`` and passing the result to ``split_text_into_chunks``
+    gives the same chunks; here each chunk is yielded as soon as the sentence
+    that closes it has arrived. A sentence boundary only depends on the
+    characters on either side of it, so everything before the last boundary
+    seen so far is final.
+
+    ``plan``, if given, maps the index of the next chunk to the length that
+    sentences are packed up to (see ``ChunkPlan``). A single sentence longer
+    than that still becomes one chunk; only sentences longer than
+    ``max_chunk_len`` are cut.
+
+    Sentences in ``repeated`` (see ``find_repeated_sentences``) are emitted as
+    chunks of their own instead of being packed with their neighbours, so
+    every occurrence yields the same chunk text and its audio can be reused.
+
+    With ``learn_repeats`` the repeats are found as the sentences arrive
+    instead: a sentence seen before is added to ``repeated`` (which must then
+    be a set) and isolated from that occurrence on. The first occurrence has
+    already been packed by then, so reuse starts with the third one.
+    """
+    current_chunk = ""
+    pending = ""
+    emitted = 0
+    seen = set()
+
+    def pack(sentence):
+        nonlocal current_chunk, emitted
+        sentence = sentence.strip()
+        if not sentence:
+            return
+        target = min(plan(emitted), max_chunk_len) if plan else max_chunk_len
+        if learn_repeats and len(sentence) <= max_chunk_len:
+            key = _normalize_sentence(sentence)
+            if len(key) >= REPEATED_SENTENCE_MIN_LEN:
+                if key in seen:
+                    repeated.add(key)
+                else:
+                    seen.add(key)
+        isolate = bool(repeated) and len(sentence) <= max_chunk_len and _normalize_sentence(sentence) in repeated
+        if not isolate and len(current_chunk) + len(sentence) <= target:
+            current_chunk += sentence
+            return
+        if current_chunk:
+            emitted += 1
+            yield current_chunk
+        if len(sentence) > max_chunk_len:
+            for i in range(0, len(sentence), max_chunk_len):
+                emitted += 1
+                yield sentence[i:i+max_chunk_len]
+            current_chunk = ""
+        elif isolate:
+            emitted += 1
+            yield sentence
+            current_chunk = ""
+        else:
+            current_chunk = sentence
+
+    for piece in pieces:
+        pending += piece
+        start = 0
+        for match in _SENTENCE_BOUNDARY_PATTERN.finditer(pending):
+            yield from pack(pending[start:match.start()])
+            start = match.start()
+        pending = pending[start:]
+    yield from pack(pending)
+    if current_chunk:
+        yield current_chunk
+
+
+# 新的文本分块函数，优先按标点断句，并确保每块不超过 max_chunk_len
+def split_text_into_chunks(text, max_chunk_len=300, plan=None, repeated=None):
+    return list(iter_text_chunks([text], max_chunk_len, plan, repeated))
+
+
+def select_repeated_sentences(text, voice, max_chunk_len=300, plan=None) -> set:
+    """Repeated sentences of ``text`` worth isolating for ``voice``.
+
+    Isolating a sentence saves synthesizing it again but splits the chunks
+    around it into more upstream calls, which does not pay off when the text
+    is short or the sentence repeats rarely. Both splits are cheap, so they
+    are compared by the expected upstream cost of their distinct chunks (see
+    ``ChunkCostModel``).
+    """
+    repeated = find_repeated_sentences(text)
+    if not repeated:
+        return repeated
+    cost = lambda chunks: sum(chunk_cost_model.expected_cost(voice, len(chunk)) for chunk in set(chunks))
+    packed = cost(split_text_into_chunks(text, max_chunk_len, plan))
+    isolated = cost(split_text_into_chunks(text, max_chunk_len, plan, repeated))
+    logger.info(f"{len(repeated)} repeated sentence(s); expected upstream cost {packed:.1f}s packed vs {isolated:.1f}s isolated.")
+    return repeated if isolated < packed else set()
+
+
+def split_text_isolating_repeats(text, voice, max_chunk_len=300, plan=None):
+    """``split_text_into_chunks`` with the sentences picked by ``select_repeated_sentences`` isolated."""
+    return split_text_into_chunks(text, max_chunk_len, plan, select_repeated_sentences(text, voice, max_chunk_len, plan))
+
+
+class ChunkPlan:
+    """Target chunk lengths for one request: ``first`` doubling up to ``target``."""
+
+    __slots__ = ("first", "target")
+
+    def __init__(self, first: int, target: int):
+        self.first = first
+        self.target = target
+
+    def __call__(self, index: int) -> int:
+        return min(self.first << min(index, 16), self.target)
+
+    def __repr__(self):
+        return f"ChunkPlan(first={self.first}, target={self.target})"
+
+
+class ChunkCostModel:
+    """Observed upstream cost of a chunk by voice and length, used to plan chunk sizes.
+
+    Every upstream attempt is recorded per voice and length bucket (and under
+    ``*`` for all voices). Latency is modelled as ``a + b * length`` by a
+    weighted least-squares fit over the buckets, anchored by a prior so that a
+    few samples cannot produce a nonsensical line; the failure rate of a length
+    comes from its bucket. The expected cost of a chunk includes its retries.
 
-    chunks = []
-    current_chunk = ""
+    ``plan`` picks the chunk length that minimizes the estimated wall time of
+    the whole text at the concurrency the request can expect: fewer, longer
+    chunks save per-request overhead until the chunks no longer fill the
+    available slots. Streaming requests start with a short chunk for fast
+    first audio and double the length of each following chunk up to that
+    target; playback of a chunk takes far longer than synthesizing the next.
+    """
 
-    for sentence in sentences:
-        if len(current_chunk) + len(sentence) <= max_chunk_len:
-            current_chunk += sentence
-        else:
-            if current_chunk:
-                chunks.append(current_chunk)
-            if len(sentence) > max_chunk_len:
-                sub_chunks = [sentence[i:i+max_chunk_len] for i in range(0, len(sentence), max_chunk_len)]
-                chunks.extend(sub_chunks)
-                current_chunk = ""
+    BUCKETS = (50, 100, 200, 400, 800, 1600)
+    PRIOR_WEIGHT = 3
+    MAX_WEIGHT = 50
+
+    def __init__(self, min_len: int = 100, max_len: int = 1500, first_len: int = 80,
+                 base_latency: float = 0.6, per_char: float = 0.004,
+                 failure_prior: float = 0.02, retry_penalty: float = 1.0):
+        self.min_len = min_len
+        self.max_len = max_len
+        self.first_len = first_len
+        self.base_latency = base_latency
+        self.per_char = per_char
+        self.failure_prior = failure_prior
+        self.retry_penalty = retry_penalty
+        # (voice, bucket) -> [successes, mean length, mean latency, attempts, failures]
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, length: int) -> int:
+        for index, edge in enumerate(self.BUCKETS):
+            if length <= edge:
+                return index
+        return len(self.BUCKETS)
+
+    def record(self, voice: str, length: int, seconds: float | None = None, ok: bool = True):
+        bucket = self._bucket(length)
+        with self._lock:
+            for key in ((voice, bucket), ("*", bucket)):
+                entry = self._buckets.setdefault(key, [0, 0.0, 0.0, 0, 0])
+                entry[3] += 1
+                if not ok:
+                    entry[4] += 1
+                    continue
+                entry[0] += 1
+                # Running mean that turns into a moving average after MAX_WEIGHT samples.
+                weight = min(entry[0], self.MAX_WEIGHT)
+                entry[1] += (length - entry[1]) / weight
+                entry[2] += (seconds - entry[2]) / weight
+
+    def _entries_locked(self, voice: str):
+        entries = {b: e for (v, b), e in self._buckets.items() if v == voice}
+        return entries or {b: e for (v, b), e in self._buckets.items() if v == "*"}
+
+    def _fit_locked(self, entries):
+        points = [(n, self.base_latency + self.per_char * n, self.PRIOR_WEIGHT) for n in (100, 800)]
+        points += [(e[1], e[2], min(e[0], self.MAX_WEIGHT)) for e in entries.values() if e[0]]
+        sw = sum(w for _, _, w in points)
+        sx = sum(w * x for x, _, w in points)
+        sy = sum(w * y for _, y, w in points)
+        sxx = sum(w * x * x for x, _, w in points)
+        sxy = sum(w * x * y for x, y, w in points)
+        det = sw * sxx - sx * sx
+        slope = (sw * sxy - sx * sy) / det if det else self.per_char
+        slope = max(slope, 1e-5)
+        return max((sy - slope * sx) / sw, 0.0), slope
+
+    def _failure_rate_locked(self, entries, length: int) -> float:
+        entry = entries.get(self._bucket(length))
+        attempts, failures = (entry[3], entry[4]) if entry else (0, 0)
+        rate = (failures + self.failure_prior * 10) / (attempts + 10)
+        return min(rate, 0.9)
+
+    def _cost_locked(self, entries, fit, length: int) -> float:
+        intercept, slope = fit
+        failure = self._failure_rate_locked(entries, length)
+        return (intercept + slope * length + failure * self.retry_penalty) / (1 - failure)
+
+    def expected_cost(self, voice: str, length: int) -> float:
+        """Expected seconds to synthesize a chunk of ``length`` characters, retries included."""
+        with self._lock:
+            entries = self._entries_locked(voice)
+            return self._cost_locked(entries, self._fit_locked(entries), length)
+
+    def plan(self, voice: str, total_length: int, concurrency: int, streaming: bool = False,
+             max_len: int | None = None) -> ChunkPlan:
+        """Plan chunk lengths for a text; ``max_len`` lowers the model's upper bound."""
+        concurrency = max(concurrency, 1)
+        upper = max(1, min(self.max_len, max_len or self.max_len))
+        candidates = []
+        length = min(self.min_len, upper)
+        while length < upper:
+            candidates.append(length)
+            length = int(length * 1.25)
+        candidates.append(upper)
+        with self._lock:
+            entries = self._entries_locked(voice)
+            fit = self._fit_locked(entries)
+
+            def wall_time(length):
+                chunks = -(-max(total_length, 1) // length)
+                return -(-chunks // concurrency) * self._cost_locked(entries, fit, length)
+
+            # Ties go to the longer chunk: same wall time, fewer upstream requests.
+            target = min(candidates, key=lambda n: (wall_time(n), -n))
+        first = min(self.first_len, target) if streaming else target
+        return ChunkPlan(first, target)
+
+    def stats(self) -> dict:
+        with self._lock:
+            voices = {}
+            for (voice, bucket), (ok, mean_len, mean_latency, attempts, failures) in sorted(self._buckets.items()):
+                voices.setdefault(voice, []).append({
+                    "max_length": self.BUCKETS[bucket] if bucket < len(self.BUCKETS) else None,
+                    "attempts": attempts,
+                    "failures": failures,
+                    "mean_length": round(mean_len, 1),
+                    "mean_latency": round(mean_latency, 4),
+                })
+            fits = {voice: self._fit_locked(self._entries_locked(voice)) for voice in voices}
+        return {
+            "min_length": self.min_len,
+            "max_length": self.max_len,
+            "first_length": self.first_len,
+            "voices": {
+                voice: {"base_latency": round(fits[voice][0], 4), "seconds_per_char": round(fits[voice][1], 6), "buckets": buckets}
+                for voice, buckets in voices.items()
+            },
+        }
+
+
+chunk_cost_model = ChunkCostModel()
+
+
+def iter_raw_text_blocks(text, block_size=STREAM_INGEST_BLOCK_SIZE):
+    """Yield consecutive blocks of raw input of roughly ``block_size`` characters.
+
+    Blocks end at a blank line outside any ``` code fence so that Markdown
+    constructs are not cut in half (a block grows past ``block_size`` if it
+    has to). Text without further blank lines is cut at the last line break,
+    space or full-width sentence end in the window, and only as a last resort
+    in the middle of a run of text.
+    """
+    pos = 0
+    length = len(text)
+    in_fence = False
+    blank_lines_left = True
+
+    def outside_fence(start, candidate):
+        return (text.count('```', start, candidate) % 2 == 1) == in_fence
+
+    while pos < length:
+        limit = pos + block_size
+        if limit >= length:
+            yield text[pos:]
+            return
+        cut = -1
+        candidate = text.rfind('\n\n', pos, limit)
+        while candidate > pos:
+            if outside_fence(pos, candidate):
+                cut = candidate
+                break
+            candidate = text.rfind('\n\n', pos, candidate)
+        while cut < 0 and blank_lines_left:
+            candidate = text.find('\n\n', limit if candidate <= pos else candidate + 2)
+            if candidate < 0:
+                blank_lines_left = False
+            elif outside_fence(pos, candidate):
+                cut = candidate
+        if cut < 0:
+            if in_fence or text.find('```', pos, limit) >= 0:
+                cut = length
             else:
-                current_chunk = sentence
-    if current_chunk:
-        chunks.append(current_chunk)
-    return chunks
+                # Prefer a line break, then a space, then a full-width sentence
+                # end, so the seam is something the cleaning passes would
+                # collapse anyway.
+                cut = text.rfind('\n', pos + 1, limit)
+                if cut <= pos:
+                    cut = text.rfind(' ', pos + 1, limit)
+                if cut <= pos:
+                    cut = max(text.rfind(c, pos, limit - 1) for c in '。！？') + 1
+                if cut <= pos:
+                    cut = limit
+        in_fence = not outside_fence(pos, cut)
+        yield text[pos:cut]
+        pos = cut
 
-async def text_to_speech_with_retry(semaphore, chunk_index, text_chunk, voice, temp_dir):
+async def text_to_speech_with_retry(upstream, chunk_index, text_chunk, voice, rate: str = "+0%", timed: bool = False):
+    """Return ``(audio or None, attempts, seconds, words)`` for one chunk.
+
+    ``words`` are the chunk's ``WordBoundary`` timings, or ``None`` if it was
+    served from a cache entry without them; ``timed`` skips such entries.
+    """
     task_start_time = time.time()
-    max_retries = 10
     logger.info(f"  [Task {chunk_index+1}] Starting processing for chunk: '{text_chunk[:30]}...'")
+    cached = await asyncio.to_thread(load_cached_chunk, voice, text_chunk, rate, timed)
+    if cached:
+        logger.info(f"  [Task {chunk_index+1}] Served from audio cache.")
+        METRIC_CHUNKS.inc(voice=voice, mode=upstream.mode, result="cached")
+        return cached[0], 0, time.time() - task_start_time, cached[1]
+    attempts = 0
+
+    async def synthesize():
+        nonlocal attempts
+        audio_data, words, attempts = await _synthesize_chunk(upstream, chunk_index, text_chunk, voice, rate, task_start_time)
+        return audio_data, words
+
+    # An identical chunk already being synthesized for another request is awaited, not repeated.
+    (audio_data, words), shared = await chunk_flights.run(AudioCache.make_key(voice, text_chunk, rate), synthesize)
+    if shared:
+        logger.info(f"  [Task {chunk_index+1}] Shared an identical chunk synthesized for another request.")
+        METRIC_CHUNKS.inc(voice=voice, mode=upstream.mode, result="coalesced")
+    return audio_data, attempts, time.time() - task_start_time, words
+
+async def _synthesize_chunk(upstream, chunk_index, text_chunk, voice, rate, task_start_time):
+    """Run the upstream attempts for one chunk; return ``(audio or None, words, attempts)``."""
+    max_retries = 10
     for attempt in range(max_retries):
         try:
             logger.info(
-                f"  [Task {chunk_index+1}] Attempt {attempt + 1}/{max_retries} acquiring semaphore..."
+                f"  [Task {chunk_index+1}] Attempt {attempt + 1}/{max_retries} acquiring upstream slot..."
             )
-            async with semaphore:
-                logger.info(f"  [Task {chunk_index+1}] Acquired semaphore. Starting TTS request...")
-                communicate = edge_tts.Communicate(text_chunk, voice)
-                temp_file_path = os.path.join(temp_dir, f"segment_{chunk_index}.mp3")
-                with open(temp_file_path, "wb") as temp_file:
-                    async for chunk in communicate.stream():
-                        if chunk["type"] == "audio":
-                            temp_file.write(chunk["data"])
-            if os.path.getsize(temp_file_path) > 0:
+            upstream_start = None
+            async with upstream.slot(chunk=chunk_index + 1, voice=voice):
+                logger.info(f"  [Task {chunk_index+1}] Acquired upstream slot. Starting TTS request...")
+                upstream_health.check()
+                upstream_start = time.time()
+                audio_data, words = await upstream_pool.synthesize(text_chunk, voice, rate)
+            if audio_data:
+                upstream.span("upstream", upstream_start, chunk=chunk_index + 1, attempt=attempt + 1, chars=len(text_chunk))
+                upstream_health.record_success()
+                chunk_cost_model.record(voice, len(text_chunk), time.time() - upstream_start)
+                METRIC_UPSTREAM_SECONDS.observe(time.time() - upstream_start, voice=voice, mode=upstream.mode)
+                METRIC_CHUNKS.inc(voice=voice, mode=upstream.mode, result="ok")
                 elapsed_time = time.time() - task_start_time
                 logger.info(
                     f"  [Task {chunk_index+1}] Successfully generated in {elapsed_time:.2f}s after {attempt + 1} attempt(s)."
                 )
                 logger.info(f"  [Task {chunk_index+1}] Done. Total retry attempts: {attempt + 1}")
-                return temp_file_path, attempt + 1, elapsed_time
+                await asyncio.to_thread(store_cached_chunk, voice, text_chunk, audio_data, words, rate)
+                return audio_data, words, attempt + 1
             else:
-                raise edge_tts.NoAudioReceived("No audio was received (empty file).")
+                raise edge_tts.NoAudioReceived("No audio was received (empty data).")
         except Exception as e:
             logger.warning(f"  [Task {chunk_index+1}] Attempt {attempt + 1} failed: {e}")
-            if attempt + 1 == max_retries:
+            if upstream_start is not None:
+                upstream.span("upstream", upstream_start, chunk=chunk_index + 1, attempt=attempt + 1, error=str(e))
+            fail_fast = isinstance(e, UpstreamUnavailableError)
+            if not fail_fast:
+                upstream_health.record_failure()
+                chunk_cost_model.record(voice, len(text_chunk), ok=False)
+            METRIC_RETRIES.inc(voice=voice, mode=upstream.mode)
+            if attempt + 1 == max_retries or fail_fast:
                 elapsed_time = time.time() - task_start_time
                 logger.error(
-                    f"  [Task {chunk_index+1}] Failed after {max_retries} attempts. Giving up."
+                    f"  [Task {chunk_index+1}] Failed after {attempt + 1} attempts. Giving up."
                 )
                 logger.info(f"  [Task {chunk_index+1}] Done. Total retry attempts: {attempt + 1}")
-                return None, attempt + 1, elapsed_time
-            wait_time = min(2 ** attempt, 8)
+                METRIC_CHUNKS.inc(voice=voice, mode=upstream.mode, result="failed")
+                return None, None, attempt + 1
+            wait_time = upstream_health.backoff(attempt)
             logger.info(f"  [Task {chunk_index+1}] Retrying after {wait_time:.2f}s...")
+            backoff_start = time.time()
             await asyncio.sleep(wait_time)
+            upstream.span("retry_backoff", backoff_start, chunk=chunk_index + 1, attempt=attempt + 1)
 
 async def run_tts(
     text_chunks,
     voice,
-    temp_dir,
     max_concurrent_requests: int | None = None,
+    rate: str = "+0%",
+    sink=None,
+    timed: bool = False,
+    ticket: AdmissionTicket | None = None,
+    trace: RequestTrace | None = None,
 ):
+    """Synthesize ``text_chunks`` concurrently and return their audio in order.
+
+    Failed chunks are ``None``. With a ``sink``, ``sink(index, audio, words)``
+    is called for every chunk index as soon as its audio is ready, so the
+    caller can write it out and the audio is not kept; ``True``/``None`` is
+    then returned per chunk instead of the bytes. ``timed`` makes sure every
+    chunk comes with its word timings (see ``text_to_speech_with_retry``).
+    Upstream progress is reported to the admission ``ticket``, and the chunk
+    spans are recorded in ``trace``.
+    """
     limit = max_concurrent_requests or MAX_CONCURRENT_REQUESTS
     logger.info(
         f"[Step 2/4] Starting TTS generation with concurrency limit: {limit}..."
     )
-    semaphore = asyncio.Semaphore(limit)
+    upstream = upstream_scheduler.session(limit, mode="full", ticket=ticket, trace=trace)
     start_time = time.time()
-    tasks = [text_to_speech_with_retry(semaphore, i, chunk, voice, temp_dir) for i, chunk in enumerate(text_chunks)]
-    results = await asyncio.gather(*tasks)
+    # Repeated chunks (see find_repeated_sentences) are synthesized once.
+    unique_chunks = list(dict.fromkeys(text_chunks))
+    reused = len(text_chunks) - len(unique_chunks)
+    if reused:
+        logger.info(f"{reused} repeated chunk(s) reuse the audio of an earlier occurrence.")
+        METRIC_CHUNKS.inc(reused, voice=voice, mode="full", result="reused")
+    tasks = [text_to_speech_with_retry(upstream, i, chunk, voice, rate, timed) for i, chunk in enumerate(unique_chunks)]
+    if sink is not None:
+        indices = defaultdict(list)
+        for i, chunk in enumerate(text_chunks):
+            indices[chunk].append(i)
+
+        async def deliver(chunk, task):
+            audio_data, attempts, elapsed, words = await task
+            for i in indices[chunk]:
+                sink(i, audio_data, words)
+            return (True if audio_data is not None else None), attempts, elapsed
+
+        tasks = [deliver(chunk, task) for chunk, task in zip(unique_chunks, tasks)]
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        upstream.close()
     total_time = time.time() - start_time
     durations = [r[2] for r in results if r is not None]
     total_attempts = sum(r[1] for r in results if r is not None)
@@ -462,9 +3762,390 @@ async def run_tts(
         f"All TTS tasks completed in {total_time:.2f}s. Average chunk time: {avg_time:.2f}s. Achieved concurrency: {concurrency:.2f}x"
     )
     logger.info(f"Total retry attempts across all tasks: {total_attempts}")
-    return [r[0] if r else None for r in results]
+    cache_stats = audio_cache.stats()
+    logger.info(f"Audio cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['bytes']} bytes stored")
+    audio = {chunk: (r[0] if r else None) for chunk, r in zip(unique_chunks, results)}
+    return [audio[chunk] for chunk in text_chunks]
+
+def batch_distinct_chunks(items) -> list:
+    """The distinct ``(voice, chunk)`` pairs of batch ``items``, in first-seen order."""
+    return list(dict.fromkeys((voice, chunk) for voice, chunks in items for chunk in chunks))
+
+async def run_tts_batch(items, max_concurrent_requests: int | None = None, trace: RequestTrace | None = None,
+                        ticket: AdmissionTicket | None = None):
+    """Synthesize many small ``(voice, text_chunks)`` items under one upstream session.
+
+    Identical ``(voice, chunk)`` pairs across the batch are synthesized once.
+    Returns the stitched audio per item (``None`` if any of its chunks failed)
+    and the number of distinct chunks that were synthesized. Upstream progress
+    is reported to the admission ``ticket``.
+    """
+    unique = batch_distinct_chunks(items)
+    logger.info(f"[Batch] {len(items)} item(s), {len(unique)} distinct chunk(s).")
+    upstream = upstream_scheduler.session(max_concurrent_requests, mode="batch", ticket=ticket, trace=trace)
+    try:
+        results = await asyncio.gather(*(
+            text_to_speech_with_retry(upstream, i, chunk, voice) for i, (voice, chunk) in enumerate(unique)
+        ))
+    finally:
+        upstream.close()
+    audio = {key: result[0] for key, result in zip(unique, results)}
+
+    def stitch_items():
+        outputs = []
+        for voice, chunks in items:
+            segments = [audio[(voice, chunk)] for chunk in chunks]
+            outputs.append(stitch_mp3_segments(segments) if segments and all(segments) else None)
+        return outputs
+
+    # Stitching is CPU-bound and the batch may be large; keep it off the event loop.
+    return await asyncio.to_thread(stitch_items), len(unique)
+
+# --- 异步任务 ---
+class SpeechJob:
+    """A persisted long-document synthesis job.
+
+    ``job.json`` holds the cleaned chunk texts and the job state; every chunk's
+    audio is written to ``chunks/`` as soon as it is synthesized. A job that is
+    interrupted (failure, cancellation, restart) therefore resumes from the
+    chunks that are still missing on disk.
+    """
+
+    QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED = "queued", "running", "completed", "failed", "cancelled"
+
+    def __init__(self, job_dir: str, job_id: str, voice: str, chunks: list, max_concurrent_requests: int | None = None,
+                 status: str = QUEUED, created_at: float | None = None, updated_at: float | None = None,
+                 failed_chunks=(), error: str | None = None):
+        self.dir = job_dir
+        self.id = job_id
+        self.voice = voice
+        self.chunks = list(chunks)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.status = status
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+        self.failed_chunks = list(failed_chunks)
+        self.error = error
+        self.completed_chunks = sum(1 for i in range(len(self.chunks)) if os.path.exists(self.chunk_path(i)))
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.dir, 'job.json')
+
+    @property
+    def result_path(self) -> str:
+        return os.path.join(self.dir, 'result.mp3')
+
+    def chunk_path(self, index: int) -> str:
+        return os.path.join(self.dir, 'chunks', f"{index:06d}.mp3")
+
+    @property
+    def cancel_path(self) -> str:
+        return os.path.join(self.dir, 'cancel')
+
+    def cancel_requested(self) -> bool:
+        """True once any worker has cancelled or deleted the job."""
+        return os.path.exists(self.cancel_path) or not os.path.isdir(self.dir)
+
+    def missing_chunks(self) -> list:
+        return [i for i in range(len(self.chunks)) if not os.path.exists(self.chunk_path(i))]
+
+    def save(self):
+        self.updated_at = time.time()
+        _write_file_atomic(self.meta_path, json.dumps({
+            "id": self.id, "voice": self.voice, "chunks": self.chunks,
+            "max_concurrent_requests": self.max_concurrent_requests, "status": self.status,
+            "created_at": self.created_at, "updated_at": self.updated_at,
+            "failed_chunks": self.failed_chunks, "error": self.error,
+        }, ensure_ascii=False).encode('utf-8'))
+
+    @classmethod
+    def load(cls, job_dir: str) -> "SpeechJob":
+        with open(os.path.join(job_dir, 'job.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(job_dir, meta["id"], meta["voice"], meta["chunks"], meta.get("max_concurrent_requests"),
+                   meta.get("status", cls.QUEUED), meta.get("created_at"), meta.get("updated_at"),
+                   meta.get("failed_chunks", ()), meta.get("error"))
+
+    def to_dict(self) -> dict:
+        total = len(self.chunks)
+        info = {
+            "id": self.id,
+            "object": "audio.job",
+            "status": self.status,
+            "voice": self.voice,
+            "total_chunks": total,
+            "completed_chunks": self.completed_chunks,
+            "progress": round(self.completed_chunks / total, 4) if total else 1.0,
+            "failed_chunks": [i + 1 for i in self.failed_chunks],
+            "created_at": int(self.created_at),
+            "updated_at": int(self.updated_at),
+        }
+        if self.error: info["error"] = self.error
+        if self.status == self.COMPLETED:
+            info["result_url"] = f"/v1/audio/jobs/{self.id}/content"
+            try:
+                info["bytes"] = os.path.getsize(self.result_path)
+            except OSError:
+                pass
+        return info
+
+
+def _write_file_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f: f.write(data)
+    os.replace(tmp_path, path)
+
+
+class JobManager:
+    """Runs ``SpeechJob``s on ``STREAM_LOOP``, at most ``max_active`` at a time.
+
+    Chunks of running jobs share the process-wide ``UpstreamScheduler`` with
+    interactive requests, so batch conversions cannot starve them, and their
+    remaining work counts in the admission backlog. Finished jobs are removed
+    after ``retention`` seconds.
+    """
+
+    def __init__(self, jobs_dir: str, loop, max_active: int = 2, retention: float = 24 * 3600):
+        self.jobs_dir = jobs_dir
+        self.loop = loop
+        self.max_active = max(int(max_active), 1)
+        self.retention = retention
+        self._jobs = {}
+        self._pending = deque()
+        self._running = {}
+        # Running jobs whose directory their task removes once it has unwound
+        self._deleted = set()
+        self._lock = threading.Lock()
+
+    def load(self, resume: bool = True):
+        """Rebuild the job index from disk and requeue unfinished jobs."""
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        resumed = 0
+        for name in sorted(os.listdir(self.jobs_dir)):
+            job_dir = os.path.join(self.jobs_dir, name)
+            try:
+                job = SpeechJob.load(job_dir)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"[Jobs] Skipping unreadable job directory {job_dir}: {e}")
+                continue
+            with self._lock:
+                self._jobs[job.id] = job
+                if resume and job.status in (SpeechJob.QUEUED, SpeechJob.RUNNING):
+                    job.status = SpeechJob.QUEUED
+                    self._pending.append(job)
+                    resumed += 1
+        self.purge()
+        with self._lock:
+            self._start_locked()
+        logger.info(f"[Jobs] Loaded {len(self._jobs)} job(s), resumed {resumed}.")
+
+    def submit(self, voice: str, chunks: list, max_concurrent_requests: int | None = None) -> SpeechJob:
+        self.purge()
+        job_id = uuid.uuid4().hex
+        job = SpeechJob(os.path.join(self.jobs_dir, job_id), job_id, voice, chunks, max_concurrent_requests)
+        job.save()
+        with self._lock:
+            self._jobs[job_id] = job
+            self._pending.append(job)
+            self._start_locked()
+        logger.info(f"[Jobs] Job {job_id} queued with {len(chunks)} chunk(s) for voice {voice}.")
+        return job
+
+    def get(self, job_id: str) -> SpeechJob | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and re.fullmatch(r'[0-9a-f]{32}', job_id):
+            # The job may belong to another worker process; read its latest state.
+            try:
+                job = SpeechJob.load(os.path.join(self.jobs_dir, job_id))
+            except (OSError, ValueError, KeyError):
+                return None
+        return job
+
+    def list_jobs(self) -> list:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created_at)
+
+    def resume(self, job_id: str) -> SpeechJob | None:
+        """Requeue a failed or cancelled job; only its missing chunks are synthesized."""
+        job = self.get(job_id)
+        with self._lock:
+            if job is None or job.status not in (SpeechJob.FAILED, SpeechJob.CANCELLED):
+                return job
+            try:
+                os.remove(job.cancel_path)
+            except OSError:
+                pass
+            job.status, job.error, job.failed_chunks = SpeechJob.QUEUED, None, []
+            job.save()
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._start_locked()
+        return job
+
+    def cancel(self, job_id: str) -> SpeechJob | None:
+        job = self.get(job_id)
+        with self._lock:
+            if job is None or job.status not in (SpeechJob.QUEUED, SpeechJob.RUNNING):
+                return job
+            # The marker stops the job in whichever worker process is running it.
+            _write_file_atomic(job.cancel_path, b"")
+            if job in self._pending:
+                self._pending.remove(job)
+            future = self._running.get(job_id)
+            job.status = SpeechJob.CANCELLED
+            job.save()
+        if future is not None:
+            future.cancel()
+        return job
+
+    def delete(self, job_id: str) -> bool:
+        # A running task could still write into the directory, so it removes
+        # the directory itself once it has unwound (see ``_run``). The mark is
+        # set before cancelling, which may unwind the task right away.
+        with self._lock:
+            if job_id in self._running:
+                self._deleted.add(job_id)
+        job = self.cancel(job_id)
+        with self._lock:
+            if job is None:
+                self._deleted.discard(job_id)
+                return False
+            self._jobs.pop(job_id, None)
+            if job_id in self._deleted:
+                return True
+        shutil.rmtree(job.dir, ignore_errors=True)
+        return True
+
+    def purge(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [j.id for j in self._jobs.values()
+                       if j.status in (SpeechJob.COMPLETED, SpeechJob.FAILED, SpeechJob.CANCELLED) and j.updated_at < cutoff]
+        for job_id in expired:
+            self.delete(job_id)
+
+    def _start_locked(self):
+        while self._pending and len(self._running) < self.max_active:
+            job = self._pending.popleft()
+            future = asyncio.run_coroutine_threadsafe(self._run(job), self.loop)
+            self._running[job.id] = future
+            future.add_done_callback(lambda _, job_id=job.id: self._finished(job_id))
+
+    def _finished(self, job_id: str):
+        with self._lock:
+            self._running.pop(job_id, None)
+            self._start_locked()
+
+    @staticmethod
+    def _assemble(job: SpeechJob):
+        # Stitched one chunk file at a time so long jobs never sit in memory.
+        tmp_path = f"{job.result_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as out:
+            for i in range(len(job.chunks)):
+                with open(job.chunk_path(i), 'rb') as f: write_mp3_segment(out, f.read())
+        os.replace(tmp_path, job.result_path)
+
+    async def _run(self, job: SpeechJob):
+        job.status = SpeechJob.RUNNING
+        job.save()
+        missing = job.missing_chunks()
+        logger.info(f"[Jobs] Job {job.id} running: {len(missing)}/{len(job.chunks)} chunk(s) to synthesize.")
+
+        # Repeated chunk texts are synthesized once and written to every index;
+        # an entry is dropped once its last index has its audio.
+        synthesis = {}
+        waiting = defaultdict(int)
+        for i in missing:
+            waiting[job.chunks[i]] += 1
+        ticket = admission.track(f"job:{job.id}", job.voice, sum(len(text) for text in waiting), len(waiting))
+        upstream = upstream_scheduler.session(job.max_concurrent_requests, mode="job", ticket=ticket)
+
+        async def process(index: int) -> bool:
+            if job.cancel_requested(): raise asyncio.CancelledError()
+            text = job.chunks[index]
+            if text not in synthesis:
+                synthesis[text] = asyncio.ensure_future(text_to_speech_with_retry(upstream, index, text, job.voice))
+            audio_data = (await asyncio.shield(synthesis[text]))[0]
+            waiting[text] -= 1
+            if not waiting[text]:
+                synthesis.pop(text, None)
+            if audio_data is None: return False
+            if job.cancel_requested(): raise asyncio.CancelledError()
+            _write_file_atomic(job.chunk_path(index), audio_data)
+            job.completed_chunks += 1
+            return True
+
+        tasks = [asyncio.ensure_future(process(i)) for i in missing]
+        assembly = None
+        try:
+            results = await asyncio.gather(*tasks)
+            job.failed_chunks = [i for i, ok in zip(missing, results) if not ok]
+            if job.failed_chunks:
+                job.status = SpeechJob.FAILED
+                job.error = f"{len(job.failed_chunks)} chunk(s) failed; resume the job to retry them."
+            else:
+                # Shielded: a thread cannot be stopped, so a cancelled job still waits for it below.
+                assembly = asyncio.ensure_future(asyncio.to_thread(self._assemble, job))
+                await asyncio.shield(assembly)
+                job.status = SpeechJob.COMPLETED
+        except asyncio.CancelledError:
+            job.status = SpeechJob.CANCELLED
+            raise
+        except Exception as e:
+            logger.error(f"[Jobs] Job {job.id} failed: {e}", exc_info=True)
+            job.status, job.error = SpeechJob.FAILED, "Internal error while processing the job."
+        finally:
+            pending = [*tasks, *synthesis.values()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, *([assembly] if assembly else []), return_exceptions=True)
+            upstream.close()
+            admission.release(ticket)
+            with self._lock:
+                self._running.pop(job.id, None)
+                deleted = job.id in self._deleted
+                self._deleted.discard(job.id)
+            if deleted:
+                await asyncio.to_thread(shutil.rmtree, job.dir, True)
+                logger.info(f"[Jobs] Job {job.id} deleted.")
+            else:
+                if os.path.isdir(job.dir):
+                    job.save()
+                logger.info(f"[Jobs] Job {job.id} {job.status}: {job.completed_chunks}/{len(job.chunks)} chunk(s) done.")
+
+
+job_manager = JobManager(JOBS_DIR, STREAM_LOOP)
+metrics.gauge("tts_jobs_running", "Speech jobs currently running.", lambda: len(job_manager._running))
+metrics.gauge("tts_jobs_queued", "Speech jobs waiting to run.", lambda: len(job_manager._pending))
+
 
 # --- Flask 路由和 API ---
+@app.before_request
+def _reload_config_before_request():
+    reload_config_if_changed()
+
+@app.after_request
+def _finish_request_trace(response):
+    """Add the trace headers of a traced request; its trace ends once the body is sent."""
+    trace = g.pop('trace', None)
+    if trace is None:
+        return response
+    trace.set(status=response.status_code)
+    response.headers['X-Trace-Id'] = trace.trace_id
+    # Streaming responses only carry the spans finished before their first byte.
+    response.headers['Server-Timing'] = trace.server_timing()
+    body = response.response
+    if isinstance(body, AudioStream):
+        response.response = AudioStream(trace.send_async(body.agen), body.loop)
+    elif response.is_streamed:
+        response.response = trace.send(body)
+    else:
+        trace.finish()
+    return response
+
 @app.route('/')
 @login_required
 def index():
@@ -493,7 +4174,37 @@ def logout():
 
 @app.route('/v1/audio/all_voices', methods=['GET'])
 @login_required
-def get_all_voices(): return jsonify(ALL_VOICES)
+def get_all_voices():
+    # Optional ?locale= and ?gender= filters; clients revalidate with If-None-Match.
+    body, etag = voice_catalog.listing(request.args.get('locale'), request.args.get('gender'))
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/v1/cache/stats', methods=['GET'])
+@login_required
+def get_cache_stats(): return jsonify({**audio_cache.stats(), "transcoded": transcode_cache.stats()})
+
+@app.route('/v1/chunking/stats', methods=['GET'])
+@login_required
+def get_chunking_stats(): return jsonify(chunk_cost_model.stats())
+
+@app.route('/v1/transcode/stats', methods=['GET'])
+@login_required
+def get_transcode_stats(): return jsonify(audio_transcoder.stats())
+
+@app.route('/v1/scheduler/stats', methods=['GET'])
+@login_required
+def get_scheduler_stats(): return jsonify(upstream_scheduler.stats())
+
+@app.route('/v1/admission/stats', methods=['GET'])
+@login_required
+def get_admission_stats(): return jsonify(admission.stats())
+
+@app.route('/v1/upstream/health', methods=['GET'])
+@login_required
+def get_upstream_health(): return jsonify({**upstream_health.stats(), "connections": upstream_pool.stats()})
 
 @app.route('/v1/config', methods=['GET'])
 @login_required
@@ -506,7 +4217,6 @@ def get_config():
 @app.route('/v1/config', methods=['POST'])
 @login_required
 def update_config():
-    global config, MAX_CONCURRENT_REQUESTS, CHUNK_SIZE, SYNC_CHUNKS
     try:
         new_data = request.get_json()
         required_keys = [
@@ -540,10 +4250,8 @@ def update_config():
                 )
 
         config.update(new_data)
-        MAX_CONCURRENT_REQUESTS = config.get("max_concurrent_requests", 20)
-        CHUNK_SIZE = config.get("chunk_size", 300)
-        SYNC_CHUNKS = config.get("sync_chunks", 1)
         save_config_to_file(config)
+        apply_runtime_config()
 
         if changed_msgs:
             for msg in changed_msgs:
@@ -555,6 +4263,37 @@ def update_config():
         logger.error(f"Error updating config: {e}", exc_info=True)
         return jsonify({"error": "更新配置时发生内部错误。"}), 500
 
+@app.route('/metrics', methods=['GET'])
+@operator_token_required
+async def get_metrics():
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/v1/debug/profile', methods=['GET'])
+@operator_token_required
+async def profile_process():
+    """Sample the stacks of this process for ``seconds`` and return them in collapsed or JSON form."""
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        interval = float(request.args.get("interval_ms", 10)) / 1000
+    except ValueError:
+        return jsonify({"error": {"message": "Parameters 'seconds' and 'interval_ms' must be numbers."}}), 400
+    if not math.isfinite(seconds) or not math.isfinite(interval):
+        return jsonify({"error": {"message": "Parameters 'seconds' and 'interval_ms' must be finite."}}), 400
+    seconds = min(max(seconds, PROFILE_MIN_SECONDS), PROFILE_MAX_SECONDS)
+    interval = min(max(interval, PROFILE_MIN_INTERVAL), PROFILE_MAX_INTERVAL)
+    output_format = request.args.get("format", "collapsed")
+    if output_format not in ("collapsed", "json"):
+        return jsonify({"error": {"message": "Parameter 'format' must be 'collapsed' or 'json'."}}), 400
+    idle = request.args.get("idle", "").lower() in ("1", "true", "yes")
+    logger.info(f"Profiling the process for {seconds:g}s every {interval * 1000:g}ms...")
+    profile = await asyncio.to_thread(profiler.run, seconds, interval, idle)
+    if profile is None:
+        return jsonify({"error": {"message": "A profile is already running."}}), 409
+    if output_format == "json":
+        return jsonify({**{k: v for k, v in profile.items() if k != "stacks"}, "worker": WORKER_INDEX,
+                        "top": SamplingProfiler.top(profile), "stacks": profile["stacks"]})
+    return Response(SamplingProfiler.collapsed(profile), content_type="text/plain; charset=utf-8")
+
 @app.route('/v1/models', methods=['GET'])
 @token_required
 async def list_models():
@@ -573,120 +4312,339 @@ async def list_models():
     models.append({"id": "tts-1", "object": "model", "owned_by": "local-tts"})
     return jsonify({"object": "list", "data": models})
 
+def _resolve_cleaning_options(data):
+    # 核心逻辑：决定使用哪套过滤规则
+    if config.get('sync_api_filtering', False):
+        logger.info("API filtering sync is ON. Using default cleaning options from config.")
+        return config.get('default_cleaning_options', {})
+    logger.info("API filtering sync is OFF. Using cleaning options from request body (if any).")
+    return data.get("cleaning_options", {})
+
+def _int_param(value, default):
+    try:
+        return int(value or default)
+    except (TypeError, ValueError):
+        return default
+
+def _resolve_chunk_plan(data, voice, text_length, max_concurrent_requests, streaming=False):
+    """Return ``(max_chunk_len, plan)``: fixed ``CHUNK_SIZE`` chunks unless adaptive chunking is on.
+
+    Adaptive plans never exceed the configured ``CHUNK_SIZE``; a request that
+    sets ``chunk_size`` always gets fixed chunks of that size.
+    """
+    requested = data.get("chunk_size") or request.args.get("chunk_size") or request.args.get("max_chunk_len")
+    if requested or not config.get("adaptive_chunking", False):
+        return _int_param(requested, CHUNK_SIZE), None
+    concurrency = upstream_scheduler.fair_share(max_concurrent_requests)
+    plan = chunk_cost_model.plan(voice, text_length, concurrency, streaming, max_len=CHUNK_SIZE)
+    logger.info(f"Adaptive chunking: {plan} for {text_length} chars at concurrency {concurrency}.")
+    return CHUNK_SIZE, plan
+
+def _resolve_output_format(data):
+    """Return ``(response_format, speed, error)`` parsed from the request body."""
+    response_format = str(data.get("response_format") or "mp3").lower()
+    if response_format not in AudioTranscoder.FORMATS:
+        return None, None, f"Unsupported response_format '{response_format}'. Use one of: {', '.join(AudioTranscoder.FORMATS)}."
+    try:
+        speed = float(data.get("speed") or 1.0)
+    except (TypeError, ValueError):
+        return None, None, "Parameter 'speed' must be a number."
+    if not 0.25 <= speed <= 4.0:
+        return None, None, "Parameter 'speed' must be between 0.25 and 4.0."
+    return response_format, speed, None
+
+def _resolve_voice(voice_name):
+    """Return ``(voice, error)``: OpenAI aliases are mapped and unknown voices rejected."""
+    voice = voice_catalog.resolve(config['openai_voice_map'].get(voice_name, voice_name))
+    if voice is None:
+        return None, f"Unknown voice '{voice_name}'. See /v1/audio/all_voices for the available voices."
+    return voice, None
+
+async def _broadcast_response(broadcast: OutputBroadcast, content_type: str):
+    """Serve a finished non-streaming ``broadcast``, or the error its leader ended with."""
+    if broadcast.error:
+        message, status = broadcast.error
+        return jsonify({"error": {"message": message}}), status
+    if broadcast.timeline is not None:
+        return await asyncio.to_thread(_timed_response, broadcast, content_type)
+    response = Response(broadcast.iter_blocks(), content_type=content_type)
+    response.content_length = broadcast.spool.size
+    return response
+
+def _timed_response(broadcast: OutputBroadcast, content_type: str):
+    """Serve the output with its word timings as JSON; the audio goes in ``audio`` as base64.
+
+    The base64 text is encoded block by block from the spool, so a long
+    output is not held in memory to build the body. Both servers iterate the
+    body in a thread, and the view builds the head with ``asyncio.to_thread``,
+    so neither step runs on the event loop.
+    """
+    head = json.dumps({"content_type": content_type, **broadcast.timeline.result()}, ensure_ascii=False)
+    prefix = (head[:-1] + ', "audio": "').encode('utf-8')
+
+    def body():
+        yield prefix
+        # A multiple of 3 bytes, so the encoded blocks join without padding.
+        for block in broadcast.iter_blocks(3 * 21845):
+            yield base64.b64encode(block)
+        yield b'"}'
+
+    response = Response(body(), content_type="application/json")
+    response.content_length = len(prefix) + 4 * ((broadcast.spool.size + 2) // 3) + 2
+    return response
+
+def _resolve_timestamps(data):
+    """Return ``(format, error)`` for the optional ``timestamps`` field; ``True`` means ``json``."""
+    value = data.get("timestamps")
+    if not value:
+        return None, None
+    timestamps = "json" if value is True else str(value).lower()
+    if timestamps not in TIMESTAMP_FORMATS:
+        return None, f"Unsupported timestamps '{value}'. Use one of: {', '.join(TIMESTAMP_FORMATS)}."
+    return timestamps, None
+
+def _broadcast_stream_response(flight_key: str, broadcast: OutputBroadcast, content_type: str):
+    """Stream ``broadcast`` to this client; the generation stops once every client has gone."""
+    def detach():
+        if request_flights.release(flight_key, broadcast):
+            logger.info("Every client of a streaming response has gone; cancelling its generation.")
+            broadcast.cancel()
+    return Response(AudioStream(broadcast.subscribe(detach), STREAM_LOOP), content_type=content_type)
+
+def _request_token() -> str | None:
+    """The request's bearer token, which identifies its client for admission."""
+    auth_header = request.headers.get('Authorization', '')
+    return auth_header[7:] if auth_header.startswith('Bearer ') else None
+
+def _admission_rejected_response(message: str, status: int, retry_after: float | None):
+    logger.warning(f"Rejecting request: {message}")
+    response = jsonify({"error": {"message": message}})
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(max(int(retry_after + 0.999), 1))
+    return response, status
+
+def _upstream_unavailable_response():
+    retry_after = max(int(upstream_health.retry_after() + 0.999), 1)
+    logger.warning(f"Rejecting request: upstream circuit breaker is open (retry after {retry_after}s).")
+    response = jsonify({"error": {"message": "Upstream TTS service is temporarily unavailable."}})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
 @app.route('/v1/audio/speech', methods=['POST'])
 @token_required
 async def generate_speech():
     request_start_time = time.time()
+    g.trace = trace = RequestTrace.from_request("speech")
     logger.info("="*50)
-    logger.info("Received new TTS request.")
-    with tempfile.TemporaryDirectory() as temp_dir:
-        try:
-            data = request.get_json()
-            text, voice_name = data.get("input"), data.get("voice")
-            stream_enabled = bool(data.get("stream", False))
-            
-            # 核心逻辑：决定使用哪套过滤规则
-            if config.get('sync_api_filtering', False):
-                cleaning_options = config.get('default_cleaning_options', {})
-                logger.info("API filtering sync is ON. Using default cleaning options from config.")
-            else:
-                cleaning_options = data.get("cleaning_options", {})
-                logger.info("API filtering sync is OFF. Using cleaning options from request body (if any).")
-            
-            if not text or not voice_name: return jsonify({"error": {"message": "Parameters 'input' and 'voice' are required"}}), 400
+    logger.info(f"Received new TTS request (trace {trace.trace_id}).")
+    try:
+        data = request.get_json()
+        text, voice_name = data.get("input"), data.get("voice")
+        stream_enabled = bool(data.get("stream", False))
+        cleaning_options = _resolve_cleaning_options(data)
+        
+        if not text or not voice_name: return jsonify({"error": {"message": "Parameters 'input' and 'voice' are required"}}), 400
 
-            final_voice = config['openai_voice_map'].get(voice_name, voice_name)
-            logger.info("[Step 1/4] Pre-processing text...")
-            processed_text = pre_process_text(text, cleaning_options)
-            if processed_text is None:
-                logger.error("\u274c processed_text is None!\uFF01\u8BF7\u68C0\u67E5\u524D\u9762\u7684\u6E05\u6D17\u903B\u8F91")
+        response_format, speed, format_error = _resolve_output_format(data)
+        if format_error: return jsonify({"error": {"message": format_error}}), 400
+        timestamps, timestamps_error = _resolve_timestamps(data)
+        if timestamps_error: return jsonify({"error": {"message": timestamps_error}}), 400
+        rate, tempo = speed_to_prosody(speed)
+        transcode = needs_transcoding(response_format, tempo)
+        if transcode and not audio_transcoder.available:
+            return jsonify({"error": {"message": f"response_format '{response_format}' at speed {speed} requires ffmpeg, which is not installed on the server."}}), 400
+        content_type = AudioTranscoder.content_type(response_format)
 
-            # Override settings per request if provided
-            chunk_size_override = (
-                data.get("chunk_size")
-                or request.args.get("chunk_size")
-                or request.args.get("max_chunk_len")
-                or CHUNK_SIZE
-            )
-            try:
-                chunk_size_override = int(chunk_size_override)
-            except (TypeError, ValueError):
-                chunk_size_override = CHUNK_SIZE
+        final_voice, voice_error = _resolve_voice(voice_name)
+        if voice_error: return jsonify({"error": {"message": voice_error}}), 400
+        mode = "stream" if stream_enabled else "full"
+        METRIC_REQUESTS.inc(voice=final_voice, mode=mode)
+        trace.set(voice=final_voice, mode=mode, chars=len(text), response_format=response_format)
 
-            sync_chunks = data.get("sync_chunks") or request.args.get("sync_chunks", SYNC_CHUNKS)
-            try:
-                sync_chunks = int(sync_chunks)
-            except (TypeError, ValueError):
-                sync_chunks = SYNC_CHUNKS
-
-            max_concurrent_requests_override = (
-                data.get("max_concurrent_requests")
-                or request.args.get("max_concurrent_requests")
-                or MAX_CONCURRENT_REQUESTS
-            )
-            try:
-                max_concurrent_requests_override = int(max_concurrent_requests_override)
-            except (TypeError, ValueError):
-                max_concurrent_requests_override = MAX_CONCURRENT_REQUESTS
+        # Override settings per request if provided
+        sync_chunks = _int_param(data.get("sync_chunks") or request.args.get("sync_chunks"), SYNC_CHUNKS)
+        max_concurrent_requests_override = _int_param(
+            data.get("max_concurrent_requests") or request.args.get("max_concurrent_requests"),
+            MAX_CONCURRENT_REQUESTS,
+        )
+        lookahead = max(_int_param(
+            data.get("lookahead_chunks") or request.args.get("lookahead_chunks"), STREAM_LOOKAHEAD_CHUNKS), 0)
 
-            max_chunk_len = chunk_size_override
+        max_chunk_len, chunk_plan = _resolve_chunk_plan(
+            data, final_voice, len(text), max_concurrent_requests_override, streaming=stream_enabled)
 
-            text_chunks = split_text_into_chunks(processed_text, max_chunk_len=max_chunk_len)
-            if not text_chunks:
-                return jsonify({"error": {"message": "Input text is empty."}}), 400
+        cache_key = None
+        if transcode:
+            cache_key = transcode_cache_key(
+                final_voice, text, cleaning_options, None if chunk_plan else max_chunk_len, response_format, speed)
+            # Cached output has no word timings; those requests synthesize again.
+            cached = None if timestamps else await asyncio.to_thread(transcode_cache.open_entry, cache_key)
+            if cached:
+                logger.info(f"Serving {response_format} output from the transcode cache.")
+                trace.set(cached=True)
+                size = os.fstat(cached.fileno()).st_size
+                METRIC_BYTES_OUT.inc(size, voice=final_voice, mode=mode)
+                response = send_file(cached, mimetype=content_type)
+                response.content_length = size
+                return response
+        if upstream_health.is_open():
+            return _upstream_unavailable_response()
 
-            for idx, chunk in enumerate(text_chunks, 1):
-                logger.info(f"Chunk {idx} length: {len(chunk)}")
+        # Identical concurrent requests share one generation (see OutputBroadcast).
+        flight_key = f"{mode}\x00{timestamps or ''}\x00" + (cache_key or transcode_cache_key(
+            final_voice, text, cleaning_options, None if chunk_plan else max_chunk_len, response_format, speed))
+        # Streams with word timings are sent as server-sent events.
+        stream_type = "text/event-stream" if timestamps else content_type
+        # With a lookahead the pump follows the client closely, so the
+        # generator's cursor is the client's playback position.
+        broadcast, leader = request_flights.join(
+            flight_key, lambda: OutputBroadcast(max_behind=0 if lookahead else None))
+        if not leader:
+            logger.info("Attaching to an identical request that is already being generated.")
+            METRIC_COALESCED_REQUESTS.inc(mode=mode)
+            trace.set(coalesced=True)
+            if stream_enabled:
+                return _broadcast_stream_response(flight_key, broadcast, stream_type)
+            await broadcast.wait()
+            return await _broadcast_response(broadcast, content_type)
 
+        # Coalesced requests add no upstream work, so only the leader of a new
+        # generation is admitted. Requests that joined it meanwhile get the
+        # same rejection.
+        ticket, rejection = admission.admit(
+            _request_token(), request.remote_addr,
+            final_voice, len(text), chunk_plan.target if chunk_plan else max_chunk_len,
+            chunk_plan.first if chunk_plan else max_chunk_len, stream_enabled)
+        if rejection:
+            broadcast.fail(*rejection[:2])
+            request_flights.leave(flight_key, broadcast)
+            return _admission_rejected_response(*rejection)
+
+        def reject(message, status):
+            broadcast.fail(message, status)
+            return jsonify({"error": {"message": message}}), status
+
+        started = False
+        try:
             if stream_enabled:
+                logger.info("[Step 1/4] Streaming text ingestion: cleaning and splitting incrementally...")
+                preprocess_start_time = time.time()
+                logger.info(f"Applying text cleaning with options: {cleaning_options}")
+                cleaner = get_text_cleaner(cleaning_options)
+                # Repeats are found on the cleaned sentences as they arrive; a
+                # whole-text pass here would delay the first chunk.
+                repeated = set()
+                text_chunks = iter_text_chunks(
+                    cleaner.iter_clean(text), max_chunk_len, chunk_plan, repeated, learn_repeats=True)
+                first_chunk = next(text_chunks, None)
+                METRIC_PREPROCESS_SECONDS.observe(time.time() - preprocess_start_time, voice=final_voice, mode=mode)
+                if first_chunk is None:
+                    return reject("Input text is empty.", 400)
+                # Cleaning and splitting continue lazily as the stream advances.
+                trace.span("first_chunk", preprocess_start_time, chars=len(first_chunk))
+                logger.info(f"First chunk ready in {time.time() - preprocess_start_time:.3f}s (length: {len(first_chunk)}).")
                 logger.info("Streaming mode enabled. Sending chunks as they are generated...")
 
-                return Response(
-                    generate_streaming_audio_sync(
-                        text_chunks,
+                broadcast.start(
+                    generate_streaming_audio_pipeline(
+                        itertools.chain([first_chunk], text_chunks),
                         final_voice,
                         sync_chunks,
                         max_concurrent_requests_override,
+                        rate,
+                        response_format,
+                        tempo,
+                        cache_key,
+                        repeated,
+                        lookahead,
+                        WordTimeline(timestamps, tempo) if timestamps else None,
+                        ticket,
+                        trace,
                     ),
-                    content_type="audio/mpeg",
+                    on_finish=lambda: (request_flights.leave(flight_key, broadcast), admission.release(ticket)),
                 )
+                started = True
+                return _broadcast_stream_response(flight_key, broadcast, stream_type)
 
-            temp_file_paths = await run_tts(
-                text_chunks,
-                final_voice,
-                temp_dir,
-                max_concurrent_requests_override,
-            )
-            generation_duration = time.time() - request_start_time
-            logger.info(f"Concurrent generation finished in {generation_duration:.2f}s.")
-            
-            logger.info("[Step 3/4] Stitching audio segments using FFmpeg...")
-            stitching_start_time = time.time()
-            list_file_path = os.path.join(temp_dir, "file_list.txt")
-            failed_chunks_indices = []
-            with open(list_file_path, "w", encoding='utf-8') as f:
-                for i, path in enumerate(temp_file_paths):
-                    if path: f.write(f"file '{os.path.basename(path)}'\n")
-                    else:
-                        silent_path = os.path.join(temp_dir, f"silent_{i}.mp3")
-                        subprocess.run(["ffmpeg", "-y", "-f", "lavfi", "-i", "anullsrc=r=24000:cl=mono", "-t", "0.2", "-q:a", "9", silent_path], check=True, capture_output=True)
-                        f.write(f"file '{os.path.basename(silent_path)}'\n")
-                        failed_chunks_indices.append(i + 1)
-            output_file_path = os.path.join(temp_dir, "final_output.mp3")
-            ffmpeg_command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_file_path, "-c", "copy", output_file_path]
-            process = await asyncio.create_subprocess_exec(*ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            stdout, stderr = await process.communicate()
-            if process.returncode != 0:
-                logger.error(f"FFmpeg failed with return code {process.returncode}.\nFFmpeg stderr:\n{stderr.decode(errors='ignore')}")
-                return jsonify({"error": {"message": "Failed to stitch audio files. Check server logs."}}), 500
-            stitching_duration = time.time() - stitching_start_time
-            logger.info(f"Stitching complete in {stitching_duration:.2f}s.")
-
-            logger.info("[Step 4/4] Exporting final audio and sending response...")
-            with open(output_file_path, 'rb') as f: final_audio_data = f.read()
-            final_audio_stream = BytesIO(final_audio_data)
+            logger.info("[Step 1/4] Pre-processing text...")
+            preprocess_start_time = time.time()
+            # Cleaning and splitting are CPU-bound; under ASGI this view runs on STREAM_LOOP.
+            processed_text = await asyncio.to_thread(pre_process_text, text, cleaning_options)
+            METRIC_PREPROCESS_SECONDS.observe(time.time() - preprocess_start_time, voice=final_voice, mode=mode)
+            trace.span("clean", preprocess_start_time)
+            if processed_text is None:
+                logger.error("\u274c processed_text is None!\uFF01\u8BF7\u68C0\u67E5\u524D\u9762\u7684\u6E05\u6D17\u903B\u8F91")
+
+            split_start_time = time.time()
+            text_chunks = await asyncio.to_thread(
+                split_text_isolating_repeats, processed_text, final_voice, max_chunk_len, chunk_plan)
+            METRIC_SPLIT_SECONDS.observe(time.time() - split_start_time, voice=final_voice, mode=mode)
+            trace.span("split", split_start_time, chunks=len(text_chunks))
+            if not text_chunks:
+                return reject("Input text is empty.", 400)
+
+            for idx, chunk in enumerate(text_chunks, 1):
+                logger.info(f"Chunk {idx} length: {len(chunk)}")
+
+            # Segments are stitched into the spool as they complete, so the
+            # request holds a bounded window of audio however long the text is.
+            spool = AudioSpool(OUTPUT_SPOOL_THRESHOLD)
+            timeline = WordTimeline(timestamps, tempo) if timestamps else None
+
+            def sink(i, audio, words):
+                segment = audio or generate_silence_bytes()
+                spool.add(i, segment)
+                if timeline is not None:
+                    timeline.add(i, text_chunks[i], segment, words)
+
+            try:
+                synthesis_start_time = time.time()
+                audio_segments = await run_tts(
+                    text_chunks,
+                    final_voice,
+                    max_concurrent_requests_override,
+                    rate,
+                    sink=sink,
+                    timed=timeline is not None,
+                    ticket=ticket,
+                    trace=trace,
+                )
+                trace.span("synthesize", synthesis_start_time)
+                generation_duration = time.time() - request_start_time
+                logger.info(f"Concurrent generation finished in {generation_duration:.2f}s.")
+
+                logger.info("[Step 3/4] Stitching audio segments...")
+                failed_chunks_indices = [i for i, ok in enumerate(audio_segments, 1) if not ok]
+                if not spool.size:
+                    logger.error("Stitching produced no audio frames.")
+                    spool.close()
+                    return reject("Failed to stitch audio files. Check server logs.", 500)
+                METRIC_STITCH_SECONDS.observe(spool.stitch_seconds, voice=final_voice, mode=mode)
+                # Stitching is interleaved with synthesis; the span carries its summed time.
+                trace.span("stitch", time.time() - spool.stitch_seconds, bytes=spool.size)
+                logger.info(f"Stitching complete in {spool.stitch_seconds:.2f}s ({spool.size} bytes, {'temp file' if spool.spilled else 'memory'}).")
+
+                logger.info("[Step 4/4] Exporting final audio and sending response...")
+                if transcode:
+                    logger.info(f"Transcoding to {response_format} (tempo {tempo})...")
+                    encode_start_time = time.time()
+                    encoded = await audio_transcoder.encode_file(spool.finish(), response_format, tempo)
+                    trace.span("encode", encode_start_time, response_format=response_format)
+                    spool.close()
+                    spool = encoded
+                    if not failed_chunks_indices:
+                        await asyncio.to_thread(transcode_cache.store_file, cache_key, spool.finish(), spool.size)
+            except BaseException:
+                spool.close()
+                raise
+            broadcast.publish(spool, timeline)
+            started = True
 
             total_request_duration = time.time() - request_start_time
+            trace.set(chunks=len(text_chunks), failed=len(failed_chunks_indices))
+            METRIC_REQUEST_SECONDS.observe(total_request_duration, voice=final_voice, mode=mode)
+            METRIC_BYTES_OUT.inc(spool.size, voice=final_voice, mode=mode)
+            METRIC_RESPONSE_BYTES.observe(spool.size, voice=final_voice, mode=mode)
             logger.info("="*50)
             logger.info("TTS Request Summary:")
             logger.info(f"  - Total Chunks: {len(text_chunks)}")
@@ -695,16 +4653,458 @@ async def generate_speech():
             if failed_chunks_indices: logger.warning(f"  - Indices of Failed Chunks: {failed_chunks_indices}")
             logger.info(f"  - Total Processing Time: {total_request_duration:.2f}s")
             logger.info("="*50)
-            
-            return send_file(final_audio_stream, mimetype='audio/mpeg', as_attachment=False)
+
+            return await _broadcast_response(broadcast, content_type)
+        finally:
+            if not started:
+                broadcast.fail("Internal server error.", 500)
+            if not stream_enabled or not started:
+                request_flights.leave(flight_key, broadcast)
+                admission.release(ticket)
+    except Exception as e:
+        logger.error(f"An unexpected error occurred in generate_speech: {e}", exc_info=True)
+        return jsonify({"error": {"message": "Internal server error."}}), 500
+
+def _build_batch_multipart(summary: dict, files, boundary: str) -> bytes:
+    body = BytesIO()
+    parts = [("manifest.json", "application/json", json.dumps(summary, ensure_ascii=False).encode('utf-8'))]
+    parts += [(name, "audio/mpeg", audio_data) for name, audio_data in files]
+    for name, content_type, payload in parts:
+        body.write(
+            f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Disposition: attachment; filename=\"{name}\"\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n".encode('ascii')
+        )
+        body.write(payload)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode('ascii'))
+    return body.getvalue()
+
+def _build_batch_zip(summary: dict, files) -> BytesIO:
+    archive = BytesIO()
+    # MP3 does not compress further; store entries as-is.
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+        zf.writestr("manifest.json", json.dumps(summary, ensure_ascii=False, indent=2))
+        for name, audio_data in files:
+            zf.writestr(name, audio_data)
+    archive.seek(0)
+    return archive
+
+@app.route('/v1/audio/batch', methods=['POST'])
+@token_required
+async def generate_speech_batch():
+    request_start_time = time.time()
+    g.trace = trace = RequestTrace.from_request("batch")
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get("items")
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": {"message": "Parameter 'items' must be a non-empty list"}}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({"error": {"message": f"At most {BATCH_MAX_ITEMS} items are allowed per batch"}}), 400
+        response_format = data.get("response_format") or (
+            "multipart" if "multipart/" in request.headers.get("Accept", "") else "zip")
+        if response_format not in ("zip", "multipart"):
+            return jsonify({"error": {"message": "Parameter 'response_format' must be 'zip' or 'multipart'"}}), 400
+        if upstream_health.is_open():
+            return _upstream_unavailable_response()
+
+        cleaner = get_text_cleaner(_resolve_cleaning_options(data))
+        max_chunk_len = _int_param(data.get("chunk_size"), CHUNK_SIZE)
+        max_concurrent_requests = _int_param(data.get("max_concurrent_requests"), MAX_CONCURRENT_REQUESTS)
+        split_start_time = time.time()
+        requested = []
+        item_ids = []
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            text, voice_name = item.get("input"), item.get("voice") or data.get("voice")
+            if not text or not voice_name:
+                return jsonify({"error": {"message": f"Item {index}: parameters 'input' and 'voice' are required"}}), 400
+            voice, voice_error = _resolve_voice(voice_name)
+            if voice_error:
+                return jsonify({"error": {"message": f"Item {index}: {voice_error}"}}), 400
+            requested.append((voice, text))
+            item_ids.append(str(item.get("id", index)))
+            METRIC_REQUESTS.inc(voice=voice, mode="batch")
+
+        # Each distinct input is cleaned and split once, off the event loop.
+        split_cache = await asyncio.to_thread(lambda: {
+            text: split_text_into_chunks(cleaner.clean(text), max_chunk_len=max_chunk_len)
+            for text in dict.fromkeys(text for _, text in requested)
+        })
+        parsed = [(voice, split_cache[text]) for voice, text in requested]
+
+        trace.span("split", split_start_time, items=len(items))
+        trace.set(items=len(items))
+        # The batch is judged like one full request over its distinct chunks,
+        # costed at the voice most of them use.
+        unique = batch_distinct_chunks(parsed)
+        chars = sum(len(chunk) for _, chunk in unique)
+        voices = defaultdict(int)
+        for voice, _ in unique:
+            voices[voice] += 1
+        ticket, rejection = admission.admit(
+            _request_token(), request.remote_addr, max(voices, key=voices.get, default=requested[0][0]), chars,
+            -(-chars // max(len(unique), 1)), max_chunk_len, False, chunks=len(unique))
+        if rejection:
+            return _admission_rejected_response(*rejection)
+        synthesis_start_time = time.time()
+        try:
+            outputs, synthesized = await run_tts_batch(parsed, max_concurrent_requests, trace, ticket)
+        finally:
+            admission.release(ticket)
+        trace.span("synthesize", synthesis_start_time, chunks=synthesized)
+
+        manifest = []
+        files = []
+        for index, ((voice, chunks), audio_data, item_id) in enumerate(zip(parsed, outputs, item_ids)):
+            entry = {"index": index, "id": item_id, "voice": voice}
+            if audio_data:
+                entry.update(status="ok", file=f"{index:05d}.mp3", bytes=len(audio_data))
+                files.append((entry["file"], audio_data))
+                METRIC_BYTES_OUT.inc(len(audio_data), voice=voice, mode="batch")
+            else:
+                entry["status"] = "failed" if chunks else "empty"
+            manifest.append(entry)
+        summary = {"object": "audio.batch", "items": len(items), "synthesized_chunks": synthesized, "data": manifest}
+        logger.info(
+            f"[Batch] Done in {time.time() - request_start_time:.2f}s: "
+            f"{sum(1 for e in manifest if e['status'] == 'ok')}/{len(items)} item(s) ok."
+        )
+
+        # Both bodies copy every output once; build them off the event loop.
+        if response_format == "multipart":
+            boundary = uuid.uuid4().hex
+            body = await asyncio.to_thread(_build_batch_multipart, summary, files, boundary)
+            return Response(body, content_type=f"multipart/mixed; boundary={boundary}")
+
+        archive = await asyncio.to_thread(_build_batch_zip, summary, files)
+        return send_file(archive, mimetype='application/zip', as_attachment=True, download_name='speech_batch.zip')
+    except Exception as e:
+        logger.error(f"An unexpected error occurred in generate_speech_batch: {e}", exc_info=True)
+        return jsonify({"error": {"message": "Internal server error."}}), 500
+
+@app.route('/v1/audio/jobs', methods=['POST'])
+@token_required
+async def create_speech_job():
+    try:
+        data = request.get_json()
+        text, voice_name = data.get("input"), data.get("voice")
+        if not text or not voice_name: return jsonify({"error": {"message": "Parameters 'input' and 'voice' are required"}}), 400
+        final_voice, voice_error = _resolve_voice(voice_name)
+        if voice_error: return jsonify({"error": {"message": voice_error}}), 400
+        if upstream_health.is_open():
+            return _upstream_unavailable_response()
+        cleaning_options = _resolve_cleaning_options(data)
+        max_concurrent_requests = _int_param(data.get("max_concurrent_requests"), MAX_CONCURRENT_REQUESTS)
+        METRIC_REQUESTS.inc(voice=final_voice, mode="job")
+
+        preprocess_start_time = time.time()
+        processed_text = await asyncio.to_thread(pre_process_text, text, cleaning_options)
+        METRIC_PREPROCESS_SECONDS.observe(time.time() - preprocess_start_time, voice=final_voice, mode="job")
+        max_chunk_len, chunk_plan = _resolve_chunk_plan(data, final_voice, len(processed_text), max_concurrent_requests)
+        split_start_time = time.time()
+        text_chunks = await asyncio.to_thread(
+            split_text_isolating_repeats, processed_text, final_voice, max_chunk_len, chunk_plan)
+        METRIC_SPLIT_SECONDS.observe(time.time() - split_start_time, voice=final_voice, mode="job")
+        if not text_chunks:
+            return jsonify({"error": {"message": "Input text is empty."}}), 400
+
+        job = job_manager.submit(final_voice, text_chunks, max_concurrent_requests)
+        response = jsonify(job.to_dict())
+        response.headers['Location'] = f"/v1/audio/jobs/{job.id}"
+        return response, 202
+    except Exception as e:
+        logger.error(f"An unexpected error occurred in create_speech_job: {e}", exc_info=True)
+        return jsonify({"error": {"message": "Internal server error."}}), 500
+
+@app.route('/v1/audio/jobs', methods=['GET'])
+@token_required
+async def list_speech_jobs():
+    return jsonify({"object": "list", "data": [job.to_dict() for job in job_manager.list_jobs()]})
+
+@app.route('/v1/audio/jobs/<job_id>', methods=['GET'])
+@token_required
+async def get_speech_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None: return jsonify({"error": {"message": "Job not found."}}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/v1/audio/jobs/<job_id>', methods=['DELETE'])
+@token_required
+async def delete_speech_job(job_id):
+    if not job_manager.delete(job_id): return jsonify({"error": {"message": "Job not found."}}), 404
+    return jsonify({"id": job_id, "object": "audio.job", "deleted": True})
+
+@app.route('/v1/audio/jobs/<job_id>/cancel', methods=['POST'])
+@token_required
+async def cancel_speech_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None: return jsonify({"error": {"message": "Job not found."}}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/v1/audio/jobs/<job_id>/resume', methods=['POST'])
+@token_required
+async def resume_speech_job(job_id):
+    job = job_manager.resume(job_id)
+    if job is None: return jsonify({"error": {"message": "Job not found."}}), 404
+    return jsonify(job.to_dict()), 202 if job.status == SpeechJob.QUEUED else 200
+
+@app.route('/v1/audio/jobs/<job_id>/content', methods=['GET'])
+@token_required
+async def get_speech_job_content(job_id):
+    job = job_manager.get(job_id)
+    if job is None: return jsonify({"error": {"message": "Job not found."}}), 404
+    if job.status != SpeechJob.COMPLETED:
+        return jsonify({"error": {"message": f"Job is {job.status}; audio is not available yet."}, **job.to_dict()}), 409
+    # conditional=True answers Range and If-None-Match requests from the file on disk.
+    return send_file(os.path.abspath(job.result_path), mimetype='audio/mpeg', conditional=True,
+                     download_name=f"{job.id}.mp3")
+
+# --- ASGI 服务 ---
+class AsgiBridge:
+    """ASGI front end for the Flask app, served on ``STREAM_LOOP``.
+
+    Requests are dispatched through Flask in a worker thread; ``async`` views
+    are handed back by asgiref to the serving loop, so views, upstream
+    connections, jobs and streaming responses all share ``STREAM_LOOP``.
+    ``AudioStream`` bodies are sent straight from the async generator, so a
+    streaming response occupies no thread while it is being generated.
+    """
+
+    def __init__(self, flask_app, loop, dispatch_threads: int = ASGI_DISPATCH_THREADS):
+        self.app = flask_app
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(max_workers=dispatch_threads, thread_name_prefix="asgi-dispatch")
+
+    async def _in_thread(self, func, *args):
+        return await sync_to_async(func, thread_sensitive=False, executor=self.executor)(*args)
+
+    @staticmethod
+    def _environ(scope, body: bytes) -> dict:
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope.get("headers", ()):
+            name = name.decode("latin-1")
+            key = {"content-type": "CONTENT_TYPE", "content-length": "CONTENT_LENGTH"}.get(
+                name, "HTTP_" + name.upper().replace("-", "_"))
+            value = value.decode("latin-1")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        # The body is fully buffered, so its real length is known even for chunked uploads.
+        environ["CONTENT_LENGTH"] = str(len(body))
+        return environ
+
+    def _dispatch(self, environ):
+        with self.app.request_context(environ):
+            try:
+                return self.app.full_dispatch_request()
+            except Exception as e:
+                return self.app.handle_exception(e)
+
+    @staticmethod
+    async def _start(send, status: int, headers):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        })
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.extend(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        environ = self._environ(scope, bytes(body))
+        response = await self._in_thread(self._dispatch, environ)
+
+        if isinstance(response.response, AudioStream) and environ["REQUEST_METHOD"] != "HEAD":
+            await self._start(send, response.status_code, response.get_wsgi_headers(environ).to_wsgi_list())
+            chunks = response.response.__aiter__()
+
+            async def forward():
+                async for chunk in chunks:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                await send({"type": "http.response.body", "body": b""})
+
+            async def disconnected():
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+
+            # Stop generating as soon as the client goes away, not only when
+            # the next send fails.
+            sender = asyncio.ensure_future(forward())
+            watcher = asyncio.ensure_future(disconnected())
+            try:
+                await asyncio.wait((sender, watcher), return_when=asyncio.FIRST_COMPLETED)
+                if sender.done():
+                    sender.result()
+                else:
+                    logger.info("Streaming client disconnected; stopping its generation.")
+            finally:
+                sender.cancel()
+                watcher.cancel()
+                await asyncio.gather(sender, watcher, return_exceptions=True)
+                await chunks.aclose()
+            return
+
+        app_iter, status, headers = response.get_wsgi_response(environ)
+        await self._start(send, int(status.split(" ", 1)[0]), headers)
+        try:
+            if isinstance(app_iter, (list, tuple)):
+                for chunk in app_iter:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            else:
+                # File bodies (send_file) are read off the loop.
+                iterator = iter(app_iter)
+                while (chunk := await self._in_thread(next, iterator, None)) is not None:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(app_iter, "close"):
+                await self._in_thread(app_iter.close)
+
+
+def serve_asgi(host: str, port: int, sock=None):
+    """Run uvicorn on ``STREAM_LOOP`` so every request shares that loop."""
+    server = uvicorn.Server(uvicorn.Config(AsgiBridge(app, STREAM_LOOP), host=host, port=port, lifespan="off"))
+    future = asyncio.run_coroutine_threadsafe(server.serve(sockets=[sock] if sock else None), STREAM_LOOP)
+    try:
+        future.result()
+    except KeyboardInterrupt:
+        server.should_exit = True
+        future.result(timeout=10)
+
+# --- 多进程模式 ---
+def _watch_config():
+    """Reload ``config.json`` changes saved by another worker, even while this one is idle."""
+    while True:
+        time.sleep(CONFIG_RELOAD_INTERVAL)
+        try:
+            reload_config_if_changed()
         except Exception as e:
-            logger.error(f"An unexpected error occurred in generate_speech: {e}", exc_info=True)
-            return jsonify({"error": {"message": "Internal server error."}}), 500
+            logger.warning(f"Failed to reload '{CONFIG_FILE}': {e}")
+
+def _serve_worker_admin(index: int):
+    """Serve this worker alone on ``worker_admin_port_base + index``, if configured.
+
+    Behind the shared port a request reaches whichever worker accepts it, so
+    per-worker state (``/metrics``, ``/v1/debug/profile``, cache and scheduler
+    stats) is only reliably reachable here.
+    """
+    base = int(config.get("worker_admin_port_base", 0) or 0)
+    if base <= 0:
+        return
+    host = config.get("worker_admin_host", "127.0.0.1")
+    server = make_server(host, base + index, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="worker-admin", daemon=True).start()
+    logger.info(f"[Worker {index}] admin endpoint on http://{host}:{base + index}")
+
+def _worker_main(index: int, sock, budget: SharedUpstreamBudget, use_asgi: bool, resume_jobs: bool):
+    global WORKER_INDEX
+    WORKER_INDEX = index
+    budget.attach(index, upstream_scheduler)
+    initialize_config()
+    parse_voices()
+    job_manager.load(resume=resume_jobs)
+    threading.Thread(target=_watch_config, name="config-watcher", daemon=True).start()
+    _serve_worker_admin(index)
+    host, port = sock.getsockname()[:2]
+    logger.info(f"[Worker {index}] pid {os.getpid()} serving on http://{host}:{port}")
+    if use_asgi:
+        serve_asgi(host, port, sock)
+    else:
+        make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+
+def run_workers(workers: int, host: str, port: int, use_asgi: bool):
+    """Serve ``workers`` processes behind one listening socket.
+
+    Workers are spawned (not forked, since this process already runs
+    ``STREAM_LOOP``) and share the socket, the upstream concurrency budget,
+    the audio cache and job directories. ``config.json`` changes saved by one
+    worker are picked up by the others within ``CONFIG_RELOAD_INTERVAL``, and
+    each worker can also be reached on its own admin port (see
+    ``_serve_worker_admin``). A worker that exits is restarted and the
+    upstream slots it held are returned to the budget.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    sock = socket.create_server((host, port), backlog=2048)
+    budget = SharedUpstreamBudget(ctx, workers, MAX_CONCURRENT_REQUESTS)
+    processes = {}
+
+    def start(index: int, resume_jobs: bool):
+        process = ctx.Process(target=_worker_main, args=(index, sock, budget, use_asgi, resume_jobs),
+                              name=f"tts-worker-{index}")
+        process.start()
+        processes[index] = process
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # Only the first generation of worker 0 resumes interrupted jobs, so a
+    # restarted worker cannot pick up jobs another worker is still running.
+    for index in range(workers):
+        start(index, resume_jobs=index == 0)
+    try:
+        while True:
+            multiprocessing.connection.wait([p.sentinel for p in processes.values()])
+            for index, process in list(processes.items()):
+                if process.is_alive(): continue
+                logger.warning(f"[Worker {index}] pid {process.pid} exited with code {process.exitcode}; restarting.")
+                budget.reset(index)
+                time.sleep(1)
+                start(index, resume_jobs=False)
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Shutting down worker processes...")
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=10)
+        sock.close()
 
 # --- 应用启动 ---
 if __name__ == '__main__':
     initialize_config()
     parse_voices()
+    use_asgi = config.get('server_mode') == 'asgi'
+    if use_asgi and uvicorn is None:
+        logger.warning("server_mode is 'asgi' but uvicorn is not installed; falling back to the Flask server.")
+        use_asgi = False
+    workers = max(int(config.get('workers', 1)), 1)
+    if workers == 1:
+        # With the debug reloader only the serving child process runs jobs.
+        job_manager.load(resume=use_asgi or is_running_from_reloader())
     
     port = int(config.get('port', 5050))
     logger.info(f"Server starting on http://0.0.0.0:{port}")
@@ -717,4 +5117,11 @@ if __name__ == '__main__':
     else:
         logger.warning("API Token is not configured. The API for TTS is open to public access.")
         
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    if workers > 1:
+        logger.info(f"Starting {workers} worker processes ({'ASGI' if use_asgi else 'Flask'} server).")
+        run_workers(workers, '0.0.0.0', port, use_asgi)
+    elif use_asgi:
+        logger.info("Serving through ASGI (uvicorn) on a single shared event loop.")
+        serve_asgi('0.0.0.0', port)
+    else:
+        app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
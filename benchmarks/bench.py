@@ -0,0 +1,544 @@
+"""Hot-path benchmarks for the speech endpoint against an offline upstream stand-in.
+
+The real Edge TTS service is replaced by ``MockUpstream``, a local stand-in
+with tunable latency, jitter, failure rate and delivery speed that returns
+valid MP3 frames sized to the input text. By default requests go through the
+Flask app in-process, so cleaning, chunking, scheduling, streaming and
+stitching are all measured, but no HTTP server or network is involved. With
+``--server asgi`` the app is served by uvicorn on ``STREAM_LOOP``, as with
+``server_mode: asgi``, and the clients send real HTTP requests; raise
+``--clients`` to load the shared event loop.
+
+Two ways of plugging in the stand-in are supported:
+
+- ``communicate`` (default) replaces ``edge_tts.Communicate`` and turns the
+  connection pool off.
+- ``websocket`` serves the Edge websocket protocol on localhost and points the
+  connection pool at it, so connection reuse is part of the measurement.
+
+Usage::
+
+    python benchmarks/bench.py --output bench.json
+    python benchmarks/bench.py --quick --baseline bench.json --tolerance 0.15
+    python benchmarks/bench.py --server asgi --clients 200 --sizes short --no-memory
+
+Results are written as JSON. With ``--baseline`` the run is compared against
+an earlier result file and the exit status is 1 if any scenario regressed by
+more than ``--tolerance``.
+"""
+import argparse
+import asyncio
+import atexit
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VOICES = {"latin": "en-US-AriaNeural", "cjk": "zh-CN-XiaoxiaoNeural"}
+SIZES = {"short": 120, "10k": 10_000, "500k": 500_000}
+# size -> (requests, concurrent clients)
+LOAD = {"short": (40, 8), "10k": (6, 2), "500k": (1, 1)}
+
+_LATIN_WORDS = (
+    "the quick brown fox jumps over a lazy dog while seven wizards quietly judge "
+    "every box of liquor jugs packed by bright young programmers near the harbour"
+).split()
+_CJK_CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理府研质各"
+_CJK_PUNCTUATION = "。！？"
+
+
+def make_text(script: str, length: int, seed: int) -> str:
+    """Deterministic prose of ``length`` characters with sentence punctuation."""
+    rng = random.Random(f"{script}-{length}-{seed}")
+    parts = []
+    total = 0
+    while total < length:
+        if script == "cjk":
+            sentence = "".join(rng.choice(_CJK_CHARS) for _ in range(rng.randint(8, 30))) + rng.choice(_CJK_PUNCTUATION)
+        else:
+            words = [rng.choice(_LATIN_WORDS) for _ in range(rng.randint(6, 18))]
+            sentence = " ".join(words).capitalize() + rng.choice(".?!") + " "
+        parts.append(sentence)
+        total += len(sentence)
+    return "".join(parts)[:length]
+
+
+class MockUpstream:
+    """Local stand-in for the Edge TTS service.
+
+    Each synthesis waits ``latency`` (plus up to ``jitter``) before the first
+    byte, fails with probability ``failure_rate``, and otherwise delivers
+    ``audio_bytes_per_text_byte`` bytes of MP3 per UTF-8 byte of text at
+    ``bytes_per_second``.
+    """
+
+    PIECE_FRAMES = 28
+
+    def __init__(self, frame: bytes, latency: float, jitter: float, failure_rate: float,
+                 bytes_per_second: float, audio_bytes_per_text_byte: float, seed: int):
+        self.frame = frame
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.bytes_per_second = bytes_per_second
+        self.audio_bytes_per_text_byte = audio_bytes_per_text_byte
+        self.calls = 0
+        self.failures = 0
+        self.active = 0
+        self.peak_active = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def settings(self) -> dict:
+        return {
+            "latency": self.latency,
+            "jitter": self.jitter,
+            "failure_rate": self.failure_rate,
+            "bytes_per_second": self.bytes_per_second,
+            "audio_bytes_per_text_byte": self.audio_bytes_per_text_byte,
+        }
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls = self.failures = self.peak_active = 0
+
+    async def audio(self, text: str):
+        """Yield MP3 pieces for ``text``; raises ``NoAudioReceived`` on a simulated failure."""
+        import edge_tts
+
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            failed = self._rng.random() < self.failure_rate
+        try:
+            await asyncio.sleep(delay)
+            if failed:
+                with self._lock:
+                    self.failures += 1
+                raise edge_tts.exceptions.NoAudioReceived("Simulated upstream failure.")
+            frames = max(1, round(len(text.encode("utf-8")) * self.audio_bytes_per_text_byte / len(self.frame)))
+            piece_seconds = self.PIECE_FRAMES * len(self.frame) / self.bytes_per_second if self.bytes_per_second else 0
+            for start in range(0, frames, self.PIECE_FRAMES):
+                yield self.frame * min(self.PIECE_FRAMES, frames - start)
+                await asyncio.sleep(piece_seconds)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def communicate_class(self):
+        mock = self
+
+        class MockCommunicate:
+            def __init__(self, text, voice, **kwargs):
+                self.text = text
+
+            async def stream(self):
+                async for piece in mock.audio(self.text):
+                    yield {"type": "audio", "data": piece}
+
+        return MockCommunicate
+
+    async def serve_websocket(self, host: str = "127.0.0.1"):
+        """Serve the Edge websocket protocol; returns the ``ws://`` URL."""
+        import aiohttp
+        from aiohttp import web
+
+        async def handler(request):
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT or "Path:ssml" not in msg.data:
+                    continue
+                ssml = msg.data.split("\r\n\r\n", 1)[1]
+                text = ssml.split("volume='+0%'>", 1)[-1].rsplit("</prosody>", 1)[0]
+                request_id = "X-RequestId:bench\r\n"
+                await ws.send_str(f"{request_id}Path:turn.start\r\n\r\n{{}}")
+                head = f"{request_id}Content-Type:audio/mpeg\r\nPath:audio".encode()
+                try:
+                    async for piece in self.audio(text):
+                        await ws.send_bytes(len(head).to_bytes(2, "big") + head + piece)
+                except Exception:
+                    pass  # No audio before turn.end is reported as NoAudioReceived.
+                await ws.send_str(f"{request_id}Path:turn.end\r\n\r\n{{}}")
+            return ws
+
+        application = web.Application()
+        application.router.add_get("/ws", handler)
+        runner = web.AppRunner(application)
+        await runner.setup()
+        sock = socket.socket()
+        sock.bind((host, 0))
+        await web.SockSite(runner, sock).start()
+        return f"ws://{host}:{sock.getsockname()[1]}/ws"
+
+
+def percentile(values, fraction: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(values) -> dict:
+    if not values:
+        return {"p50": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": round(percentile(values, 0.5), 6),
+        "p99": round(percentile(values, 0.99), 6),
+        "mean": round(sum(values) / len(values), 6),
+        "max": round(max(values), 6),
+    }
+
+
+def serve_asgi(tts) -> int:
+    """Serve the app through ``AsgiBridge`` on ``STREAM_LOOP``, as ``server_mode: asgi`` does; returns the port."""
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(
+        tts.AsgiBridge(tts.app, tts.STREAM_LOOP), lifespan="off", log_level="warning", backlog=4096))
+    future = asyncio.run_coroutine_threadsafe(server.serve(sockets=[sock]), tts.STREAM_LOOP)
+    while not server.started:
+        if future.done():
+            future.result()
+        time.sleep(0.01)
+    return sock.getsockname()[1]
+
+
+def max_rss_bytes() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Bench:
+    def __init__(self, tts, mock: MockUpstream, args, port: int | None = None):
+        self.tts = tts
+        self.mock = mock
+        self.args = args
+        self.port = port
+
+    def _client(self):
+        if self.port is None:
+            return self.tts.app.test_client()
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=600)
+
+    def _post(self, client, body: dict):
+        """Send ``body`` to the speech endpoint; returns ``(status, pieces, close)``."""
+        if self.port is None:
+            response = client.post("/v1/audio/speech", json=body, buffered=False)
+            return response.status_code, response.response, response.close
+        client.request("POST", "/v1/audio/speech", json.dumps(body), {"Content-Type": "application/json"})
+        response = client.getresponse()
+        if response.status != 200:
+            response.read()  # Keep the connection usable.
+        return response.status, iter(lambda: response.read1(65536), b""), response.close
+
+    def _reset_upstream(self):
+        # A breaker tripped by simulated failures must not leak into the next scenario.
+        self.tts.upstream_health = self.tts.UpstreamHealth(self.tts.upstream_scheduler)
+        self.tts.upstream_scheduler.set_throttle(None)
+
+    def _request(self, client, body: dict):
+        start = time.perf_counter()
+        # Bodies are read piece by piece in both modes, so the memory pass
+        # measures the server rather than a client-side copy of the response.
+        status, pieces, close = self._post(client, body)
+        first_byte = None
+        size = 0
+        try:
+            if status != 200:
+                return None
+            for piece in pieces:
+                if piece and first_byte is None:
+                    first_byte = time.perf_counter() - start
+                size += len(piece)
+        finally:
+            close()
+        return time.perf_counter() - start, first_byte, size
+
+    def scenario(self, script: str, size: str, mode: str) -> dict:
+        requests, clients = LOAD[size]
+        if self.args.requests:
+            requests = self.args.requests
+        if self.args.clients:
+            clients = self.args.clients
+            requests = max(requests, clients)
+        text = make_text(script, SIZES[size], self.args.seed)
+        body = {"input": text, "voice": VOICES[script], "stream": mode == "stream"}
+        self._reset_upstream()
+        self.mock.reset_counters()
+
+        local = threading.local()
+        peak_threads = 0
+
+        def run_one(_):
+            nonlocal peak_threads
+            if not hasattr(local, "client"):
+                local.client = self._client()
+            outcome = self._request(local.client, body)
+            # Includes the client threads; in-process, the server runs in them.
+            peak_threads = max(peak_threads, threading.active_count())
+            return outcome
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            outcomes = list(pool.map(run_one, range(requests)))
+        wall = time.perf_counter() - wall_start
+        ok = [o for o in outcomes if o is not None]
+        audio_bytes = sum(o[2] for o in ok)
+        upstream_calls, upstream_failures, peak_active = self.mock.calls, self.mock.failures, self.mock.peak_active
+
+        peak_memory = None
+        if not self.args.no_memory:
+            # Separate pass: tracing allocations slows the hot path down.
+            self._reset_upstream()
+            tracemalloc.start()
+            try:
+                self._request(self._client(), body)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        return {
+            "name": f"{mode}-{script}-{size}" + ("" if self.port is None else "-asgi"),
+            "mode": mode,
+            "script": script,
+            "input_chars": len(text),
+            "requests": requests,
+            "clients": clients,
+            "errors": requests - len(ok),
+            "wall_seconds": round(wall, 6),
+            "throughput": {
+                "requests_per_second": round(len(ok) / wall, 3) if wall else None,
+                "chars_per_second": round(len(ok) * len(text) / wall, 1) if wall else None,
+                "audio_bytes_per_second": round(audio_bytes / wall, 1) if wall else None,
+            },
+            "latency_seconds": summarize([o[0] for o in ok]),
+            "ttfb_seconds": summarize([o[1] for o in ok if o[1] is not None]),
+            "audio_bytes": audio_bytes,
+            "upstream": {"calls": upstream_calls, "failures": upstream_failures, "peak_concurrency": peak_active},
+            "peak_traced_memory_bytes": peak_memory,
+            "max_rss_bytes": max_rss_bytes(),
+            "peak_threads": peak_threads,
+        }
+
+    def stitch(self) -> dict:
+        """Throughput of ``stitch_mp3_segments`` on 1,000 segments of about 14 KB."""
+        segments = [self.tts.generate_silence_bytes(2.4) for _ in range(1000)]
+        total = sum(len(s) for s in segments)
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            self.tts.stitch_mp3_segments(segments)
+            timings.append(time.perf_counter() - start)
+        return {"name": "stitch", "input_bytes": total, "seconds": summarize(timings),
+                "bytes_per_second": round(total / percentile(timings, 0.5), 1)}
+
+    async def _start_stop_encoder(self, response_format: str):
+        proc = await self.tts.audio_transcoder._spawn(response_format, 1.0)
+        proc.stdin.close()
+        await proc.communicate()
+
+    def transcode(self) -> list:
+        """Encode throughput per ``response_format``, in MP3 input bytes per second.
+
+        Every encode runs in its own ffmpeg process. ``cold_start_seconds`` is
+        what starting and stopping one costs, which a request pays whenever no
+        warm spare is waiting; ``warm_hits`` counts the encodes that found one.
+        """
+        transcoder = self.tts.audio_transcoder
+        if not transcoder.available:
+            return [{"name": "transcode", "skipped": "ffmpeg not found"}]
+        data = self.tts.generate_silence_bytes(60.0)
+        results = []
+        for response_format in transcoder.FORMATS:
+            timings = []
+            out = b""
+            warm_hits = transcoder.warm_hits
+            for _ in range(3):
+                start = time.perf_counter()
+                out = asyncio.run_coroutine_threadsafe(
+                    transcoder.encode(data, response_format), self.tts.STREAM_LOOP).result()
+                timings.append(time.perf_counter() - start)
+            warm_hits = transcoder.warm_hits - warm_hits
+            cold_starts = []
+            for _ in range(3):
+                start = time.perf_counter()
+                asyncio.run_coroutine_threadsafe(self._start_stop_encoder(response_format), self.tts.STREAM_LOOP).result()
+                cold_starts.append(time.perf_counter() - start)
+            results.append({
+                "name": f"transcode-{response_format}",
+                "input_bytes": len(data),
+                "output_bytes": len(out),
+                "seconds": summarize(timings),
+                "input_bytes_per_second": round(len(data) / percentile(timings, 0.5), 1),
+                "warm_hits": warm_hits,
+                "cold_start_seconds": summarize(cold_starts),
+            })
+        return results
+
+
+# metric path -> True if larger is better
+_GATED_METRICS = {
+    ("throughput", "chars_per_second"): True,
+    ("latency_seconds", "p50"): False,
+    ("latency_seconds", "p99"): False,
+    ("ttfb_seconds", "p50"): False,
+    ("peak_traced_memory_bytes",): False,
+}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return human-readable regressions of ``results`` against ``baseline``."""
+    previous = {s["name"]: s for s in baseline.get("scenarios", [])}
+    regressions = []
+    for scenario in results["scenarios"]:
+        before = previous.get(scenario["name"])
+        if before is None:
+            continue
+        for path, higher_is_better in _GATED_METRICS.items():
+            new, old = scenario, before
+            for key in path:
+                new = new.get(key) if isinstance(new, dict) else None
+                old = old.get(key) if isinstance(old, dict) else None
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{scenario['name']} {'.'.join(path)}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--upstream", choices=("communicate", "websocket"), default="communicate",
+                        help="where the stand-in is plugged in (default: communicate)")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds before the first audio byte")
+    parser.add_argument("--jitter", type=float, default=0.05, help="extra random latency, in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability that an attempt fails")
+    parser.add_argument("--bytes-per-second", type=float, default=500_000, help="audio delivery speed per synthesis")
+    parser.add_argument("--audio-bytes-per-text-byte", type=float, default=400,
+                        help="MP3 bytes returned per UTF-8 byte of text (400 is about real time for 48 kbps)")
+    parser.add_argument("--scripts", default="latin,cjk", help="comma-separated scripts to run")
+    parser.add_argument("--sizes", default="short,10k,500k", help="comma-separated input sizes to run")
+    parser.add_argument("--modes", default="full,stream", help="comma-separated response modes to run")
+    parser.add_argument("--quick", action="store_true", help="skip the 500k inputs")
+    parser.add_argument("--server", choices=("inprocess", "asgi"), default="inprocess",
+                        help="call the app in-process or over HTTP through uvicorn (default: inprocess)")
+    parser.add_argument("--requests", type=int, default=0, help="override the request count of every scenario")
+    parser.add_argument("--clients", type=int, default=0, help="override the concurrent clients of every scenario")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced peak-memory pass")
+    parser.add_argument("--config", action="append", default=[], metavar="KEY=VALUE",
+                        help="config.json override, VALUE parsed as JSON (repeatable)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression (default 0.15)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    overrides = {"audio_cache_max_bytes": 0, "transcode_cache_max_bytes": 0,
+                 "admission_slo_seconds": 0, "admission_stream_slo_seconds": 0,
+                 "upstream_connection_reuse": args.upstream == "websocket"}
+    for item in args.config:
+        key, _, value = item.partition("=")
+        try:
+            overrides[key] = json.loads(value)
+        except json.JSONDecodeError:
+            overrides[key] = value
+
+    resolve = lambda path: os.path.join(invocation_dir, path)
+    invocation_dir = os.getcwd()
+    # The app keeps its config, caches and jobs relative to the working directory.
+    workdir = tempfile.mkdtemp(prefix="tts-bench-")
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    os.chdir(workdir)
+    with open("config.json", "w", encoding="utf-8") as f:
+        json.dump(overrides, f)
+    sys.path.insert(0, REPO_ROOT)
+    import edge_tts
+    import app as tts
+
+    logging.getLogger().setLevel(logging.WARNING)
+    tts.initialize_config()
+    mock = MockUpstream(tts._SILENT_MP3_FRAME, args.latency, args.jitter, args.failure_rate,
+                        args.bytes_per_second, args.audio_bytes_per_text_byte, args.seed)
+    if args.upstream == "websocket":
+        url = asyncio.run_coroutine_threadsafe(mock.serve_websocket(), tts.STREAM_LOOP).result()
+        tts.upstream_pool._connect_url = lambda: url
+    else:
+        edge_tts.Communicate = mock.communicate_class()
+
+    bench = Bench(tts, mock, args, serve_asgi(tts) if args.server == "asgi" else None)
+    sizes = [s for s in args.sizes.split(",") if s and not (args.quick and s == "500k")]
+    scenarios = []
+    for size in sizes:
+        for script in args.scripts.split(","):
+            for mode in args.modes.split(","):
+                result = bench.scenario(script, size, mode)
+                scenarios.append(result)
+                print(f"{result['name']:>22}: p50 {result['latency_seconds']['p50']}s, "
+                      f"ttfb p50 {result['ttfb_seconds']['p50']}s, "
+                      f"{result['throughput']['chars_per_second']} chars/s, errors {result['errors']}",
+                      file=sys.stderr)
+
+    results = {
+        "version": 1,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "server": args.server,
+        "upstream": {"mode": args.upstream, **mock.settings()},
+        "config": {key: tts.config.get(key) for key in (
+            "max_concurrent_requests", "chunk_size", "sync_chunks", "adaptive_chunking", "upstream_connection_reuse")},
+        "scenarios": scenarios,
+        "micro": [bench.stitch(), *bench.transcode()],
+    }
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(resolve(args.output), "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+    if args.baseline:
+        with open(resolve(args.baseline), encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
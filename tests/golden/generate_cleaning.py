@@ -0,0 +1,78 @@
+"""Regenerate cleaning.json from the original (baseline a96b1aa) pre_process_text.
+
+Run from the repository root: ``python tests/golden/generate_cleaning.py``.
+"""
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+
+import emoji
+
+BASELINE = "a96b1aa"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+TEXTS = [
+    "",
+    "   \n\n\t  ",
+    "# 标题\n\n这是第一行\n被 PDF 截断的句子。\n\n第二段 ， 有空格 。",
+    "**Bold** and __strong__ and *em* and _under_ text.\n> quoted line\n- item one\n* item two\n1. first\n2. second\n---\n",
+    "See [the docs](https://example.com/docs) and ![alt text](img.png) or [![badge](b.svg)](https://ci).",
+    "```python\nprint('code')\n```\nInline `code` here.\nVersion 3.14 is out. Call 555 1234.",
+    "Visit https://example.com/a?b=c or www.example.org now!\nhttp://x.y/z trailing",
+    "Emoji 😀 party 🎉🎉 flags 🇨🇳 family 👨‍👩‍👧 keycap 1️⃣ done.",
+    "中文（ 括号 ）《 书名 》「 引号 」『 双引号 』测试？是的！好\n继续\t制表符",
+    "Line one without stop\nline two continues\n\n\nNew paragraph.\nAnother?\nYes!\n  indented  line  ",
+    "广告：点击这里购买！本文由赞助商提供。abcabc ab bc abcd 广告位招租",
+    "snake_case_name and 2*3*4 and a_b_c plus ** unmatched",
+    "混合 English 与中文 mixed text 。End",
+]
+
+SMALL_KEYWORDS = "广告, 赞助商,abc, ab ,bc,点击这里购买"
+LARGE_KEYWORDS = ",".join(
+    ["ab", "abc", "bcd", "b", "广告位", "广告", "赞助", "赞助商提供", "http", "Line", "ine o"]
+    + [f"kw{i:03d}" for i in range(150)]
+)
+# Below and above AHO_CORASICK_MIN_KEYWORDS, so both keyword matchers are covered.
+KEYWORD_SETS = {"none": "", "small": SMALL_KEYWORDS, "large": LARGE_KEYWORDS}
+
+
+def random_texts(count=24, seed=8):
+    rng = random.Random(seed)
+    alphabet = list("abcdkw0123 .。，！？?!\n\t*_#>-`[]()（）广告赞助商中文") + ["😀", "https://e.x/y ", "\n\n"]
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 120))) for _ in range(count)]
+
+
+def load_baseline():
+    source = subprocess.run(["git", "show", f"{BASELINE}:app.py"], capture_output=True, text=True, check=True).stdout
+    start = source.index("def pre_process_text(")
+    end = source.index("\ndef ", start + 1)
+    namespace = {"re": re, "emoji": emoji, "logger": logging.getLogger("golden")}
+    exec(source[start:end], namespace)
+    return namespace["pre_process_text"]
+
+
+def main():
+    pre_process_text = load_baseline()
+    cases = []
+    texts = TEXTS + random_texts()
+    for index, text in enumerate(texts):
+        for flags in itertools.product([False, True], repeat=4):
+            for keyword_set, keywords in KEYWORD_SETS.items():
+                options = dict(zip(("remove_markdown", "remove_emoji", "no_urls", "no_line_breaks"), flags))
+                expected = pre_process_text(text, dict(options, custom_keywords=keywords))
+                cases.append({"text": index, "options": options, "keywords": keyword_set, "expected": expected})
+    with open(os.path.join(HERE, "cleaning.json"), "w", encoding="utf-8") as f:
+        header = json.dumps({"baseline": BASELINE, "keyword_sets": KEYWORD_SETS, "texts": texts},
+                            ensure_ascii=False, indent=1)
+        # One case per line keeps diffs of regenerated fixtures readable.
+        f.write(header[:-2] + ',\n "cases": [\n')
+        f.write(",\n".join(json.dumps(case, ensure_ascii=False) for case in cases))
+        f.write("\n ]\n}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""AdmissionController: SLO and quota checks, and the backlog shared with batches and jobs."""
+import asyncio
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    controller = app.AdmissionController(app.UpstreamScheduler(2), slo=1.0)
+    monkeypatch.setattr(app, "admission", controller)
+    return controller
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(app.config, "api_token", "")
+    monkeypatch.setitem(app.config, "openai_voice_map", {})
+    return app.app.test_client()
+
+
+def test_batch_is_rejected_behind_a_backlog(client, admission, monkeypatch):
+    async def unexpected(*args, **kwargs):
+        raise AssertionError("a rejected batch must not be synthesized")
+    monkeypatch.setattr(app, "run_tts_batch", unexpected)
+    admission.track("job:x", "v", 100_000, 1000)
+    response = client.post("/v1/audio/batch", json={"voice": "en-US-AriaNeural", "items": [
+        {"input": "One sentence here."}, {"input": "Another sentence there."}]})
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    assert admission.rejected["slo"] == 1
+
+
+def test_admitted_batch_holds_a_ticket_until_done(client, admission, monkeypatch):
+    seen = []
+
+    async def run(items, max_concurrent_requests=None, trace=None, ticket=None):
+        seen.append((ticket.work, admission.stats()["in_flight"]))
+        return [b"audio"] * len(items), len(app.batch_distinct_chunks(items))
+    monkeypatch.setattr(app, "run_tts_batch", run)
+    response = client.post("/v1/audio/batch", json={"voice": "en-US-AriaNeural", "items": [
+        {"input": "Same text."}, {"input": "Same text."}], "response_format": "multipart"})
+    assert response.status_code == 200
+    # Two identical items are one distinct chunk of upstream work.
+    per_chunk = app.chunk_cost_model.expected_cost("en-US-AriaNeural", len("Same text."))
+    assert seen == [(pytest.approx(per_chunk), 1)]
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_running_job_counts_in_the_backlog(admission, monkeypatch, tmp_path):
+    backlog = []
+
+    async def synthesize(upstream, index, text, voice, *args):
+        backlog.append(admission.backlog())
+        return b"\xff\xfb" + text.encode(), 1, 0.0, []
+    monkeypatch.setattr(app, "text_to_speech_with_retry", synthesize)
+    manager = app.JobManager(str(tmp_path), None)
+    job = app.SpeechJob(str(tmp_path / "job"), "job", "v", ["a", "b", "a"])
+    asyncio.run(manager._run(job))
+    assert job.status == app.SpeechJob.COMPLETED
+    # Two distinct texts are owed when the first one starts.
+    per_chunk = app.chunk_cost_model.expected_cost("v", 1)
+    assert backlog[0] == pytest.approx(2 * per_chunk)
+    assert admission.backlog() == 0
+    assert admission.stats()["in_flight"] == 0
+
+
+class FlatCost:
+    """One second per chunk, whatever its voice and length."""
+
+    def expected_cost(self, voice, length):
+        return 1.0
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(app, "chunk_cost_model", FlatCost())
+    return app.AdmissionController(app.UpstreamScheduler(2), slo=10.0, stream_slo=2.0)
+
+
+def admit(controller, chars, stream=False, token="t", chunk_len=100):
+    return controller.admit(token, "127.0.0.1", "v", chars, chunk_len, chunk_len, stream)
+
+
+def test_idle_server_admits_any_length(controller):
+    ticket, rejection = admit(controller, 100_000)
+    assert rejection is None and ticket.work == 1000
+    assert controller.stats()["backlog_seconds"] == 1000
+
+
+def test_full_request_rejected_behind_the_backlog(controller):
+    admit(controller, 3000)
+    assert admit(controller, 1000)[1] is None
+    ticket, rejection = admit(controller, 1200)
+    # 12 chunks of its own, plus up to 12 of each admitted ticket (12 + 10), over 2 slots.
+    assert ticket is None
+    message, status, retry_after = rejection
+    assert status == 429 and "17.0s exceeds 10s" in message
+    assert retry_after == pytest.approx(7.0)
+    assert controller.rejected == {"slo": 1}
+
+
+def test_progress_and_release_shrink_the_backlog(controller):
+    first, _ = admit(controller, 3000)
+    for _ in range(25):
+        first.progress()
+    assert controller.backlog() == 5
+    assert admit(controller, 1000)[1] is None
+    controller.release(first)
+    assert controller.backlog() == 10
+    assert controller.stats()["in_flight"] == 1
+
+
+def test_streams_are_judged_by_time_to_first_audio(controller):
+    admit(controller, 3000)
+    ticket, rejection = admit(controller, 3000, stream=True)
+    assert rejection is None and ticket.stream
+    controller.scheduler.active = 2
+    controller.scheduler._priority.extend([object()] * 3)
+    _, rejection = admit(controller, 3000, stream=True)
+    assert rejection[1] == 429 and "time to first audio" in rejection[0]
+
+
+def test_client_quotas(controller):
+    controller.configure(0, 0, 500, {"vip": 2000})
+    _, rejection = admit(controller, 600)
+    assert rejection[:2] == ("Input of 600 characters exceeds the client quota of 500; use /v1/audio/jobs.", 413)
+    assert admit(controller, 400)[1] is None
+    _, rejection = admit(controller, 200)
+    assert rejection[1] == 429
+    # Other clients have their own budget.
+    assert admit(controller, 400, token="other")[1] is None
+    assert admit(controller, 1500, token="vip")[1] is None
+    assert controller.rejected == {"quota": 2}
+
+
+def test_limits_of_zero_disable_checks(controller):
+    controller.configure(0, 0, 0, None)
+    admit(controller, 100_000)
+    assert admit(controller, 100_000)[1] is None
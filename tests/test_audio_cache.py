@@ -0,0 +1,81 @@
+"""AudioCache: keys, LRU eviction by byte budget, runtime resizing and the chunk cache."""
+import asyncio
+import threading
+
+import app
+
+
+def test_lru_eviction_keeps_the_budget(tmp_path):
+    cache = app.AudioCache(str(tmp_path), 250)
+    cache.store("a", b"x" * 100)
+    cache.store("b", b"y" * 100)
+    assert cache.load("a") == b"x" * 100  # "a" is now the most recently used
+    cache.store("c", b"z" * 100)
+    assert cache.load("b") is None
+    assert cache.load("a") is not None and cache.load("c") is not None
+    assert cache.stats()["bytes"] == 200
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    app.AudioCache(str(tmp_path), 1000).put("voice", "Some  text.", b"mp3")
+    cache = app.AudioCache(str(tmp_path), 1000)
+    assert cache.get("voice", "Some text.") == b"mp3"
+    assert cache.get("other", "Some text.") is None
+
+
+def test_resize_evicts_disables_and_reenables(tmp_path):
+    cache = app.AudioCache(str(tmp_path), 1000)
+    for key in "abc":
+        cache.store(key, b"x" * 100)
+    cache.resize(150)
+    assert cache.stats()["entries"] == 1
+    assert cache.load("c") is not None
+    cache.resize(0)
+    assert not cache.enabled and cache.load("c") is None
+    # Disabling keeps the files; enabling again indexes them.
+    cache.resize(1000)
+    assert cache.load("c") == b"x" * 100
+
+
+def test_keys_separate_voice_text_and_rate():
+    key = app.AudioCache.make_key("v", "Some text.", "+0%")
+    assert key == app.AudioCache.make_key("v", " Some   text. ", "+0%")
+    assert key != app.AudioCache.make_key("v", "Some text.", "+10%")
+    assert key != app.AudioCache.make_key("w", "Some text.", "+0%")
+    assert key != app.AudioCache.make_key("v", "Other text.", "+0%")
+
+
+def test_disabled_cache_misses_and_stores_nothing(tmp_path):
+    cache = app.AudioCache(str(tmp_path), 0)
+    cache.store("a", b"x")
+    assert cache.load("a") is None
+    assert not any(tmp_path.iterdir())
+
+
+def test_chunk_cache_keeps_word_timings(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "audio_cache", app.AudioCache(str(tmp_path), 1000))
+    monkeypatch.setattr(app, "word_cache", app.AudioCache(str(tmp_path), 1000, suffix=".words"))
+    assert app.load_cached_chunk("v", "Hello.") is None
+    app.store_cached_chunk("v", "Hello.", b"mp3", [[0, 10, "Hello"]])
+    assert app.load_cached_chunk("v", "Hello.") == (b"mp3", None)
+    assert app.load_cached_chunk("v", "Hello.", timed=True) == (b"mp3", [[0, 10, "Hello"]])
+    # Audio cached without timings is a miss for a timed lookup.
+    app.audio_cache.store(app.AudioCache.make_key("v", "Bye.", "+0%"), b"mp3")
+    assert app.load_cached_chunk("v", "Bye.") == (b"mp3", None)
+    assert app.load_cached_chunk("v", "Bye.", timed=True) is None
+
+
+def test_chunk_cache_is_read_off_the_event_loop(monkeypatch):
+    threads = []
+
+    def load(*args):
+        threads.append(threading.get_ident())
+        return b"mp3", None
+    monkeypatch.setattr(app, "load_cached_chunk", load)
+
+    async def lookup():
+        upstream = app.UpstreamScheduler(1).session()
+        return await app.text_to_speech_with_retry(upstream, 0, "Hello.", "v"), threading.get_ident()
+    (audio, attempts, _, _), loop_thread = asyncio.run(lookup())
+    assert (audio, attempts) == (b"mp3", 0)
+    assert threads and threads[0] != loop_thread
@@ -0,0 +1,49 @@
+"""AudioSpool: output stitched in index order, kept in memory only while small."""
+import pytest
+
+import app
+
+HEADER = bytes([0xFF, 0xF3, 0x64, 0xC4])
+
+
+def frame(fill: int) -> bytes:
+    return HEADER + bytes([fill]) * 140
+
+
+def test_small_output_stays_in_memory():
+    spool = app.AudioSpool(threshold=1000)
+    spool.add(0, frame(1))
+    spool.add(1, frame(2))
+    assert not spool.spilled
+    assert spool.finish().read() == frame(1) + frame(2)
+    spool.close()
+
+
+def test_large_output_moves_to_disk():
+    spool = app.AudioSpool(threshold=200)
+    spool.add(0, frame(1))
+    assert not spool.spilled
+    spool.add(1, frame(2))
+    assert spool.spilled
+    assert spool.size == 2 * len(frame(0))
+    assert spool.read_at(len(frame(0)), 5) == frame(2)[:5]
+    assert spool.finish().read() == frame(1) + frame(2)
+    spool.close()
+
+
+@pytest.mark.parametrize("reorder_bytes", [10_000, 0])
+def test_segments_are_stitched_in_index_order(reorder_bytes):
+    # With no reorder budget early segments wait in the scratch file.
+    spool = app.AudioSpool(threshold=10_000, reorder_bytes=reorder_bytes)
+    for index in (2, 0, 3, 1):
+        spool.add(index, frame(index) + frame(index))
+    assert spool.finish().read() == b"".join(frame(i) * 2 for i in range(4))
+    spool.close()
+
+
+def test_finish_requires_every_segment():
+    spool = app.AudioSpool(threshold=10_000)
+    spool.add(1, frame(1))
+    with pytest.raises(ValueError):
+        spool.finish()
+    spool.close()
@@ -0,0 +1,37 @@
+"""Chunk planning: fixed CHUNK_SIZE by default, adaptive plans bounded by it."""
+import pytest
+
+import app
+
+
+def test_plan_never_exceeds_max_len():
+    model = app.ChunkCostModel()
+    assert model.plan("v", 100_000, 1).target > 300
+    plan = model.plan("v", 100_000, 1, streaming=True, max_len=300)
+    assert plan.target <= 300
+    assert plan.first <= plan.target
+    assert all(plan(i) <= 300 for i in range(10))
+
+
+def test_plan_below_min_len():
+    assert app.ChunkCostModel(min_len=100).plan("v", 10_000, 4, max_len=60).target == 60
+
+
+@pytest.fixture
+def chunk_config(monkeypatch):
+    monkeypatch.setattr(app, "CHUNK_SIZE", 250)
+    monkeypatch.delitem(app.config, "adaptive_chunking", raising=False)
+
+
+def test_adaptive_chunking_is_opt_in(chunk_config):
+    with app.app.test_request_context(json={}):
+        assert app._resolve_chunk_plan({}, "v", 50_000, 4) == (250, None)
+
+
+def test_adaptive_plan_is_bounded_by_chunk_size(chunk_config, monkeypatch):
+    monkeypatch.setitem(app.config, "adaptive_chunking", True)
+    with app.app.test_request_context(json={}):
+        max_chunk_len, plan = app._resolve_chunk_plan({}, "v", 50_000, 4)
+        assert max_chunk_len == 250
+        assert plan.target <= 250
+        assert app._resolve_chunk_plan({"chunk_size": 120}, "v", 50_000, 4) == (120, None)
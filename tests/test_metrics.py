@@ -0,0 +1,36 @@
+"""Prometheus registry: rendering and the per-voice latency breakdown."""
+import asyncio
+
+import app
+
+
+def test_latency_histograms_share_the_synthesis_label_set():
+    for metric in (app.METRIC_PREPROCESS_SECONDS, app.METRIC_SPLIT_SECONDS, app.METRIC_SLOT_WAIT_SECONDS,
+                   app.METRIC_STITCH_SECONDS, app.METRIC_REQUEST_SECONDS):
+        assert metric.labelnames == app.METRIC_UPSTREAM_SECONDS.labelnames == ("voice", "mode")
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = app.MetricsRegistry()
+    histogram = registry.histogram("t_seconds", "Test.", ("voice",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, voice="a")
+    histogram.observe(0.5, voice="a")
+    histogram.observe(5, voice="a")
+    text = registry.render()
+    assert 't_seconds_bucket{voice="a",le="0.1"} 1' in text
+    assert 't_seconds_bucket{voice="a",le="1.0"} 2' in text
+    assert 't_seconds_bucket{voice="a",le="+Inf"} 3' in text
+    assert 't_seconds_count{voice="a"} 3' in text
+
+
+def test_slot_wait_is_labelled_by_voice():
+    async def take_slot():
+        scheduler = app.UpstreamScheduler(1)
+        session = scheduler.session(None, mode="test")
+        try:
+            async with session.slot(voice="xx-XX-TestNeural"):
+                pass
+        finally:
+            session.close()
+    asyncio.run(take_slot())
+    assert 'tts_slot_wait_seconds_count{voice="xx-XX-TestNeural",mode="test"} 1' in app.metrics.render()
@@ -0,0 +1,61 @@
+"""stitch_mp3_segments: frames are joined as-is, tags and header frames are dropped."""
+import io
+
+import pytest
+
+import app
+
+# MPEG-2 Layer III, 24 kHz mono, 48 kbps: the format edge-tts returns, 144 bytes per frame.
+HEADER = bytes([0xFF, 0xF3, 0x64, 0xC4])
+
+
+def frame(fill: int) -> bytes:
+    return HEADER + bytes([fill]) * 140
+
+
+def id3v2(payload: bytes) -> bytes:
+    size = len(payload)
+    return b"ID3\x04\x00\x00" + bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0)) + payload
+
+
+def xing_frame() -> bytes:
+    # The Xing tag sits after the side info: 4 header bytes + 9 for MPEG-2 mono.
+    data = bytearray(frame(0))
+    data[13:17] = b"Xing"
+    return bytes(data)
+
+
+def test_frames_are_joined_in_order():
+    assert app.stitch_mp3_segments([frame(1) + frame(2), frame(3)]) == frame(1) + frame(2) + frame(3)
+
+
+def test_tags_and_header_frames_are_dropped():
+    id3v1 = b"TAG" + bytes(125)
+    first = id3v2(b"TIT2 title") + xing_frame() + frame(1) + id3v1
+    second = id3v2(bytes(20)) + frame(2) + frame(3)
+    assert app.stitch_mp3_segments([first, second]) == frame(1) + frame(2) + frame(3)
+
+
+def test_garbage_and_truncated_frames_are_skipped():
+    segment = b"\x00junk" + frame(1) + frame(2)[:50]
+    assert app.stitch_mp3_segments([segment]) == frame(1)
+
+
+def test_empty_segments_are_skipped():
+    assert app.stitch_mp3_segments([b"", None, frame(1)]) == frame(1)
+    assert app.stitch_mp3_segments([]) == b""
+
+
+def test_write_mp3_segment_matches_stitching():
+    segments = [id3v2(b"x") + xing_frame() + frame(1), frame(2) + frame(3)[:10]]
+    out = io.BytesIO()
+    written = sum(app.write_mp3_segment(out, segment) for segment in segments)
+    assert out.getvalue() == app.stitch_mp3_segments(segments)
+    assert written == len(out.getvalue())
+
+
+def test_durations_add_up_to_the_stitched_output():
+    segments = [xing_frame() + frame(1), frame(2) + frame(3)]
+    total = sum(app.mp3_duration(segment) for segment in segments)
+    assert total == pytest.approx(app.mp3_duration(app.stitch_mp3_segments(segments)))
+    assert total == pytest.approx(3 * 576 / 24000)
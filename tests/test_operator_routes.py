@@ -0,0 +1,35 @@
+"""Operator endpoints (/metrics, /v1/debug/profile) are closed unless an API token is configured."""
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    # The app reloads config.json from the working directory before each request.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(app.config, "api_token", "")
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("path", ["/metrics", "/v1/debug/profile?seconds=0.1"])
+def test_operator_routes_do_not_exist_without_a_token(client, path):
+    assert client.get(path).status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/metrics", "/v1/debug/profile?seconds=0.1"])
+def test_operator_routes_require_the_configured_token(client, monkeypatch, path):
+    monkeypatch.setitem(app.config, "api_token", "secret")
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 403
+
+
+def test_profile_parameters_are_clamped(client, monkeypatch):
+    monkeypatch.setitem(app.config, "api_token", "secret")
+    headers = {"Authorization": "Bearer secret"}
+    response = client.get("/v1/debug/profile?seconds=0&interval_ms=0&format=json", headers=headers)
+    assert response.status_code == 200
+    profile = response.get_json()
+    assert app.PROFILE_MIN_SECONDS <= profile["seconds"] < 1
+    assert profile["interval"] == app.PROFILE_MIN_INTERVAL
+    assert client.get("/v1/debug/profile?seconds=nan", headers=headers).status_code == 400
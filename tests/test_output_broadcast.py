@@ -0,0 +1,49 @@
+"""OutputBroadcast completes and runs on_finish exactly once, however its pump ends."""
+import threading
+import time
+
+import app
+
+
+def _pieces(started):
+    async def agen():
+        started.set()
+        for piece in (b"a", b"b", b"c"):
+            yield piece
+    return agen()
+
+
+def test_pump_publishes_and_finishes_once():
+    finished = []
+    started = threading.Event()
+    broadcast = app.OutputBroadcast()
+    broadcast.start(_pieces(started), lambda: finished.append(True))
+    broadcast.done.result(timeout=5)
+    time.sleep(0.05)
+    assert b"".join(broadcast.iter_blocks()) == b"abc"
+    assert finished == [True]
+    assert broadcast.exception is None
+
+
+def test_cancel_before_the_pump_starts_still_finishes():
+    finished = threading.Event()
+    started = threading.Event()
+    release = threading.Event()
+    # Keep STREAM_LOOP busy so the pump cannot start before it is cancelled.
+    app.STREAM_LOOP.call_soon_threadsafe(release.wait, 5)
+    try:
+        broadcast = app.OutputBroadcast()
+        broadcast.start(_pieces(started), finished.set)
+        broadcast.cancel()
+    finally:
+        release.set()
+    assert finished.wait(5)
+    assert broadcast.done.done()
+    assert not started.is_set()
+
+
+def test_done_is_set_only_once():
+    broadcast = app.OutputBroadcast()
+    broadcast.fail("Rejected.", 429)
+    broadcast.publish(app.AudioSpool(1024))
+    assert broadcast.error == ("Rejected.", 429)
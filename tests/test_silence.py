@@ -0,0 +1,27 @@
+"""generate_silence_bytes: silence is built from whole frames of the edge-tts format."""
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("duration", [0.2, 0.5, 1.0, 3.0])
+def test_silence_lasts_the_requested_duration(duration):
+    silence = app.generate_silence_bytes(duration)
+    assert app.mp3_duration(silence) == pytest.approx(duration, abs=app._SILENT_MP3_FRAME_SECONDS / 2)
+
+
+def test_silence_is_whole_valid_frames():
+    silence = app.generate_silence_bytes()
+    frames, end = app.scan_mp3_frames(silence)
+    assert end == len(silence)
+    assert [(stop - start) for start, stop, _ in frames] == [len(app._SILENT_MP3_FRAME)] * len(frames)
+    assert app.parse_mp3_frame_header(silence, 0) == app.parse_mp3_frame_header(app._SILENT_MP3_FRAME, 0)
+
+
+def test_at_least_one_frame():
+    assert app.generate_silence_bytes(0) == app._SILENT_MP3_FRAME
+
+
+def test_silence_survives_stitching():
+    silence = app.generate_silence_bytes(0.1)
+    assert app.stitch_mp3_segments([silence, silence]) == silence * 2
@@ -0,0 +1,78 @@
+"""WordTimeline and format_subtitles: word timings placed on the stitched audio and rendered as cues."""
+import pytest
+
+import app
+
+TICKS = 10_000_000
+
+
+def words(*entries):
+    """``(start_seconds, duration_seconds, text)`` -> WordBoundary timings in ticks."""
+    return [[int(start * TICKS), int(duration * TICKS), text] for start, duration, text in entries]
+
+
+def test_chunks_are_placed_after_the_audio_before_them():
+    audio = app.generate_silence_bytes(1.0)
+    offset = app.mp3_duration(audio)
+    timeline = app.WordTimeline()
+    # Added out of order: chunk 1 waits for chunk 0.
+    timeline.add(1, "Second.", audio, words((0.1, 0.2, "Second")))
+    assert timeline.words == []
+    timeline.add(0, "First.", audio, words((0.0, 0.3, "First")))
+    assert timeline.result() == {"words": [
+        {"text": "First", "start": 0.0, "end": 0.3},
+        {"text": "Second", "start": round(offset + 0.1, 3), "end": round(offset + 0.3, 3)},
+    ]}
+
+
+def test_tempo_scales_times():
+    timeline = app.WordTimeline(tempo=2.0)
+    timeline.add(0, "Hi.", app.generate_silence_bytes(1.0), words((0.5, 0.5, "Hi")))
+    assert timeline.words == [{"text": "Hi", "start": 0.25, "end": 0.5}]
+
+
+def test_cues_end_at_sentences_and_keep_punctuation():
+    timeline = app.WordTimeline("srt")
+    text = "Hello, world! How are you?"
+    timeline.add(0, text, None, words(
+        (0.0, 0.4, "Hello"), (0.5, 0.4, "world"), (1.0, 0.2, "How"), (1.3, 0.2, "are"), (1.6, 0.3, "you")))
+    assert [cue[2] for cue in timeline.cues] == ["Hello, world!", "How are you?"]
+    assert timeline.cues[1][:2] == (1.0, pytest.approx(1.9))
+
+
+def test_long_cues_are_split():
+    text = " ".join(f"word{i}" for i in range(20))
+    timeline = app.WordTimeline("vtt")
+    timeline.add(0, text, None, words(*((i * 0.5, 0.4, f"word{i}") for i in range(20))))
+    assert len(timeline.cues) > 1
+    assert all(len(cue[2]) <= app.SUBTITLE_CUE_MAX_CHARS for cue in timeline.cues)
+    assert " ".join(cue[2] for cue in timeline.cues) == text
+
+
+def test_take_event_hands_out_each_word_once():
+    timeline = app.WordTimeline("srt")
+    assert timeline.take_event() is None
+    timeline.add(0, "One.", None, words((0.0, 0.5, "One")))
+    first = timeline.take_event()
+    timeline.add(1, "Two.", None, words((0.0, 0.5, "Two")))
+    second = timeline.take_event()
+    assert [w["text"] for w in first["words"]] == ["One"]
+    assert [w["text"] for w in second["words"]] == ["Two"]
+    # Fragments continue the numbering.
+    assert second["subtitles"].startswith("2\n")
+    assert timeline.take_event() is None
+
+
+def test_format_srt():
+    cues = [(0.0, 1.5, "Hello."), (3661.25, 3662.0, "Later.")]
+    assert app.format_subtitles(cues, "srt") == (
+        "1\n00:00:00,000 --> 00:00:01,500\nHello.\n\n"
+        "2\n01:01:01,250 --> 01:01:02,000\nLater.\n\n"
+    )
+
+
+def test_format_vtt_header_only_at_the_start():
+    cues = [(0.0, 1.0, "Hi.")]
+    assert app.format_subtitles(cues, "vtt") == "WEBVTT\n\n00:00:00.000 --> 00:00:01.000\nHi.\n\n"
+    assert app.format_subtitles(cues, "vtt", first_number=3) == "00:00:00.000 --> 00:00:01.000\nHi.\n\n"
+    assert app.format_subtitles([], "srt") == ""
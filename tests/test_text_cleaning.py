@@ -0,0 +1,44 @@
+"""pre_process_text against golden outputs of the original pass-by-pass cleaning.
+
+The fixtures in golden/cleaning.json were produced by the baseline
+implementation (see golden/generate_cleaning.py).
+"""
+import json
+import os
+import re
+
+import pytest
+
+import app
+
+with open(os.path.join(os.path.dirname(__file__), "golden", "cleaning.json"), encoding="utf-8") as f:
+    GOLDEN = json.load(f)
+
+
+def test_keyword_sets_cover_both_matchers():
+    counts = {name: len([k for k in keywords.split(",") if k.strip()])
+              for name, keywords in GOLDEN["keyword_sets"].items()}
+    assert 0 < counts["small"] < app.AHO_CORASICK_MIN_KEYWORDS <= counts["large"]
+
+
+@pytest.mark.parametrize("keyword_set", ["none", "small", "large"])
+def test_pre_process_text_matches_baseline(keyword_set):
+    keywords = GOLDEN["keyword_sets"][keyword_set]
+    mismatches = []
+    for case in GOLDEN["cases"]:
+        if case["keywords"] != keyword_set:
+            continue
+        text = GOLDEN["texts"][case["text"]]
+        options = dict(case["options"], custom_keywords=keywords)
+        actual = app.pre_process_text(text, options)
+        if actual != case["expected"]:
+            mismatches.append((text, case["options"], case["expected"], actual))
+    assert not mismatches, f"{len(mismatches)} mismatches, first: {mismatches[0]!r}"
+
+
+def test_keyword_automaton_matches_regex_alternation():
+    keywords = [k.strip() for k in GOLDEN["keyword_sets"]["large"].split(",") if k.strip()]
+    automaton = app.KeywordAutomaton(keywords)
+    pattern = re.compile("|".join(map(re.escape, keywords)))
+    for text in GOLDEN["texts"]:
+        assert automaton.remove(text) == pattern.sub("", text)
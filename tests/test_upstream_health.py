@@ -0,0 +1,89 @@
+"""UpstreamHealth: closed -> open -> half-open -> closed/open transitions of the circuit breaker."""
+import pytest
+
+import app
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(app.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def health(clock):
+    return app.UpstreamHealth(app.UpstreamScheduler(4), window=30, min_samples=4,
+                              failure_threshold=0.5, cooldown=5, max_cooldown=15)
+
+
+def trip(health):
+    for _ in range(health.min_samples):
+        health.record_failure()
+
+
+def test_breaker_needs_enough_samples_and_failures(health):
+    for _ in range(3):
+        health.record_failure()
+    assert health.state == health.CLOSED
+    for _ in range(4):
+        health.record_success()
+    health.record_failure()
+    # 4 failures out of 8 samples reach the 50% threshold.
+    assert health.state == health.OPEN
+    assert health.trips == 1
+
+
+def test_old_outcomes_leave_the_window(health, clock):
+    for _ in range(3):
+        health.record_failure()
+    clock.now += 31
+    health.record_failure()
+    assert health.state == health.CLOSED
+    assert health.stats()["window_samples"] == 1
+
+
+def test_open_breaker_rejects_and_throttles(health, clock):
+    trip(health)
+    assert health.is_open()
+    with pytest.raises(app.UpstreamUnavailableError):
+        health.check()
+    assert health.retry_after() == 5
+    assert health.scheduler.effective_limit() == 1
+    clock.now += 2
+    assert health.backoff(0) >= 3
+
+
+def test_successful_probe_closes_the_breaker(health, clock):
+    trip(health)
+    clock.now += 5
+    assert not health.is_open()
+    assert health.state == health.HALF_OPEN
+    health.check()
+    health.record_success()
+    assert health.state == health.CLOSED
+    assert health.scheduler.effective_limit() == 4
+    assert health.stats()["window_samples"] == 0
+
+
+def test_failed_probe_reopens_with_a_longer_cooldown(health, clock):
+    trip(health)
+    for cooldown in (10, 15, 15):
+        clock.now += health.cooldown
+        assert health.stats()["state"] == health.HALF_OPEN
+        health.record_failure()
+        assert health.state == health.OPEN
+        assert health.cooldown == cooldown
+    assert health.trips == 4
+    clock.now += 15
+    health.is_open()
+    health.record_success()
+    assert health.state == health.CLOSED and health.cooldown == 5
@@ -0,0 +1,126 @@
+"""UpstreamConnectionPool against a stand-in for the Edge TTS websocket service."""
+import asyncio
+import json
+import re
+
+import pytest
+from aiohttp import web
+
+import app
+
+# One MPEG-2 Layer III frame in the format the service returns.
+FRAME = bytes([0xFF, 0xF3, 0x64, 0xC4]) + bytes(140)
+
+
+class StandInService:
+    """Answers every SSML turn with one WordBoundary per word and one audio frame per word."""
+
+    def __init__(self, close_after_turn: bool = False):
+        self.close_after_turn = close_after_turn
+        self.connections = 0
+        self.configs = 0
+        self.ssml = []
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        async for msg in ws:
+            head, _, body = msg.data.partition("\r\n\r\n")
+            if "Path:speech.config" in head:
+                self.configs += 1
+                continue
+            self.ssml.append(body)
+            words = re.search(r"<prosody[^>]*>(.*)</prosody>", body, re.S).group(1).split()
+            await ws.send_str("X-RequestId:0\r\nPath:turn.start\r\n\r\n{}")
+            metadata = [
+                {"Type": "WordBoundary", "Data": {"Offset": i * 1000, "Duration": 900, "text": {"Text": word}}}
+                for i, word in enumerate(words)
+            ]
+            await ws.send_str("X-RequestId:0\r\nPath:audio.metadata\r\n\r\n" + json.dumps({"Metadata": metadata}))
+            header = b"X-RequestId:0\r\nContent-Type:audio/mpeg\r\nPath:audio"
+            await ws.send_bytes(len(header).to_bytes(2, "big") + header + FRAME * len(words))
+            await ws.send_str("X-RequestId:0\r\nPath:turn.end\r\n\r\n{}")
+            if self.close_after_turn:
+                await ws.close()
+        return ws
+
+
+def run_with_service(test, **options):
+    async def main():
+        service = StandInService(**options)
+        server = web.Application()
+        server.router.add_get("/ws", service.handle)
+        runner = web.AppRunner(server)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        pool = app.UpstreamConnectionPool(asyncio.get_running_loop(), app.UpstreamScheduler(4))
+        pool._connect_url = lambda: f"http://127.0.0.1:{port}/ws"
+        try:
+            return await test(pool, service)
+        finally:
+            await pool.close()
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_turn_uses_edge_voice_form_and_escapes_text():
+    async def test(pool, service):
+        audio, words = await pool.synthesize("Tom & Jerry <3", "zh-CN-shaanxi-XiaoniNeural", "+10%")
+        assert len(service.ssml) == 1
+        ssml = service.ssml[0]
+        assert "<voice name='Microsoft Server Speech Text to Speech Voice (zh-CN-shaanxi, XiaoniNeural)'>" in ssml
+        assert "rate='+10%'" in ssml
+        assert "Tom &amp; Jerry &lt;3" in ssml
+        assert audio == FRAME * 4
+        assert [w[2] for w in words] == ["Tom", "&", "Jerry", "<3"]
+    run_with_service(test)
+
+
+def test_connection_is_reused_across_turns():
+    async def test(pool, service):
+        await pool.synthesize("First chunk.", "en-US-AriaNeural")
+        await pool.synthesize("Second chunk.", "en-US-AriaNeural")
+        assert service.connections == 1
+        assert service.configs == 1
+        assert (pool.opened, pool.reused) == (1, 1)
+    run_with_service(test)
+
+
+def test_connection_dropped_while_idle_is_replaced():
+    async def test(pool, service):
+        await pool.synthesize("First chunk.", "en-US-AriaNeural")
+        await asyncio.sleep(0.1)
+        audio, _ = await pool.synthesize("Second chunk.", "en-US-AriaNeural")
+        assert audio == FRAME * 2
+        assert service.connections == 2
+        assert pool.evicted >= 1
+    run_with_service(test, close_after_turn=True)
+
+
+def test_long_text_is_split_and_word_offsets_continue():
+    async def test(pool, service):
+        text = " ".join(["word"] * 1200)
+        audio, words = await pool.synthesize(text, "en-US-AriaNeural")
+        assert len(service.ssml) > 1
+        assert audio == FRAME * 1200
+        offsets = [w[0] for w in words]
+        assert offsets == sorted(offsets)
+    run_with_service(test)
+
+
+@pytest.mark.parametrize("voice", ["en-US-Aria'Neural", "Microsoft Server Speech Text to Speech Voice (en-US, A'>)"])
+def test_unsafe_voice_names_are_rejected(voice):
+    async def test(pool, service):
+        with pytest.raises(ValueError):
+            await pool.synthesize("Hello.", voice)
+        assert service.ssml == []
+    run_with_service(test)
+
+
+def test_empty_catalog_only_accepts_well_formed_names():
+    catalog = app.VoiceCatalog()
+    assert catalog.resolve("zh-CN-XiaoxiaoNeural") == "zh-CN-XiaoxiaoNeural"
+    assert catalog.resolve("x'><evil/>") is None
@@ -0,0 +1,91 @@
+"""UpstreamScheduler: round-robin slots across requests, priority waiters, caps and cancellation."""
+import asyncio
+
+import app
+
+
+async def grant_order(scheduler, waiters):
+    """Queue ``(session, priority)`` waiters behind a held slot; return the order they are served in."""
+    holder = scheduler.session()
+    await scheduler.acquire(holder.request_id)
+    order = []
+
+    async def wait(name, session, priority):
+        async with session.slot(priority=priority):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    tasks = [asyncio.ensure_future(wait(name, session, priority)) for name, session, priority in waiters]
+    await asyncio.sleep(0)
+    scheduler.release(holder.request_id)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_slots_are_shared_round_robin():
+    async def scenario():
+        scheduler = app.UpstreamScheduler(1)
+        long, short = scheduler.session(), scheduler.session()
+        waiters = [("long1", long, False), ("long2", long, False), ("long3", long, False), ("short", short, False)]
+        return await grant_order(scheduler, waiters)
+    assert asyncio.run(scenario()) == ["long1", "short", "long2", "long3"]
+
+
+def test_priority_waiters_are_served_first():
+    async def scenario():
+        scheduler = app.UpstreamScheduler(1)
+        full, stream = scheduler.session(), scheduler.session(mode="stream")
+        return await grant_order(scheduler, [("full", full, False), ("stream", stream, True)])
+    assert asyncio.run(scenario()) == ["stream", "full"]
+
+
+def test_session_cap_lowers_its_share():
+    async def scenario():
+        scheduler = app.UpstreamScheduler(4)
+        session = scheduler.session(cap=2)
+        peak = 0
+
+        async def chunk():
+            nonlocal peak
+            async with session.slot():
+                peak = max(peak, scheduler.active)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(chunk() for _ in range(6)))
+        session.close()
+        return peak, scheduler.stats()
+    peak, stats = asyncio.run(scenario())
+    assert peak == 2
+    assert stats["active"] == 0 and stats["open_sessions"] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = app.UpstreamScheduler(1)
+        holder, other = scheduler.session(), scheduler.session()
+        await scheduler.acquire(holder.request_id)
+        waiter = asyncio.ensure_future(scheduler.acquire(other.request_id))
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth() == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        depth = scheduler.queue_depth()
+        scheduler.release(holder.request_id)
+        return depth, scheduler.active
+    assert asyncio.run(scenario()) == (0, 0)
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_returned():
+    async def scenario():
+        scheduler = app.UpstreamScheduler(1)
+        holder, other = scheduler.session(), scheduler.session()
+        await scheduler.acquire(holder.request_id)
+        waiter = asyncio.ensure_future(scheduler.acquire(other.request_id))
+        await asyncio.sleep(0)
+        # The release grants the slot; the waiter is cancelled before it wakes.
+        scheduler.release(holder.request_id)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await asyncio.sleep(0)
+        return scheduler.active
+    assert asyncio.run(scenario()) == 0
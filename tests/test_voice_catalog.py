@@ -0,0 +1,49 @@
+"""VoiceCatalog: case-insensitive resolution and precomputed locale/gender listings."""
+import json
+
+import pytest
+
+import app
+
+VOICES = [
+    {"name": "en-US-AriaNeural", "gender": "Female", "locale": "en-US", "short_name": "AriaNeural"},
+    {"name": "en-US-GuyNeural", "gender": "Male", "locale": "en-US", "short_name": "GuyNeural"},
+    {"name": "zh-CN-XiaoxiaoNeural", "gender": "Female", "locale": "zh-CN", "short_name": "XiaoxiaoNeural"},
+]
+
+
+@pytest.fixture
+def catalog():
+    return app.VoiceCatalog(VOICES)
+
+
+@pytest.mark.parametrize("name", ["en-US-AriaNeural", "EN-us-arianeural", "en-us-ARIANEURAL"])
+def test_resolve_returns_the_canonical_spelling(catalog, name):
+    assert catalog.resolve(name) == "en-US-AriaNeural"
+
+
+@pytest.mark.parametrize("name", ["en-US-Nobody", "", "Aria", None, 42])
+def test_resolve_rejects_unknown_voices(catalog, name):
+    assert catalog.resolve(name) is None
+
+
+def test_empty_catalog_accepts_well_formed_names():
+    catalog = app.VoiceCatalog()
+    assert catalog.resolve("xx-YY-AnyNeural") == "xx-YY-AnyNeural"
+    assert catalog.resolve("Microsoft Server Speech Text to Speech Voice (en-US, AriaNeural)") is not None
+    assert catalog.resolve("en-US-Aria'/><voice") is None
+
+
+def test_filters(catalog):
+    assert [v["name"] for v in catalog.filter("EN-US", "female")] == ["en-US-AriaNeural"]
+    assert len(catalog.filter(gender="Female")) == 2
+    assert len(catalog.filter()) == 3
+    assert catalog.filter("fr-FR") == []
+
+
+def test_listing_is_rendered_once(catalog):
+    with app.app.app_context():
+        body, etag = catalog.listing("en-US")
+        assert catalog.listing("en-us") == (body, etag)
+        assert [v["name"] for v in json.loads(body)] == ["en-US-AriaNeural", "en-US-GuyNeural"]
+        assert catalog.listing("zh-CN")[1] != etag